@@ -1,18 +1,22 @@
-import pdfplumber
 import pandas as pd
-import sqlite3
 import re
-from datetime import datetime
+import numpy as np
+import os
+import sys
 
-def clean_amount(amount_str):
-    if pd.isna(amount_str) or amount_str == '':
-        return 0.0
-    try:
-        # Remove currency symbol, commas, and spaces
-        amount_str = re.sub(r'[^\d.-]', '', amount_str)
-        return abs(float(amount_str))  # Return absolute value
-    except:
-        return 0.0
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from ledger import amounts
+from ledger import anomaly
+from ledger import atomic
+from ledger import categorize
+from ledger import cycles
+from ledger import dates
+from ledger import instrument
+from ledger import ordering
+from ledger import pagecache
+from ledger import pdfresources
+from ledger import recurring
+from ledger import storage
 
 def determine_transaction_type(details, amount_str):
     """
@@ -45,138 +49,148 @@ def extract_transactions_from_pdf(pdf_path):
     current_date = None
     
     try:
-        with pdfplumber.open(pdf_path) as pdf:
+        with instrument.stage('open'):
+            pdf = pdfresources.open_pdf(pdf_path)
+        with pdf:
             print(f"Processing PDF with {len(pdf.pages)} pages")
             
             for page_num, page in enumerate(pdf.pages, 1):
-                text = page.extract_text()
+                with instrument.stage('page_extract', page=page_num):
+                    text = pagecache.page_text(page)
+                instrument.count('pages')
                 lines = text.split('\n')
                 
-                for line in lines:
-                    if not line.strip():
-                        continue
+                with instrument.stage('parse', page=page_num):
+                    for line in lines:
+                        if not line.strip():
+                            continue
                         
-                    # Updated pattern to better match date and amount
-                    date_pattern = r'(\d{2}-\d{2}-\d{4})\s+(.+?)\s+([\d,]+\.\d{2}(?:\s*(?:CR|DR))?)'
-                    match = re.search(date_pattern, line)
+                        # Updated pattern to better match date and amount
+                        date_pattern = r'(\d{2}-\d{2}-\d{4})\s+(.+?)\s+([\d,]+\.\d{2}(?:\s*(?:CR|DR))?)'
+                        match = re.search(date_pattern, line)
                     
-                    if match:
-                        try:
-                            date_str, details, amount_str = match.groups()
-                            
-                            # Convert date
-                            date_obj = datetime.strptime(date_str, '%d-%m-%Y')
-                            formatted_date = date_obj.strftime('%d-%b-%y')
+                        if not match:
+                            instrument.reject('no_match')
+                        else:
+                            try:
+                                date_str, details, amount_str = match.groups()
                             
-                            # Clean amount
-                            amount = clean_amount(amount_str)
+                                # Determine transaction type
+                                sign = determine_transaction_type(details, amount_str)
                             
-                            # Determine transaction type
-                            sign = determine_transaction_type(details, amount_str)
+                                transaction = {
+                                    'Date': date_str,  # dates and amounts are parsed for the whole statement below
+                                    'TransactionDetails': details.strip(),
+                                    'Amount': amount_str,
+                                    'BillingAmountSign': sign
+                                }
                             
-                            transaction = {
-                                'Date': formatted_date,
-                                'TransactionDetails': details.strip(),
-                                'Amount': amount,
-                                'BillingAmountSign': sign,
-                                '_date_obj': date_obj  # Temporary field for sorting
-                            }
+                                transactions.append(transaction)
+                                instrument.echo(f"Processed: {date_str} | {details.strip()} | {amount_str} | {sign}")
                             
-                            transactions.append(transaction)
-                            print(f"Processed: {formatted_date} | {details.strip()} | {amount} | {sign}")
-                            
-                        except Exception as e:
-                            print(f"Error processing line: {line}")
-                            print(f"Error details: {str(e)}")
-                            continue
+                            except Exception as e:
+                                instrument.reject('parse_error', f"{line} ({e})")
+                                continue
     
     except Exception as e:
         print(f"Error processing PDF: {str(e)}")
         raise
 
-    # Sort transactions by date
-    transactions.sort(key=lambda x: x['_date_obj'])
+    # Dates parsed and reformatted once for the whole statement; rows whose date is not a real day are dropped
+    raw_dates = [trans['Date'] for trans in transactions]
+    parsed_dates = dates.to_datetime64(raw_dates)
+    formatted_dates = dates.format_dates(raw_dates, '%d-%b-%y').to_numpy()
+    instrument.reject('bad_date', n=int(np.isnat(parsed_dates).sum()))
+    # Sort transactions by date (stable, so same-day rows keep their statement order)
+    order = [i for i in np.argsort(parsed_dates, kind='stable') if not np.isnat(parsed_dates[i])]
+    parsed_amounts = amounts.to_rupees([trans['Amount'] for trans in transactions], absolute=True)
     
-    # Add SrNo and remove temporary date object
+    # Add SrNo
     final_transactions = []
-    for i, trans in enumerate(transactions, 1):
-        del trans['_date_obj']
+    for i, index in enumerate(order, 1):
+        trans, amount = transactions[index], parsed_amounts[index]
         final_trans = {
             'SrNo': i,
-            'Date': trans['Date'],
+            'Date': formatted_dates[index],
             'TransactionDetails': trans['TransactionDetails'],
-            'Amount': trans['Amount'],
+            'Amount': float(amount),
             'BillingAmountSign': trans['BillingAmountSign']
         }
         final_transactions.append(final_trans)
     
+    instrument.count('rows', len(final_transactions))
+    
     # Print detailed transaction list for verification
-    print("\nDetailed Transaction List:")
-    print("-" * 80)
-    for trans in final_transactions:
-        print(f"#{trans['SrNo']:02d} | {trans['Date']} | {trans['TransactionDetails'][:40]:40} | {trans['Amount']:10.2f} | {trans['BillingAmountSign']}")
-    print("-" * 80)
+    if not instrument.is_quiet():
+        print("\nDetailed Transaction List:")
+        print("-" * 80)
+        for trans in final_transactions:
+            print(f"#{trans['SrNo']:02d} | {trans['Date']} | {trans['TransactionDetails'][:40]:40} | {trans['Amount']:10.2f} | {trans['BillingAmountSign']}")
+        print("-" * 80)
     
     return final_transactions
 
-def create_database(transactions, db_path):
+def create_database(transactions, db_path, statement=None):
     # Create DataFrame
     df = pd.DataFrame(transactions)
     
     # Ensure columns are in correct order
-    columns = ['SrNo', 'Date', 'TransactionDetails', 'Amount', 'BillingAmountSign']
+    amounts.add_paise_column(df)
+    # Every row belongs to this statement's billing cycle
+    cycle = cycles.statement_cycle(df, statement, 'Date')
+    cycles.tag_rows(df, cycle)
+    columns = ['SrNo', 'Date', 'TransactionDetails', 'Amount', 'AmountPaise', 'BillingAmountSign', 'StatementDate']
     df = df[columns]
     
-    # Connect to SQLite database
-    conn = sqlite3.connect(db_path)
-    
+    # Built in a temp file that replaces db_path only once complete, so a crash keeps the old database
     try:
-        # Create table with proper schema
-        create_table_sql = '''
-        CREATE TABLE IF NOT EXISTS transactions (
-            SrNo INTEGER PRIMARY KEY,
-            Date TEXT NOT NULL,
-            TransactionDetails TEXT NOT NULL,
-            Amount REAL NOT NULL,
-            BillingAmountSign TEXT NOT NULL
-        )
-        '''
-        conn.execute(create_table_sql)
-        
-        # Clear existing data
-        conn.execute('DELETE FROM transactions')
-        
-        # Insert data
-        df.to_sql('transactions', conn, if_exists='replace', index=False)
+        with atomic.rebuild(db_path) as conn:
+            # Create table with proper schema
+            create_table_sql = '''
+            CREATE TABLE IF NOT EXISTS transactions (
+                SrNo INTEGER PRIMARY KEY,
+                Date TEXT NOT NULL,
+                TransactionDetails TEXT NOT NULL,
+                Amount REAL NOT NULL,
+                AmountPaise INTEGER NOT NULL,
+                BillingAmountSign TEXT NOT NULL,
+                StatementDate TEXT
+            )
+            '''
+            conn.execute(create_table_sql)
         
-        # Verify data
-        print("\nVerifying database contents:")
-        cursor = conn.cursor()
+            # Insert data
+            df.to_sql('transactions', conn, if_exists='replace', index=False)
+            ordering.ensure_order_columns(conn)
+            categorize.recategorize(conn)
+            recurring.update_recurring(conn)
+            anomaly.ensure_anomalies(conn)
+            cycles.record_cycle(conn, cycle)
         
-        # Check first few records
-        print("\nFirst 5 records:")
-        cursor.execute("""
-            SELECT SrNo, Date, TransactionDetails, Amount, BillingAmountSign 
-            FROM transactions 
-            ORDER BY SrNo 
-            LIMIT 5
-        """)
-        for row in cursor.fetchall():
-            print(row)
+            # Verify data
+            print("\nVerifying database contents:")
+            cursor = conn.cursor()
         
-        # Check transaction types
-        cursor.execute("SELECT BillingAmountSign, COUNT(*) FROM transactions GROUP BY BillingAmountSign")
-        print("\nTransaction type summary:")
-        for sign, count in cursor.fetchall():
-            print(f"{sign}: {count} transactions")
+            # Check first few records
+            print("\nFirst 5 records:")
+            cursor.execute("""
+                SELECT SrNo, Date, TransactionDetails, Amount, BillingAmountSign 
+                FROM transactions 
+                ORDER BY SrNo 
+                LIMIT 5
+            """)
+            for row in cursor.fetchall():
+                print(row)
         
-        conn.commit()
+            # Check transaction types
+            cursor.execute("SELECT BillingAmountSign, COUNT(*) FROM transactions GROUP BY BillingAmountSign")
+            print("\nTransaction type summary:")
+            for sign, count in cursor.fetchall():
+                print(f"{sign}: {count} transactions")
         
     except Exception as e:
         print(f"Error creating database: {e}")
         raise
-    finally:
-        conn.close()
 
 def main():
     pdf_path = r'C:\Users\seren\OneDrive\Desktop\PythonTransaction\DBS_Card_Statement.pdf'
@@ -191,13 +205,13 @@ def main():
     
     print(f"Found {len(transactions)} transactions")
     print("Creating database...")
-    create_database(transactions, db_path)
+    create_database(transactions, db_path, cycles.read_statement(pdf_path))
     
     print(f"Processed {len(transactions)} transactions successfully!")
     
     # Display sample data
     try:
-        conn = sqlite3.connect(db_path)
+        conn = storage.connect(db_path)
         print("\nFirst 5 transactions:")
         df = pd.read_sql_query("SELECT * FROM transactions ORDER BY TransactionDate LIMIT 5", conn)
         print(df)
@@ -210,6 +224,5 @@ def main():
         print(f"Error displaying sample data: {e}")
 
 if __name__ == "__main__":
-    main()
-
-
+    with instrument.session():
+        main()
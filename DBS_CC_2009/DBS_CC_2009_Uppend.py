@@ -1,18 +1,27 @@
-import pdfplumber
 import pandas as pd
-import sqlite3
 import re
-from datetime import datetime
+import numpy as np
+import os
+import sys
 
-def clean_amount(amount_str):
-    if pd.isna(amount_str) or amount_str == '':
-        return 0.0
-    try:
-        # Remove currency symbol, commas, and spaces
-        amount_str = re.sub(r'[^\d.-]', '', amount_str)
-        return abs(float(amount_str))  # Return absolute value
-    except:
-        return 0.0
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from ledger import amounts
+from ledger import anomaly
+from ledger import atomic
+from ledger import categorize
+from ledger import changefeed
+from ledger import cycles
+from ledger import dates
+from ledger import dedup
+from ledger import instrument
+from ledger import ordering
+from ledger import pagecache
+from ledger import pdfresources
+from ledger import recurring
+from ledger import storage
+
+# Existing database path
+DB_PATH = r"C:\Users\seren\OneDrive\Desktop\PythonTransaction\DBS_Card_Statementn2.db"
 
 def determine_transaction_type(details, amount_str):
     """
@@ -40,187 +49,230 @@ def determine_transaction_type(details, amount_str):
     # For credit card statements, most transactions are debits (purchases)
     return 'Dr'
 
-def extract_transactions_from_pdf(pdf_path):
+def extract_transactions_from_pdf(pdf_path, statement=None):
+    """Parse the statement's rows; a statement dict is filled with its header fields on the way"""
     transactions = []
     current_date = None
     
     try:
-        with pdfplumber.open(pdf_path) as pdf:
+        with instrument.stage('open'):
+            pdf = pdfresources.open_pdf(pdf_path)
+        with pdf:
             print(f"Processing PDF with {len(pdf.pages)} pages")
             
             for page_num, page in enumerate(pdf.pages, 1):
-                text = page.extract_text()
+                with instrument.stage('page_extract', page=page_num):
+                    text = pagecache.page_text(page)
+                instrument.count('pages')
+                if statement is not None and page_num <= cycles.HEADER_PAGES:
+                    cycles.parse_summary(text, statement)
                 lines = text.split('\n')
                 
-                for line in lines:
-                    if not line.strip():
-                        continue
+                with instrument.stage('parse', page=page_num):
+                    for line in lines:
+                        if not line.strip():
+                            continue
                         
-                    # Updated pattern to better match date and amount
-                    date_pattern = r'(\d{2}-\d{2}-\d{4})\s+(.+?)\s+([\d,]+\.\d{2}(?:\s*(?:CR|DR))?)'
-                    match = re.search(date_pattern, line)
+                        # Updated pattern to better match date and amount
+                        date_pattern = r'(\d{2}-\d{2}-\d{4})\s+(.+?)\s+([\d,]+\.\d{2}(?:\s*(?:CR|DR))?)'
+                        match = re.search(date_pattern, line)
                     
-                    if match:
-                        try:
-                            date_str, details, amount_str = match.groups()
-                            
-                            # Convert date
-                            date_obj = datetime.strptime(date_str, '%d-%m-%Y')
-                            formatted_date = date_obj.strftime('%d-%b-%y')
-                            
-                            # Clean amount
-                            amount = clean_amount(amount_str)
+                        if not match:
+                            instrument.reject('no_match')
+                        else:
+                            try:
+                                date_str, details, amount_str = match.groups()
                             
-                            # Determine transaction type
-                            sign = determine_transaction_type(details, amount_str)
+                                # Determine transaction type
+                                sign = determine_transaction_type(details, amount_str)
                             
-                            transaction = {
-                                'Date': formatted_date,
-                                'TransactionDetails': details.strip(),
-                                'Amount': amount,
-                                'BillingAmountSign': sign,
-                                '_date_obj': date_obj  # Temporary field for sorting
-                            }
+                                transaction = {
+                                    'Date': date_str,  # dates and amounts are parsed for the whole statement below
+                                    'TransactionDetails': details.strip(),
+                                    'Amount': amount_str,
+                                    'BillingAmountSign': sign
+                                }
                             
-                            transactions.append(transaction)
-                            print(f"Processed: {formatted_date} | {details.strip()} | {amount} | {sign}")
+                                transactions.append(transaction)
+                                instrument.echo(f"Processed: {date_str} | {details.strip()} | {amount_str} | {sign}")
                             
-                        except Exception as e:
-                            print(f"Error processing line: {line}")
-                            print(f"Error details: {str(e)}")
-                            continue
+                            except Exception as e:
+                                instrument.reject('parse_error', f"{line} ({e})")
+                                continue
     
     except Exception as e:
         print(f"Error processing PDF: {str(e)}")
         raise
 
-    # Sort transactions by date
-    transactions.sort(key=lambda x: x['_date_obj'])
+    # Dates parsed and reformatted once for the whole statement; rows whose date is not a real day are dropped
+    raw_dates = [trans['Date'] for trans in transactions]
+    parsed_dates = dates.to_datetime64(raw_dates)
+    formatted_dates = dates.format_dates(raw_dates, '%d-%b-%y').to_numpy()
+    instrument.reject('bad_date', n=int(np.isnat(parsed_dates).sum()))
+    # Sort transactions by date (stable, so same-day rows keep their statement order)
+    order = [i for i in np.argsort(parsed_dates, kind='stable') if not np.isnat(parsed_dates[i])]
+    parsed_amounts = amounts.to_rupees([trans['Amount'] for trans in transactions], absolute=True)
     
-    # Add SrNo and remove temporary date object
+    # Add SrNo
     final_transactions = []
-    for i, trans in enumerate(transactions, 1):
-        del trans['_date_obj']
+    for i, index in enumerate(order, 1):
+        trans, amount = transactions[index], parsed_amounts[index]
         final_trans = {
             'SrNo': i,
-            'Date': trans['Date'],
+            'Date': formatted_dates[index],
             'TransactionDetails': trans['TransactionDetails'],
-            'Amount': trans['Amount'],
+            'Amount': float(amount),
             'BillingAmountSign': trans['BillingAmountSign']
         }
         final_transactions.append(final_trans)
     
+    instrument.count('rows', len(final_transactions))
+    
     # Print detailed transaction list for verification
-    print("\nDetailed Transaction List:")
-    print("-" * 80)
-    for trans in final_transactions:
-        print(f"#{trans['SrNo']:02d} | {trans['Date']} | {trans['TransactionDetails'][:40]:40} | {trans['Amount']:10.2f} | {trans['BillingAmountSign']}")
-    print("-" * 80)
+    if not instrument.is_quiet():
+        print("\nDetailed Transaction List:")
+        print("-" * 80)
+        for trans in final_transactions:
+            print(f"#{trans['SrNo']:02d} | {trans['Date']} | {trans['TransactionDetails'][:40]:40} | {trans['Amount']:10.2f} | {trans['BillingAmountSign']}")
+        print("-" * 80)
     
     return final_transactions
 
-def create_database(transactions, db_path):
+def create_database(transactions, db_path, statement=None):
     # Create DataFrame
     df = pd.DataFrame(transactions)
     
     # Ensure columns are in correct order
-    columns = ['SrNo', 'Date', 'TransactionDetails', 'Amount', 'BillingAmountSign']
+    amounts.add_paise_column(df)
+    # Every row belongs to this statement's billing cycle
+    cycle = cycles.statement_cycle(df, statement, 'Date')
+    cycles.tag_rows(df, cycle)
+    columns = ['SrNo', 'Date', 'TransactionDetails', 'Amount', 'AmountPaise', 'BillingAmountSign', 'StatementDate']
     df = df[columns]
     
-    # Connect to SQLite database
-    conn = sqlite3.connect(db_path)
-    
+    # Built in a temp file that replaces db_path only once complete, so a crash keeps the old database
     try:
-        # Create table with proper schema
-        create_table_sql = '''
-        CREATE TABLE IF NOT EXISTS transactions (
-            SrNo INTEGER PRIMARY KEY,
-            Date TEXT NOT NULL,
-            TransactionDetails TEXT NOT NULL,
-            Amount REAL NOT NULL,
-            BillingAmountSign TEXT NOT NULL
-        )
-        '''
-        conn.execute(create_table_sql)
-        
-        # Clear existing data
-        conn.execute('DELETE FROM transactions')
-        
-        # Insert data
-        df.to_sql('transactions', conn, if_exists='replace', index=False)
+        with atomic.rebuild(db_path) as conn:
+            # Create table with proper schema
+            create_table_sql = '''
+            CREATE TABLE IF NOT EXISTS transactions (
+                SrNo INTEGER PRIMARY KEY,
+                Date TEXT NOT NULL,
+                TransactionDetails TEXT NOT NULL,
+                Amount REAL NOT NULL,
+                AmountPaise INTEGER NOT NULL,
+                BillingAmountSign TEXT NOT NULL,
+                StatementDate TEXT
+            )
+            '''
+            conn.execute(create_table_sql)
         
-        # Verify data
-        print("\nVerifying database contents:")
-        cursor = conn.cursor()
+            # Insert data
+            df.to_sql('transactions', conn, if_exists='replace', index=False)
+            ordering.ensure_order_columns(conn)
+            categorize.recategorize(conn)
+            recurring.update_recurring(conn)
+            anomaly.ensure_anomalies(conn)
+            cycles.record_cycle(conn, cycle)
         
-        # Check first few records
-        print("\nFirst 5 records:")
-        cursor.execute("""
-            SELECT SrNo, Date, TransactionDetails, Amount, BillingAmountSign 
-            FROM transactions 
-            ORDER BY SrNo 
-            LIMIT 5
-        """)
-        for row in cursor.fetchall():
-            print(row)
+            # Verify data
+            print("\nVerifying database contents:")
+            cursor = conn.cursor()
         
-        # Check transaction types
-        cursor.execute("SELECT BillingAmountSign, COUNT(*) FROM transactions GROUP BY BillingAmountSign")
-        print("\nTransaction type summary:")
-        for sign, count in cursor.fetchall():
-            print(f"{sign}: {count} transactions")
+            # Check first few records
+            print("\nFirst 5 records:")
+            cursor.execute("""
+                SELECT SrNo, Date, TransactionDetails, Amount, BillingAmountSign 
+                FROM transactions 
+                ORDER BY SrNo 
+                LIMIT 5
+            """)
+            for row in cursor.fetchall():
+                print(row)
         
-        conn.commit()
+            # Check transaction types
+            cursor.execute("SELECT BillingAmountSign, COUNT(*) FROM transactions GROUP BY BillingAmountSign")
+            print("\nTransaction type summary:")
+            for sign, count in cursor.fetchall():
+                print(f"{sign}: {count} transactions")
         
     except Exception as e:
         print(f"Error creating database: {e}")
         raise
-    finally:
-        conn.close()
 
-def append_new_transactions(pdf_path):
+def append_new_transactions(pdf_path, db_path=DB_PATH, conn=None, transactions=None, statement=None):
     """Append new transactions from PDF to existing database"""
-    # Existing database path
-    db_path = r"C:\Users\seren\OneDrive\Desktop\PythonTransaction\DBS_Card_Statementn2.db"
     
     try:
         # Extract transactions from new PDF
         print(f"Processing new PDF: {pdf_path}")
-        new_transactions = extract_transactions_from_pdf(pdf_path)
+        # Rows a parser worker already extracted (ledger.writer), as a list or a DataFrame, are used as they are,
+        # with the header it read alongside them; the PDF is not opened again here
+        if transactions is None:
+            statement = {}
+            new_transactions = extract_transactions_from_pdf(pdf_path, statement)
+        else:
+            new_transactions = transactions
         
-        if not new_transactions:
+        if len(new_transactions) == 0:
             print("No new transactions found in PDF")
             return
             
         print(f"Found {len(new_transactions)} potential new transactions")
         
         # Connect to existing database
-        conn = sqlite3.connect(db_path)
+        own_conn = conn is None
+        if own_conn:
+            conn = storage.connect(db_path)
         
-        # Get existing transactions
-        existing_df = pd.read_sql_query("SELECT * FROM transactions", conn)
+        # Databases written by older versions of these scripts are migrated in place, all or nothing
+        with atomic.savepoint(conn):
+            storage.ensure_amount_paise(conn)
+            ordering.ensure_order_columns(conn)
+            dedup.ensure_dedup_index(conn)
+            categorize.ensure_category_columns(conn)
+            cycles.ensure_cycles(conn)
+            changefeed.ensure_changefeed(conn)
+            # Applies rule edits made since the last run
+            categorize.recategorize(conn)
+            anomaly.ensure_anomalies(conn)
         
-        # Get the last SrNo
-        last_srno = existing_df['SrNo'].max() if not existing_df.empty else 0
+        # Only the row count: dedup looks up the stored rows it needs
+        existing_count = conn.execute("SELECT COUNT(*) FROM transactions").fetchone()[0]
         
         # Convert new transactions to DataFrame
         new_df = pd.DataFrame(new_transactions)
         
-        # Check for duplicates
-        merged_df = pd.concat([existing_df, new_df])
-        duplicates = merged_df.duplicated(subset=['Date', 'TransactionDetails', 'Amount'], keep='first')
-        unique_new_transactions = merged_df[~duplicates].iloc[len(existing_df):]
+        amounts.add_paise_column(new_df)
+        # Cycle totals come from the whole statement, including rows already stored from an overlapping one
+        cycle = cycles.statement_cycle(new_df, statement, 'Date')
+        
+        # Drop rows already stored, including near-duplicates from overlapping statements
+        duplicates = dedup.find_stored_duplicates(conn, new_df)
+        unique_new_transactions = new_df[~duplicates].copy()
         
         if len(unique_new_transactions) == 0:
             print("No new unique transactions to add")
-            conn.close()
+            # Its rows came in with an overlapping statement, but this statement's cycle is still new
+            with atomic.savepoint(conn):
+                cycles.record_cycle(conn, cycle)
+            if own_conn:
+                conn.close()
             return
             
-        # Add SrNo to new transactions
-        unique_new_transactions['SrNo'] = range(last_srno + 1, last_srno + len(unique_new_transactions) + 1)
+        # The new rows, their checks and the version bump commit together or not at all
+        with atomic.savepoint(conn):
+            # Stable SrNo and (DateKey, DaySeq) after the rows already stored; existing rows are not renumbered
+            ordering.assign_row_keys(conn, unique_new_transactions, 'Date')
+            categorize.add_category_columns(conn, unique_new_transactions)
+            cycles.tag_rows(unique_new_transactions, cycle)
         
-        # Insert only the new transactions
-        unique_new_transactions.to_sql('transactions', conn, if_exists='append', index=False)
+            # Insert only the new transactions
+            atomic.insert_rows(conn, unique_new_transactions)
+            recurring.update_recurring(conn)
+            anomaly.print_alerts(anomaly.update_anomalies(conn))
+            cycles.record_cycle(conn, cycle)
+            storage.bump_version(conn)
         
         print(f"\nSuccessfully added {len(unique_new_transactions)} new transactions")
         print("\nNewly added transactions:")
@@ -228,8 +280,8 @@ def append_new_transactions(pdf_path):
         
         # Display summary statistics
         print("\nDatabase Summary:")
-        total_transactions = len(existing_df) + len(unique_new_transactions)
-        print(f"Previous transactions: {len(existing_df)}")
+        total_transactions = existing_count + len(unique_new_transactions)
+        print(f"Previous transactions: {existing_count}")
         print(f"New transactions added: {len(unique_new_transactions)}")
         print(f"Total transactions: {total_transactions}")
         
@@ -238,13 +290,13 @@ def append_new_transactions(pdf_path):
         latest = pd.read_sql_query("""
             SELECT Date, TransactionDetails, Amount, BillingAmountSign 
             FROM transactions 
-            ORDER BY Date DESC 
+            ORDER BY DateKey DESC, DaySeq DESC
             LIMIT 5
         """, conn)
         print(latest)
         
-        conn.commit()
-        conn.close()
+        if own_conn:
+            conn.close()
         
     except Exception as e:
         print(f"Error appending transactions: {e}")
@@ -253,7 +305,8 @@ def append_new_transactions(pdf_path):
 def verify_database(db_path):
     """Verify database contents and integrity"""
     try:
-        conn = sqlite3.connect(db_path)
+        conn = storage.connect(db_path, readonly=True)
+        paise = storage.amount_paise_sql(storage.table_columns(conn))
         
         # Get basic statistics
         cursor = conn.cursor()
@@ -267,8 +320,8 @@ def verify_database(db_path):
         date_range = cursor.fetchone()
         
         # Transaction types
-        cursor.execute("""
-            SELECT BillingAmountSign, COUNT(*), SUM(Amount)
+        cursor.execute(f"""
+            SELECT BillingAmountSign, COUNT(*), SUM({paise}) / 100.0
             FROM transactions 
             GROUP BY BillingAmountSign
         """)
@@ -305,7 +358,7 @@ def main():
     
     # Display sample data
     try:
-        conn = sqlite3.connect(db_path)
+        conn = storage.connect(db_path)
         print("\nFirst 5 transactions:")
         df = pd.read_sql_query("SELECT * FROM transactions ORDER BY TransactionDate LIMIT 5", conn)
         print(df)
@@ -318,12 +371,12 @@ def main():
         print(f"Error displaying sample data: {e}")
 
 if __name__ == "__main__":
-    # Example usage
-    pdf_path = r"C:\Users\seren\OneDrive\Desktop\PythonTransaction\new_dbs_statement.pdf"
-    db_path = r"C:\Users\seren\OneDrive\Desktop\PythonTransaction\DBS_Card_Statementn2.db"
+    with instrument.session():
+        # Example usage
+        pdf_path = r"C:\Users\seren\OneDrive\Desktop\PythonTransaction\new_dbs_statement.pdf"
+        db_path = r"C:\Users\seren\OneDrive\Desktop\PythonTransaction\DBS_Card_Statementn2.db"
     
-    # Append new transactions
-    append_new_transactions(pdf_path)
+        # Append new transactions
+        append_new_transactions(pdf_path)
     
-    # Verify database after update
-
+        # Verify database after update
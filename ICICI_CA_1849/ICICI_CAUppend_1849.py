@@ -1,75 +1,95 @@
-import pdfplumber
 import pandas as pd
-import sqlite3
-import re
-from datetime import datetime
+import numpy as np
+import os
+import sys
 
-def clean_amount(amount_str):
-    """Clean and convert amount string to float"""
-    if pd.isna(amount_str) or amount_str == 'NA':
-        return 0.0
-    try:
-        # Remove all non-digit characters except decimal point
-        cleaned = re.sub(r'[^\d.]', '', str(amount_str))
-        return float(cleaned) if cleaned else 0.0
-    except:
-        return 0.0
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from ledger import amounts
+from ledger import anomaly
+from ledger import atomic
+from ledger import categorize
+from ledger import changefeed
+from ledger import dates
+from ledger import dedup
+from ledger import instrument
+from ledger import ordering
+from ledger import pagecache
+from ledger import pdfresources
+from ledger import reconcile
+from ledger import recurring
+from ledger import storage
+
+# Existing database path
+DB_PATH = r"C:\Users\seren\OneDrive\Desktop\NewfolderOne\ICICI_CA_1849(2023-25).db"
 
 def extract_transactions_from_pdf(pdf_path):
     """Extract transactions from PDF statement"""
     transactions = []
     
     try:
-        with pdfplumber.open(pdf_path) as pdf:
-            for page in pdf.pages:
-                tables = page.extract_tables()
+        with instrument.stage('open'):
+            pdf = pdfresources.open_pdf(pdf_path)
+        with pdf:
+            for page_num, page in enumerate(pdf.pages, 1):
+                with instrument.stage('page_extract', page=page_num):
+                    tables = pagecache.page_tables(page)
+                instrument.count('pages')
                 
-                for table in tables:
-                    for row in table:
-                        if not row or 'SrNo' in str(row[0]):  # Skip header row
-                            continue
+                with instrument.stage('parse', page=page_num):
+                    for table in tables:
+                        for row in table:
+                            if not row or 'SrNo' in str(row[0]):  # Skip header row
+                                instrument.reject('header')
+                                continue
                         
-                        try:
-                            # Extract and clean data
-                            sr_no = row[0]
-                            trans_date = row[3].replace('\n', '')
-                            remarks = row[5].replace('\n', ' ').strip()
-                            withdrawal = clean_amount(row[6])
-                            deposit = clean_amount(row[7])
+                            try:
+                                # Extract and clean data
+                                sr_no = row[0]
+                                trans_date = row[3].replace('\n', '')
+                                remarks = row[5].replace('\n', ' ').strip()
                             
-                            # Skip empty or invalid rows
-                            if not trans_date or not (withdrawal or deposit):
-                                continue
+                                # Skip empty or invalid rows (amounts are checked after the loop)
+                                if not trans_date:
+                                    instrument.reject('empty_row')
+                                    continue
                             
-                            # Determine amount and sign
-                            amount = withdrawal if withdrawal > 0 else deposit
-                            sign = '-' if withdrawal > 0 else '+'
+                                transactions.append({
+                                    'TransactionDate': trans_date,
+                                    'TransactionDetails': remarks,
+                                    'Withdrawal': row[6],
+                                    'Deposit': row[7],
+                                    'Balance': row[8],
+                                    'TransID': row[1],
+                                    'CheqNo': row[4]
+                                })
                             
-                            # Standardize date format to DD-Mon-YY
-                            try:
-                                date_obj = datetime.strptime(trans_date, '%d-%b-%Y')
-                                formatted_date = date_obj.strftime('%d-%b-%y')
-                            except ValueError:
-                                print(f"Invalid date format: {trans_date}")
+                            except Exception as e:
+                                instrument.reject('parse_error', f"{row} ({e})")
                                 continue
                             
-                            transactions.append({
-                                'Date': formatted_date,
-                                'TransactionDetails': remarks,
-                                'Amount': amount,
-                                'BillingAmountSign': sign
-                            })
-                            
-                        except Exception as e:
-                            print(f"Error processing row: {row}")
-                            print(f"Error details: {str(e)}")
-                            continue
-                            
-        return pd.DataFrame(transactions)
+        # Same columns and Dr/Cr signs as the database ICICI_CA_1849.py creates
+        df = pd.DataFrame(transactions, columns=['TransactionDate', 'TransactionDetails', 'Withdrawal', 'Deposit', 'Balance', 'TransID', 'CheqNo'])
+        
+        # Standardize the date column to DD-Mon-YY in one pass; unparseable dates are dropped
+        parsed_dates = dates.to_datetime64(df['TransactionDate'])
+        instrument.reject('bad_date', n=int(np.isnat(parsed_dates).sum()))
+        df['TransactionDate'] = dates.format_dates(df['TransactionDate'], '%d-%b-%y')
+        df = df[~np.isnat(parsed_dates)].reset_index(drop=True)
+        
+        # Amount and sign from the withdrawal/deposit columns, parsed in one go
+        amount_values, is_debit = amounts.debit_credit(df['Withdrawal'], df['Deposit'])
+        df['Amount'] = amount_values
+        df['BillingAmountSign'] = np.where(is_debit, 'Dr', 'Cr')
+        df['SourceTxnId'] = dedup.source_ids(df, ['TransID', 'CheqNo'])
+        instrument.reject('empty_row', n=int((amount_values == 0).sum()))
+        df = df[amount_values > 0].drop(columns=['Withdrawal', 'Deposit', 'TransID', 'CheqNo']).reset_index(drop=True)
+        
+        instrument.count('rows', len(df))
+        return df
         
     except Exception as e:
         print(f"Error processing PDF {pdf_path}: {e}")
-        return pd.DataFrame()
+        raise
 
 def create_database(transactions, db_path):
     # Create DataFrame
@@ -83,61 +103,64 @@ def create_database(transactions, db_path):
         'Amount': float,
         'BillingAmountSign': str
     })
+    amounts.add_paise_column(df)
+    reconcile.add_balance_columns(df)
     
-    # Connect to SQLite database
-    conn = sqlite3.connect(db_path)
-    
+    # Built in a temp file that replaces db_path only once complete, so a crash keeps the old database
     try:
-        # Create table manually first
-        create_table_sql = '''
-        CREATE TABLE IF NOT EXISTS transactions (
-            SrNo TEXT,
-            TransactionDate TEXT,
-            TransactionDetails TEXT,
-            Amount REAL,
-            BillingAmountSign TEXT
-        )
-        '''
-        conn.execute(create_table_sql)
-        
-        # Clear existing data
-        conn.execute('DELETE FROM transactions')
-        
-        # Insert data
-        for _, row in df.iterrows():
+        with atomic.rebuild(db_path) as conn:
+            # Create table manually first
+            create_table_sql = '''
+            CREATE TABLE IF NOT EXISTS transactions (
+                SrNo TEXT,
+                TransactionDate TEXT,
+                TransactionDetails TEXT,
+                Amount REAL,
+                AmountPaise INTEGER,
+                BillingAmountSign TEXT,
+                Balance REAL,
+                BalancePaise INTEGER,
+                SourceTxnId TEXT
+            )
+            '''
+            conn.execute(create_table_sql)
+        
+            # Insert data
             insert_sql = '''
-            INSERT INTO transactions (SrNo, TransactionDate, TransactionDetails, Amount, BillingAmountSign)
-            VALUES (?, ?, ?, ?, ?)
+            INSERT INTO transactions (SrNo, TransactionDate, TransactionDetails, Amount, AmountPaise, BillingAmountSign, Balance, BalancePaise, SourceTxnId)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
             '''
-            conn.execute(insert_sql, (
-                row['SrNo'],
-                row['TransactionDate'],
-                row['TransactionDetails'],
-                row['Amount'],
-                row['BillingAmountSign']
-            ))
+            conn.executemany(insert_sql, df[[
+                'SrNo', 'TransactionDate', 'TransactionDetails', 'Amount', 'AmountPaise', 'BillingAmountSign',
+                'Balance', 'BalancePaise', 'SourceTxnId'
+            ]].itertuples(index=False, name=None))
         
-        # Create index
-        conn.execute('CREATE INDEX IF NOT EXISTS idx_date ON transactions(TransactionDate)')
+            # Check the statement's running balance
+            reconcile.print_breaks(reconcile.reconcile_database(conn))
         
-        # Commit changes
-        conn.commit()
+            # Create indexes
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_date ON transactions(TransactionDate)')
+            storage.ensure_source_id(conn)
+            ordering.ensure_order_columns(conn)
+            categorize.recategorize(conn)
+            recurring.update_recurring(conn)
+            anomaly.ensure_anomalies(conn)
         
     except Exception as e:
         print(f"Error creating database: {e}")
         raise
-    finally:
-        conn.close()
 
-def append_new_transactions(pdf_path):
+def append_new_transactions(pdf_path, db_path=DB_PATH, conn=None, transactions=None):
     """Append new transactions from PDF to existing database"""
-    # Existing database path
-    db_path = r"C:\Users\seren\OneDrive\Desktop\NewfolderOne\ICICI_CA_1849(2023-25).db"
     
     try:
         # Extract transactions from new PDF
         print(f"Processing new PDF: {pdf_path}")
-        new_transactions = extract_transactions_from_pdf(pdf_path)
+        # Rows a parser worker already extracted (ledger.writer) are used as they are
+        if transactions is None:
+            new_transactions = extract_transactions_from_pdf(pdf_path)
+        else:
+            new_transactions = transactions
         
         if new_transactions.empty:
             print("No new transactions found in PDF")
@@ -146,53 +169,77 @@ def append_new_transactions(pdf_path):
         print(f"Found {len(new_transactions)} potential new transactions")
         
         # Connect to existing database
-        conn = sqlite3.connect(db_path)
+        own_conn = conn is None
+        if own_conn:
+            conn = storage.connect(db_path)
+        
+        # Databases written by older versions of these scripts are migrated in place, all or nothing
+        with atomic.savepoint(conn):
+            storage.ensure_amount_paise(conn)
+            reconcile.ensure_balance_columns(conn)
+            storage.ensure_source_id(conn)
+            ordering.ensure_order_columns(conn)
+            dedup.ensure_dedup_index(conn)
+            categorize.ensure_category_columns(conn)
+            changefeed.ensure_changefeed(conn)
+            # Applies rule edits made since the last run
+            categorize.recategorize(conn)
+            anomaly.ensure_anomalies(conn)
         
-        # Get existing transactions
-        existing_df = pd.read_sql_query("SELECT * FROM transactions", conn)
+        # Only the row count: dedup looks up the stored rows it needs
+        existing_count = conn.execute("SELECT COUNT(*) FROM transactions").fetchone()[0]
         
-        # Get the last SrNo
-        last_srno = existing_df['SrNo'].max() if not existing_df.empty else 0
+        amounts.add_paise_column(new_transactions)
+        reconcile.add_balance_columns(new_transactions)
         
-        # Check for duplicates based on Date, Amount, and TransactionDetails
-        merged_df = pd.concat([existing_df, new_transactions])
-        duplicates = merged_df.duplicated(subset=['Date', 'TransactionDetails', 'Amount'], keep='first')
-        unique_new_transactions = merged_df[~duplicates].iloc[len(existing_df):]
+        # Drop rows already stored, including near-duplicates from overlapping statements
+        duplicates = dedup.find_stored_duplicates(conn, new_transactions)
+        unique_new_transactions = new_transactions[~duplicates].copy()
         
         if len(unique_new_transactions) == 0:
             print("No new unique transactions to add")
-            conn.close()
+            if own_conn:
+                conn.close()
             return
             
-        # Add SrNo to new transactions
-        unique_new_transactions['SrNo'] = range(last_srno + 1, last_srno + len(unique_new_transactions) + 1)
+        # The new rows, their checks and the version bump commit together or not at all
+        with atomic.savepoint(conn):
+            # Stable SrNo and (DateKey, DaySeq) after the rows already stored; existing rows are not renumbered
+            ordering.assign_row_keys(conn, unique_new_transactions, 'TransactionDate')
+            categorize.add_category_columns(conn, unique_new_transactions)
+        
+            # Insert only the new transactions
+            atomic.insert_rows(conn, unique_new_transactions)
+            recurring.update_recurring(conn)
+            anomaly.print_alerts(anomaly.update_anomalies(conn))
         
-        # Insert only the new transactions
-        unique_new_transactions.to_sql('transactions', conn, if_exists='append', index=False)
+            # Check the running balance over the appended rows only
+            reconcile.print_breaks(reconcile.reconcile_database(conn))
         
-        # Create or update index on date
-        conn.execute('CREATE INDEX IF NOT EXISTS idx_date ON transactions(Date)')
+            # Create or update index on date
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_date ON transactions(TransactionDate)')
+            storage.bump_version(conn)
         
         print(f"\nSuccessfully added {len(unique_new_transactions)} new transactions")
         print("\nNewly added transactions:")
-        print(unique_new_transactions[['Date', 'TransactionDetails', 'Amount', 'BillingAmountSign']].head())
+        print(unique_new_transactions[['TransactionDate', 'TransactionDetails', 'Amount', 'BillingAmountSign']].head())
         
         # Display summary statistics
         print("\nDatabase Summary:")
-        print(f"Total transactions: {len(existing_df) + len(unique_new_transactions)}")
+        print(f"Total transactions: {existing_count + len(unique_new_transactions)}")
         
         # Show latest transactions
         print("\nLatest 5 transactions in database:")
         latest = pd.read_sql_query("""
-            SELECT Date, TransactionDetails, Amount, BillingAmountSign 
+            SELECT TransactionDate, TransactionDetails, Amount, BillingAmountSign 
             FROM transactions 
-            ORDER BY Date DESC 
+            ORDER BY DateKey DESC, DaySeq DESC
             LIMIT 5
         """, conn)
         print(latest)
         
-        conn.commit()
-        conn.close()
+        if own_conn:
+            conn.close()
         
     except Exception as e:
         print(f"Error appending transactions: {e}")
@@ -201,16 +248,17 @@ def append_new_transactions(pdf_path):
 def verify_database(db_path):
     """Verify database contents and integrity"""
     try:
-        conn = sqlite3.connect(db_path)
+        conn = storage.connect(db_path, readonly=True)
+        paise = storage.amount_paise_sql(storage.table_columns(conn))
         
         # Get basic statistics
-        stats = pd.read_sql_query("""
+        stats = pd.read_sql_query(f"""
             SELECT 
                 COUNT(*) as total_transactions,
-                MIN(Date) as earliest_date,
-                MAX(Date) as latest_date,
-                SUM(CASE WHEN BillingAmountSign = '-' THEN Amount ELSE 0 END) as total_debits,
-                SUM(CASE WHEN BillingAmountSign = '+' THEN Amount ELSE 0 END) as total_credits
+                MIN(TransactionDate) as earliest_date,
+                MAX(TransactionDate) as latest_date,
+                SUM(CASE WHEN BillingAmountSign = 'Dr' THEN {paise} ELSE 0 END) / 100.0 as total_debits,
+                SUM(CASE WHEN BillingAmountSign = 'Cr' THEN {paise} ELSE 0 END) / 100.0 as total_credits
             FROM transactions
         """, conn)
         
@@ -226,13 +274,13 @@ def verify_database(db_path):
         print(f"Error verifying database: {e}")
 
 if __name__ == "__main__":
-    # Example usage
-    pdf_path = r"C:\Users\seren\OneDrive\Desktop\PythonTransaction\new_icici_statement.pdf"
+    with instrument.session():
+        # Example usage
+        pdf_path = r"C:\Users\seren\OneDrive\Desktop\PythonTransaction\new_icici_statement.pdf"
     
-    # Append new transactions
-    append_new_transactions(pdf_path)
+        # Append new transactions
+        append_new_transactions(pdf_path)
     
-    # Verify database after update
-    db_path = r"C:\Users\seren\OneDrive\Desktop\NewfolderOne\ICICI_CA_1849(2023-25).db"
-    verify_database(db_path)
-
+        # Verify database after update
+        db_path = r"C:\Users\seren\OneDrive\Desktop\NewfolderOne\ICICI_CA_1849(2023-25).db"
+        verify_database(db_path)
@@ -1,68 +1,86 @@
-import pdfplumber
 import pandas as pd
-import sqlite3
+import numpy as np
 import re
-from datetime import datetime
+import os
+import sys
 
-def clean_amount(amount_str):
-    if pd.isna(amount_str) or amount_str == 'NA':
-        return 0.0
-    try:
-        return float(re.sub(r'[^\d.]', '', str(amount_str)))
-    except:
-        return 0.0
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from ledger import amounts
+from ledger import anomaly
+from ledger import atomic
+from ledger import categorize
+from ledger import dates
+from ledger import dedup
+from ledger import instrument
+from ledger import ordering
+from ledger import pagecache
+from ledger import pdfresources
+from ledger import reconcile
+from ledger import recurring
+from ledger import storage
 
 def extract_transactions_from_pdf(pdf_path):
     transactions = []
     
-    with pdfplumber.open(pdf_path) as pdf:
-        for page in pdf.pages:
-            tables = page.extract_tables()
+    with instrument.stage('open'):
+        pdf = pdfresources.open_pdf(pdf_path)
+    with pdf:
+        for page_num, page in enumerate(pdf.pages, 1):
+            with instrument.stage('page_extract', page=page_num):
+                tables = pagecache.page_tables(page)
+            instrument.count('pages')
             
-            for table in tables:
-                for row in table:
-                    if not row or 'SrNo' in str(row[0]):
-                        continue
+            with instrument.stage('parse', page=page_num):
+                for table in tables:
+                    for row in table:
+                        if not row or 'SrNo' in str(row[0]):
+                            instrument.reject('header')
+                            continue
                     
-                    try:
-                        sr_no = row[0]
-                        # Handle multi-line date format
-                        trans_date = row[3].replace('\n', '')
-                        remarks = row[5].replace('\n', ' ')  # Replace newlines with spaces
-                        withdrawal = clean_amount(row[6])
-                        deposit = clean_amount(row[7])
-                        
-                        # Determine amount and sign
-                        amount = withdrawal if withdrawal > 0 else deposit
-                        sign = 'Dr' if withdrawal > 0 else 'Cr'
-                        
-                        # Clean and format transaction date to DD-Mon-YY
                         try:
-                            # First convert to datetime object
-                            date_obj = datetime.strptime(trans_date, '%d-%b-%Y')
-                            # Then format to DD-Mon-YY
-                            trans_date = date_obj.strftime('%d-%b-%y')  # Note: using lowercase 'y' for 2-digit year
-                        except Exception as e:
-                            print(f"Date conversion error for {trans_date}: {e}")
-                            continue
+                            sr_no = row[0]
+                            # Handle multi-line date format
+                            trans_date = row[3].replace('\n', '')
+                            remarks = row[5].replace('\n', ' ')  # Replace newlines with spaces
                         
-                        # Clean transaction details
-                        remarks = re.sub(r'\s+', ' ', str(remarks)).strip()
+                            # Clean transaction details
+                            remarks = re.sub(r'\s+', ' ', str(remarks)).strip()
                         
-                        transactions.append({
-                            'SrNo': sr_no,
-                            'TransactionDate': trans_date,
-                            'TransactionDetails': remarks,
-                            'Amount': amount,
-                            'BillingAmountSign': sign
-                        })
-                        print(f"Processed transaction: {sr_no} on {trans_date}")
+                            transactions.append({
+                                'SrNo': sr_no,
+                                'TransactionDate': trans_date,
+                                'TransactionDetails': remarks,
+                                'Withdrawal': row[6],
+                                'Deposit': row[7],
+                                'Balance': row[8],
+                                'TransID': row[1],
+                                'CheqNo': row[4]
+                            })
+                            instrument.echo(f"Processed transaction: {sr_no} on {trans_date}")
                         
-                    except Exception as e:
-                        print(f"Error processing row: {row}")
-                        print(f"Error details: {str(e)}")
-                        continue
+                        except Exception as e:
+                            instrument.reject('parse_error', f"{row} ({e})")
+                            continue
     
+    # Dates converted to DD-Mon-YY for the whole statement at once; unparseable ones are dropped
+    raw_dates = [t['TransactionDate'] for t in transactions]
+    parsed_dates = dates.to_datetime64(raw_dates)
+    formatted_dates = dates.format_dates(raw_dates, '%d-%b-%y').to_numpy()
+    instrument.reject('bad_date', n=int(np.isnat(parsed_dates).sum()))
+    transactions = [dict(t, TransactionDate=formatted_dates[i]) for i, t in enumerate(transactions)
+                    if not np.isnat(parsed_dates[i])]
+    
+    # Amount and sign from the withdrawal/deposit columns, parsed in one go
+    amount_values, is_debit = amounts.debit_credit([t.pop('Withdrawal') for t in transactions],
+                                                   [t.pop('Deposit') for t in transactions])
+    ids = dedup.source_ids(pd.DataFrame({'TransID': [t.pop('TransID') for t in transactions],
+                                         'CheqNo': [t.pop('CheqNo') for t in transactions]}))
+    for transaction, amount, debit, source_id in zip(transactions, amount_values, is_debit, ids):
+        transaction['Amount'] = float(amount)
+        transaction['BillingAmountSign'] = 'Dr' if debit else 'Cr'
+        transaction['SourceTxnId'] = source_id
+
+    instrument.count('rows', len(transactions))
     return transactions
 
 def create_database(transactions, db_path):
@@ -77,51 +95,52 @@ def create_database(transactions, db_path):
         'Amount': float,
         'BillingAmountSign': str
     })
+    amounts.add_paise_column(df)
+    reconcile.add_balance_columns(df)
     
-    # Connect to SQLite database
-    conn = sqlite3.connect(db_path)
-    
+    # Built in a temp file that replaces db_path only once complete, so a crash keeps the old database
     try:
-        # Create table manually first
-        create_table_sql = '''
-        CREATE TABLE IF NOT EXISTS transactions (
-            SrNo TEXT,
-            TransactionDate TEXT,
-            TransactionDetails TEXT,
-            Amount REAL,
-            BillingAmountSign TEXT
-        )
-        '''
-        conn.execute(create_table_sql)
-        
-        # Clear existing data
-        conn.execute('DELETE FROM transactions')
+        with atomic.rebuild(db_path) as conn:
+            # Create table manually first
+            create_table_sql = '''
+            CREATE TABLE IF NOT EXISTS transactions (
+                SrNo TEXT,
+                TransactionDate TEXT,
+                TransactionDetails TEXT,
+                Amount REAL,
+                AmountPaise INTEGER,
+                BillingAmountSign TEXT,
+                Balance REAL,
+                BalancePaise INTEGER,
+                SourceTxnId TEXT
+            )
+            '''
+            conn.execute(create_table_sql)
         
-        # Insert data
-        for _, row in df.iterrows():
+            # Insert data
             insert_sql = '''
-            INSERT INTO transactions (SrNo, TransactionDate, TransactionDetails, Amount, BillingAmountSign)
-            VALUES (?, ?, ?, ?, ?)
+            INSERT INTO transactions (SrNo, TransactionDate, TransactionDetails, Amount, AmountPaise, BillingAmountSign, Balance, BalancePaise, SourceTxnId)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
             '''
-            conn.execute(insert_sql, (
-                row['SrNo'],
-                row['TransactionDate'],
-                row['TransactionDetails'],
-                row['Amount'],
-                row['BillingAmountSign']
-            ))
+            conn.executemany(insert_sql, df[[
+                'SrNo', 'TransactionDate', 'TransactionDetails', 'Amount', 'AmountPaise', 'BillingAmountSign',
+                'Balance', 'BalancePaise', 'SourceTxnId'
+            ]].itertuples(index=False, name=None))
         
-        # Create index
-        conn.execute('CREATE INDEX IF NOT EXISTS idx_date ON transactions(TransactionDate)')
+            # Check the statement's running balance
+            reconcile.print_breaks(reconcile.reconcile_database(conn))
         
-        # Commit changes
-        conn.commit()
+            # Create indexes
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_date ON transactions(TransactionDate)')
+            storage.ensure_source_id(conn)
+            ordering.ensure_order_columns(conn)
+            categorize.recategorize(conn)
+            recurring.update_recurring(conn)
+            anomaly.ensure_anomalies(conn)
         
     except Exception as e:
         print(f"Error creating database: {e}")
         raise
-    finally:
-        conn.close()
 
 def main():
     pdf_path = r'C:\Users\seren\Downloads\Transactions.pdf'
@@ -141,7 +160,7 @@ def main():
     print(f"Processed {len(transactions)} transactions successfully!")
     
     try:
-        conn = sqlite3.connect(db_path)
+        conn = storage.connect(db_path)
         df = pd.read_sql_query("SELECT * FROM transactions LIMIT 5", conn)
         print("\nSample data:")
         print(df)
@@ -150,6 +169,5 @@ def main():
         print(f"Error displaying sample data: {e}")
 
 if __name__ == "__main__":
-    main()
-
-
+    with instrument.session():
+        main()
@@ -1,32 +1,24 @@
 import sqlite3
 import pandas as pd
 import os
-from datetime import datetime
+import sys
 
-def standardize_date(date_str):
-    """Convert various date formats to a standard format"""
-    try:
-        # Handle different date formats
-        if isinstance(date_str, str):
-            # Try different date formats
-            for fmt in ['%d-%b-%y', '%d-%b-%Y', '%d %b %Y', '%Y-%m-%d']:
-                try:
-                    return datetime.strptime(date_str, fmt).strftime('%Y-%m-%d')
-                except ValueError:
-                    continue
-        elif isinstance(date_str, pd.Timestamp):
-            return date_str.strftime('%Y-%m-%d')
-        return date_str
-    except Exception as e:
-        print(f"Date conversion error for {date_str}: {e}")
-        return date_str
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from ledger import amounts
+from ledger import anomaly
+from ledger import atomic
+from ledger import categorize
+from ledger import dates
+from ledger import dedup
+from ledger import ordering
+from ledger import recurring
 
-def merge_databases():
-    # Define paths
-    db_path1 = r"C:\Users\seren\OneDrive\Desktop\PythonTransaction\ICICI_SA_0090(23-24).db"
-    db_path2 = r"C:\Users\seren\OneDrive\Desktop\PythonTransaction\ICICI_SA_0090(24-25).db"
-    output_path = r"C:\Users\seren\OneDrive\Desktop\NewfolderOne\ICICI_SA_0090(2023-25).db"
+# Define paths
+DB_PATH1 = r"C:\Users\seren\OneDrive\Desktop\PythonTransaction\ICICI_SA_0090(23-24).db"
+DB_PATH2 = r"C:\Users\seren\OneDrive\Desktop\PythonTransaction\ICICI_SA_0090(24-25).db"
+OUTPUT_PATH = r"C:\Users\seren\OneDrive\Desktop\NewfolderOne\ICICI_SA_0090(2023-25).db"
 
+def merge_databases(db_path1=DB_PATH1, db_path2=DB_PATH2, output_path=OUTPUT_PATH):
     all_transactions = []
     
     # Process first database
@@ -56,6 +48,13 @@ def merge_databases():
     if not all_transactions:
         print("No transactions found in either database!")
         return
+    
+    # Drop rows of the second database already in the first (overlapping statements):
+    # by SourceTxnId where both have one, by date/amount/narration otherwise
+    if len(all_transactions) == 2:
+        duplicates = dedup.find_duplicates(all_transactions[0], all_transactions[1])
+        print(f"Skipping {duplicates.sum()} transactions of database 2 already in database 1")
+        all_transactions[1] = all_transactions[1][~duplicates]
 
     # Combine all transactions
     merged_df = pd.concat(all_transactions, ignore_index=True)
@@ -75,81 +74,79 @@ def merge_databases():
     # Rename columns if they exist
     merged_df = merged_df.rename(columns=column_mapping)
     
-    # Standardize all dates to YYYY-MM-DD format
+    # Parse all dates (whatever format each source used) for sorting
     print("Standardizing dates...")
-    merged_df['Date'] = merged_df['Date'].apply(standardize_date)
-    
-    # Convert to datetime for sorting
-    merged_df['Date'] = pd.to_datetime(merged_df['Date'])
+    merged_df['Date'] = dates.to_datetime64(merged_df['Date'])
     
-    # Sort by date
-    print("Sorting transactions by date...")
-    merged_df = merged_df.sort_values('Date')
+    # Database 1 rows keep their SrNo and day order; database 2 rows are numbered after them
+    print("Ordering transactions by date...")
+    merged_df = ordering.merge_row_keys(merged_df, len(all_transactions[0]), 'Date')
     
-    # Reset index and add SrNo column
-    merged_df = merged_df.reset_index(drop=True)
-    merged_df['SrNo'] = range(1, len(merged_df) + 1)
+    # Recomputed from Amount so sources written before AmountPaise existed are covered
+    amounts.add_paise_column(merged_df)
     
     # Convert date back to string in consistent format
     merged_df['Date'] = merged_df['Date'].dt.strftime('%d-%b-%y')
 
     # Create new database
     try:
-        if os.path.exists(output_path):
-            os.remove(output_path)
-            print(f"Removed existing output database")
-
-        conn = sqlite3.connect(output_path)
-        
-        # Create transactions table with proper schema
-        create_table_sql = '''
-        CREATE TABLE IF NOT EXISTS transactions (
-            SrNo INTEGER,
-            Date TEXT,
-            TransactionDetails TEXT,
-            Amount REAL,
-            BillingAmountSign TEXT
-        )
-        '''
-        conn.execute(create_table_sql)
+        # Built in a temp file that replaces output_path only once complete, so a crash keeps the old database
+        with atomic.rebuild(output_path) as conn:
+            # Create transactions table with proper schema
+            create_table_sql = '''
+            CREATE TABLE IF NOT EXISTS transactions (
+                SrNo INTEGER,
+                Date TEXT,
+                TransactionDetails TEXT,
+                Amount REAL,
+                AmountPaise INTEGER,
+                BillingAmountSign TEXT,
+                SourceTxnId TEXT,
+                DateKey TEXT,
+                DaySeq INTEGER
+            )
+            '''
+            conn.execute(create_table_sql)
         
-        # Ensure all required columns exist
-        required_columns = ['SrNo', 'Date', 'TransactionDetails', 'Amount', 'BillingAmountSign']
-        for col in required_columns:
-            if col not in merged_df.columns:
-                merged_df[col] = None  # Add missing columns with NULL values
+            # Ensure all required columns exist
+            required_columns = ['SrNo', 'Date', 'TransactionDetails', 'Amount', 'AmountPaise', 'BillingAmountSign', 'SourceTxnId', 'DateKey', 'DaySeq']
+            for col in required_columns:
+                if col not in merged_df.columns:
+                    merged_df[col] = None  # Add missing columns with NULL values
         
-        # Select only the columns we want
-        merged_df = merged_df[required_columns]
+            # Select only the columns we want
+            merged_df = merged_df[required_columns]
         
-        # Insert data
-        merged_df.to_sql('transactions', conn, if_exists='replace', index=False)
+            # Insert data
+            merged_df.to_sql('transactions', conn, if_exists='replace', index=False)
         
-        # Create index on date
-        conn.execute('CREATE INDEX idx_date ON transactions(Date)')
+            # Create index on date
+            conn.execute('CREATE INDEX idx_date ON transactions(Date)')
+            conn.execute('CREATE INDEX idx_source_txn ON transactions(SourceTxnId)')
+            ordering.ensure_order_columns(conn)
+            categorize.recategorize(conn)
+            recurring.update_recurring(conn)
+            anomaly.ensure_anomalies(conn)
         
-        conn.commit()
-        print(f"\nSuccessfully merged databases:")
-        print(f"Total transactions: {len(merged_df)}")
+            print(f"\nSuccessfully merged databases:")
+            print(f"Total transactions: {len(merged_df)}")
         
-        # Display sample data
-        print("\nFirst 5 transactions:")
-        sample = pd.read_sql_query("""
-            SELECT SrNo, Date, TransactionDetails, Amount, BillingAmountSign 
-            FROM transactions 
-            ORDER BY Date 
-            LIMIT 5""", conn)
-        print(sample)
+            # Display sample data
+            print("\nFirst 5 transactions:")
+            sample = pd.read_sql_query("""
+                SELECT SrNo, Date, TransactionDetails, Amount, BillingAmountSign 
+                FROM transactions 
+                ORDER BY DateKey, DaySeq
+                LIMIT 5""", conn)
+            print(sample)
 
-        print("\nLast 5 transactions:")
-        sample = pd.read_sql_query("""
-            SELECT SrNo, Date, TransactionDetails, Amount, BillingAmountSign 
-            FROM transactions 
-            ORDER BY Date DESC 
-            LIMIT 5""", conn)
-        print(sample)
-        
-        conn.close()
+            print("\nLast 5 transactions:")
+            sample = pd.read_sql_query("""
+                SELECT SrNo, Date, TransactionDetails, Amount, BillingAmountSign 
+                FROM transactions 
+                ORDER BY DateKey DESC, DaySeq DESC
+                LIMIT 5""", conn)
+            print(sample)
 
     except Exception as e:
         print(f"Error creating merged database: {e}")
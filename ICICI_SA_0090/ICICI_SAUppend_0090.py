@@ -1,68 +1,117 @@
-import sqlite3
+import numpy as np
 import pandas as pd
 import os
-from datetime import datetime
+import sys
 
-def standardize_date(date_str):
-    """Convert various date formats to a standard format"""
-    try:
-        if isinstance(date_str, str):
-            for fmt in ['%d-%b-%y', '%d-%b-%Y', '%d %b %Y', '%Y-%m-%d']:
-                try:
-                    return datetime.strptime(date_str, fmt).strftime('%d-%b-%y')
-                except ValueError:
-                    continue
-        elif isinstance(date_str, pd.Timestamp):
-            return date_str.strftime('%d-%b-%y')
-        return date_str
-    except Exception as e:
-        print(f"Date conversion error for {date_str}: {e}")
-        return date_str
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from ledger import amounts
+from ledger import anomaly
+from ledger import atomic
+from ledger import categorize
+from ledger import changefeed
+from ledger import dates
+from ledger import dedup
+from ledger import instrument
+from ledger import ordering
+from ledger import reconcile
+from ledger import recurring
+from ledger import storage
+
+# Existing database path
+DB_PATH = r"C:\Users\seren\OneDrive\Desktop\NewfolderOne\ICICI_SA_0090(2023-25).db"
+
+# Header words of each statement column, as matched by ICICI_SA_0090.py; the first word found wins
+COLUMN_NAMES = {
+    'Date': ['value date', 'transaction date', 'date'],
+    'TransactionDetails': ['transaction remarks', 'particulars', 'description', 'remarks', 'narration', 'details'],
+    'Debit': ['withdrawal', 'debit'],
+    'Credit': ['deposit', 'credit'],
+    'Balance': ['balance'],
+}
+
+def find_columns(header):
+    """{field: column position} for the cells of a header row"""
+    cells = [str(cell).strip().lower() for cell in header]
+    found = {}
+    for field, names in COLUMN_NAMES.items():
+        for name in names:
+            position = next((i for i, cell in enumerate(cells) if name in cell), None)
+            if position is not None:
+                found[field] = position
+                break
+    return found
+
+def find_table(sheets):
+    """(sheet, header row, columns) of the transaction table, or None
+
+    Downloaded statements open with account details, so the table starts
+    at the first row that names a date, a details and an amount column.
+    """
+    for sheet in sheets.values():
+        for idx in range(len(sheet)):
+            found = find_columns(sheet.iloc[idx])
+            if 'Date' in found and 'TransactionDetails' in found and ('Debit' in found or 'Credit' in found):
+                return sheet, idx, found
+    return None
 
 def extract_transactions_from_excel(excel_path):
     """Extract transaction data from Excel sheet"""
     try:
         # Read Excel file
-        df = pd.read_excel(excel_path)
-        
-        # Rename columns if needed
-        column_mapping = {
-            'Value Date': 'Date',
-            'Description': 'TransactionDetails',
-            'Debit': 'Debit',
-            'Credit': 'Credit'
-        }
-        df = df.rename(columns=column_mapping)
-        
-        # Convert date format
-        df['Date'] = df['Date'].apply(standardize_date)
-        
-        # Handle Amount and BillingAmountSign
-        df['Amount'] = df.apply(
-            lambda row: row['Debit'] if pd.notnull(row['Debit']) else row['Credit'],
-            axis=1
-        )
-        
-        df['BillingAmountSign'] = df.apply(
-            lambda row: '-' if pd.notnull(row['Debit']) else '+',
-            axis=1
-        )
-        
-        return df[['Date', 'TransactionDetails', 'Amount', 'BillingAmountSign']]
+        with instrument.stage('open'):
+            sheets = pd.read_excel(excel_path, sheet_name=None, header=None)
+        
+        table = find_table(sheets)
+        if table is None:
+            raise ValueError("Could not find sheet with required columns")
+        sheet, idx, found = table
+        df = sheet.iloc[idx + 1:].set_axis(sheet.iloc[idx].astype(str).str.strip(), axis=1).reset_index(drop=True)
+        columns = {field: df.iloc[:, position] for field, position in found.items()}
+        no_amounts = [None] * len(df)
+        
+        # Convert date format; blank and footer rows have no date
+        parsed_dates = dates.to_datetime64(columns['Date'])
+        formatted_dates = dates.format_dates(columns['Date'], '%d-%b-%y')
+        
+        # Amount and sign from the debit/credit columns, parsed in one go; the debit wins if both are set
+        amount_values, is_debit = amounts.debit_credit(columns.get('Debit', no_amounts), columns.get('Credit', no_amounts))
+        details = columns['TransactionDetails'].fillna('').astype(str).str.replace(r'\s+', ' ', regex=True).str.strip()
+        
+        transactions = pd.DataFrame({
+            'Date': formatted_dates,
+            'TransactionDetails': details,
+            'Amount': amount_values,
+            # Dr/Cr, as in the database ICICI_SA_0090.py creates
+            'BillingAmountSign': np.where(is_debit | (amount_values == 0), 'Dr', 'Cr'),
+            'Balance': columns.get('Balance', no_amounts),
+            'SourceTxnId': dedup.source_ids(df),
+        })
+        
+        has_date = ~np.isnat(parsed_dates)
+        is_empty = (details == '') & (amount_values == 0)
+        instrument.reject('no_date', n=int((~has_date).sum()))
+        instrument.reject('empty_row', n=int((has_date & is_empty).sum()))
+        transactions = transactions[has_date & ~is_empty].reset_index(drop=True)
+        
+        instrument.count('rows', len(transactions))
+        return transactions
         
     except Exception as e:
+        # Raised, not an empty frame: an unreadable workbook is a failed import, not one with no new rows
         print(f"Error processing Excel {excel_path}: {e}")
-        return pd.DataFrame()
+        raise
 
-def append_new_transactions(excel_path):
+def append_new_transactions(excel_path, db_path=DB_PATH, conn=None, transactions=None):
     """Append new transactions from Excel to existing database"""
-    # Existing database path
-    db_path = r"C:\Users\seren\OneDrive\Desktop\NewfolderOne\ICICI_SA_0090(2023-25).db"
     
     try:
         # Extract transactions from Excel
         print(f"Processing Excel file: {excel_path}")
-        new_transactions = extract_transactions_from_excel(excel_path)
+        # Rows a parser worker already extracted (ledger.writer) are used as they are
+        if transactions is None:
+            new_transactions = extract_transactions_from_excel(excel_path)
+        else:
+            new_transactions = transactions
         
         if new_transactions.empty:
             print("No new transactions found in Excel")
@@ -71,41 +120,63 @@ def append_new_transactions(excel_path):
         print(f"Found {len(new_transactions)} potential new transactions")
         
         # Connect to existing database
-        conn = sqlite3.connect(db_path)
-        
-        # Get existing transactions
-        existing_df = pd.read_sql_query("SELECT * FROM transactions", conn)
-        
-        # Get the last SrNo
-        last_srno = existing_df['SrNo'].max() if not existing_df.empty else 0
-        
-        # Check for duplicates
-        merged_df = pd.concat([existing_df, new_transactions])
-        duplicates = merged_df.duplicated(subset=['Date', 'TransactionDetails', 'Amount'], keep='first')
-        unique_new_transactions = merged_df[~duplicates].iloc[len(existing_df):]
+        own_conn = conn is None
+        if own_conn:
+            conn = storage.connect(db_path)
+        
+        # Databases written by older versions of these scripts are migrated in place, all or nothing
+        with atomic.savepoint(conn):
+            storage.ensure_amount_paise(conn)
+            reconcile.ensure_balance_columns(conn)
+            storage.ensure_source_id(conn)
+            ordering.ensure_order_columns(conn)
+            dedup.ensure_dedup_index(conn)
+            categorize.ensure_category_columns(conn)
+            changefeed.ensure_changefeed(conn)
+            # Applies rule edits made since the last run
+            categorize.recategorize(conn)
+            anomaly.ensure_anomalies(conn)
+        
+        amounts.add_paise_column(new_transactions)
+        reconcile.add_balance_columns(new_transactions)
+        
+        # Drop rows already stored, including near-duplicates from overlapping statements
+        duplicates = dedup.find_stored_duplicates(conn, new_transactions)
+        unique_new_transactions = new_transactions[~duplicates].copy()
         
         if len(unique_new_transactions) == 0:
             print("No new unique transactions to add")
-            conn.close()
+            if own_conn:
+                conn.close()
             return
             
-        # Add SrNo to new transactions
-        unique_new_transactions['SrNo'] = range(last_srno + 1, last_srno + len(unique_new_transactions) + 1)
+        # The new rows, their checks and the version bump commit together or not at all
+        with atomic.savepoint(conn):
+            # Stable SrNo and (DateKey, DaySeq) after the rows already stored; existing rows are not renumbered
+            ordering.assign_row_keys(conn, unique_new_transactions, 'Date')
+            categorize.add_category_columns(conn, unique_new_transactions)
+        
+            # Insert only the new transactions
+            atomic.insert_rows(conn, unique_new_transactions)
+            recurring.update_recurring(conn)
+            anomaly.print_alerts(anomaly.update_anomalies(conn))
         
-        # Insert only the new transactions
-        unique_new_transactions.to_sql('transactions', conn, if_exists='append', index=False)
+            # Check the running balance over the appended rows only
+            reconcile.print_breaks(reconcile.reconcile_database(conn))
+            storage.bump_version(conn)
         
         print(f"\nSuccessfully added {len(unique_new_transactions)} new transactions")
         print("\nNewly added transactions:")
         print(unique_new_transactions[['Date', 'TransactionDetails', 'Amount', 'BillingAmountSign']].head())
         
-        conn.commit()
-        conn.close()
+        if own_conn:
+            conn.close()
         
     except Exception as e:
         print(f"Error appending transactions: {e}")
+        raise
 
 if __name__ == "__main__":
-    # Example usage
-    excel_path = r"C:\Users\seren\OneDrive\Desktop\PythonTransaction\new_icici_statement.xlsx"
-
+    with instrument.session():
+        # Example usage
+        excel_path = r"C:\Users\seren\OneDrive\Desktop\PythonTransaction\new_icici_statement.xlsx"
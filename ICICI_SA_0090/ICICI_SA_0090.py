@@ -1,36 +1,37 @@
 
 import pandas as pd
-import sqlite3
 import re
 import os
-from datetime import datetime
+import sys
 
-def clean_amount(amount_str):
-    if pd.isna(amount_str) or amount_str == 'NA' or amount_str == '-':
-        return 0.0
-    try:
-        if isinstance(amount_str, (int, float)):
-            return float(amount_str)
-        # Remove any currency symbols, commas and other non-numeric characters except decimal point
-        cleaned = re.sub(r'[^\d.-]', '', str(amount_str))
-        return float(cleaned) if cleaned else 0.0
-    except:
-        return 0.0
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from ledger import amounts
+from ledger import anomaly
+from ledger import atomic
+from ledger import categorize
+from ledger import dates
+from ledger import dedup
+from ledger import instrument
+from ledger import ordering
+from ledger import reconcile
+from ledger import recurring
+from ledger import storage
 
 def extract_transactions_from_excel(excel_path):
     try:
         print(f"Reading Excel file: {excel_path}")
         
         # Read all sheets from Excel file
-        all_sheets = pd.read_excel(excel_path, sheet_name=None, header=None)
+        with instrument.stage('open'):
+            all_sheets = pd.read_excel(excel_path, sheet_name=None, header=None)
         
         # Try each sheet until we find one with the required data
         df = None
         for sheet_name, sheet_df in all_sheets.items():
             print(f"\nChecking sheet: {sheet_name}")
             
-            # Read the entire sheet without headers first
-            full_df = pd.read_excel(excel_path, sheet_name=sheet_name, header=None)
+            # The entire sheet without headers (already read above)
+            full_df = sheet_df
             
             # Look for the actual transaction data header
             # Usually it contains words like "Sr No", "Date", "Particulars", etc.
@@ -87,106 +88,78 @@ def extract_transactions_from_excel(excel_path):
         
         # Create new DataFrame with only required columns
         transactions = []
-        for _, row in df.iterrows():
-            try:
-                # Extract date
-                date_col = found_columns.get('date')
-                trans_date = row[date_col] if date_col else None
-                if pd.isna(trans_date):
-                    continue
-                
+        with instrument.stage('parse'):
+            # Parse each distinct date once and convert to DD-Mon-YY format
+            date_col = found_columns.get('date')
+            if date_col:
+                parsed_dates = pd.Series(dates.to_datetime64(df[date_col]), index=df.index)
+                formatted_dates = dates.format_dates(df[date_col], '%d-%b-%y')
+            
+            # Withdrawal/deposit columns are parsed whole; the withdrawal wins if both are set
+            withdrawal_col = next((col for col in df.columns if any(name in col.lower() for name in ['withdrawal', 'debit', 'dr'])), None)
+            deposit_col = next((col for col in df.columns if any(name in col.lower() for name in ['deposit', 'credit', 'cr'])), None)
+            no_amounts = [None] * len(df)
+            amount_values, is_debit = amounts.debit_credit(df[withdrawal_col] if withdrawal_col else no_amounts,
+                                                           df[deposit_col] if deposit_col else no_amounts)
+            amount_values = pd.Series(amount_values, index=df.index)
+            is_debit = pd.Series(is_debit, index=df.index)
+            balance_col = next((col for col in df.columns if 'balance' in col.lower()), None)
+            # TransID, or the cheque number for rows that have one
+            source_ids = dedup.source_ids(df)
+            for index, row in df.iterrows():
                 try:
-                    # Handle different date formats and convert to DD-Mon-YY
-                    if isinstance(trans_date, str):
-                        # Try multiple date formats
-                        date_formats = ['%d/%m/%Y', '%d-%m-%Y', '%Y-%m-%d', '%d/%m/%y']
-                        date_obj = None
-                        
-                        for date_format in date_formats:
-                            try:
-                                date_obj = datetime.strptime(trans_date, date_format)
-                                break
-                            except ValueError:
-                                continue
-                        
-                        if date_obj is None:
-                            # If all formats fail, try pandas to_datetime
-                            date_obj = pd.to_datetime(trans_date).to_pydatetime()
-                    elif isinstance(trans_date, datetime):
-                        date_obj = trans_date
-                    elif isinstance(trans_date, pd.Timestamp):
-                        date_obj = trans_date.to_pydatetime()
-                    else:
-                        # Try parsing with pandas
-                        date_obj = pd.to_datetime(trans_date).to_pydatetime()
-                    
-                    # Convert to DD-Mon-YY format
-                    formatted_date = date_obj.strftime('%d-%b-%y')  # This will give format like '01-Jan-24'
-                except Exception as e:
-                    print(f"Date conversion error for {trans_date}: {e}")
-                    continue
+                    # Extract date
+                    trans_date = row[date_col] if date_col else None
+                    if pd.isna(trans_date):
+                        instrument.reject('no_date')
+                        continue
                 
-                # Extract details
-                details_col = found_columns.get('details')
-                details = str(row[details_col]).strip() if details_col else ''
-                details = re.sub(r'\s+', ' ', details)
-                
-                # Extract withdrawal and deposit amounts
-                withdrawal_amount = 0.0
-                deposit_amount = 0.0
-                
-                # Check for withdrawal/debit amount
-                for col in df.columns:
-                    if any(name in col.lower() for name in ['withdrawal', 'debit', 'dr']):
-                        withdrawal_amount = clean_amount(row[col])
-                        break
+                    if pd.isna(parsed_dates.at[index]):
+                        instrument.reject('bad_date', trans_date)
+                        continue
+                    formatted_date = formatted_dates.at[index]
                 
-                # Check for deposit/credit amount
-                for col in df.columns:
-                    if any(name in col.lower() for name in ['deposit', 'credit', 'cr']):
-                        deposit_amount = clean_amount(row[col])
-                        break
+                    # Extract details
+                    details_col = found_columns.get('details')
+                    details = str(row[details_col]).strip() if details_col else ''
+                    details = re.sub(r'\s+', ' ', details)
                 
-                # Determine final amount and sign
-                if withdrawal_amount > 0:
-                    amount = withdrawal_amount
-                    sign = 'Dr'
-                elif deposit_amount > 0:
-                    amount = deposit_amount
-                    sign = 'Cr'
-                else:
-                    amount = 0.0
-                    sign = 'Dr'
+                    # Determine final amount and sign
+                    amount = float(amount_values.at[index])
+                    sign = 'Dr' if is_debit.at[index] or amount == 0.0 else 'Cr'
                 
-                # Extract SrNo and convert to integer
-                srno_col = found_columns.get('srno')
-                if srno_col and not pd.isna(row[srno_col]):
-                    try:
-                        srno = int(float(row[srno_col]))
-                    except:
-                        srno = str(row[srno_col]).strip()
-                else:
-                    srno = ''
+                    # Extract SrNo and convert to integer
+                    srno_col = found_columns.get('srno')
+                    if srno_col and not pd.isna(row[srno_col]):
+                        try:
+                            srno = int(float(row[srno_col]))
+                        except:
+                            srno = str(row[srno_col]).strip()
+                    else:
+                        srno = ''
                 
-                # Skip rows where all values are empty or zero
-                if not details and amount == 0.0:
-                    continue
+                    # Skip rows where all values are empty or zero
+                    if not details and amount == 0.0:
+                        instrument.reject('empty_row')
+                        continue
                 
-                transaction = {
-                    'SrNo': srno,
-                    'Date': formatted_date,
-                    'TransactionDetails': details,
-                    'Amount': abs(amount),
-                    'BillingAmountSign': sign
-                }
+                    transaction = {
+                        'SrNo': srno,
+                        'Date': formatted_date,
+                        'TransactionDetails': details,
+                        'Amount': amount,
+                        'BillingAmountSign': sign,
+                        'Balance': row[balance_col] if balance_col else None,
+                        'SourceTxnId': source_ids.at[index]
+                    }
                 
-                transactions.append(transaction)
+                    transactions.append(transaction)
                 
-            except Exception as e:
-                print(f"Error processing row: {row}")
-                print(f"Error details: {str(e)}")
-                continue
+                except Exception as e:
+                    instrument.reject('parse_error', f"{row.to_dict()} ({e})")
+                    continue
         
+        instrument.count('rows', len(transactions))
         print(f"\nTotal transactions extracted: {len(transactions)}")
         return transactions
     
@@ -208,44 +181,53 @@ def create_database(transactions, db_path):
         'Date',
         'TransactionDetails',
         'Amount',
-        'BillingAmountSign'
+        'BillingAmountSign',
+        'Balance',
+        'SourceTxnId'
     ]]
+    amounts.add_paise_column(df)
+    reconcile.add_balance_columns(df)
     
-    # Connect to SQLite database
-    conn = sqlite3.connect(db_path)
-    
+    # Built in a temp file that replaces db_path only once complete, so a crash keeps the old database
     try:
-        # Create table with only required columns
-        create_table_sql = '''
-        CREATE TABLE IF NOT EXISTS transactions (
-            SrNo TEXT,
-            Date TEXT,
-            TransactionDetails TEXT,
-            Amount REAL,
-            BillingAmountSign TEXT
-        )
-        '''
-        conn.execute(create_table_sql)
+        with atomic.rebuild(db_path) as conn:
+            # Create table with only required columns
+            create_table_sql = '''
+            CREATE TABLE IF NOT EXISTS transactions (
+                SrNo TEXT,
+                Date TEXT,
+                TransactionDetails TEXT,
+                Amount REAL,
+                AmountPaise INTEGER,
+                BillingAmountSign TEXT,
+                Balance REAL,
+                BalancePaise INTEGER,
+                SourceTxnId TEXT
+            )
+            '''
+            conn.execute(create_table_sql)
         
-        # Clear existing data
-        conn.execute('DELETE FROM transactions')
+            # Insert data
+            df.to_sql('transactions', conn, if_exists='replace', index=False)
+            storage.ensure_source_id(conn)
+            ordering.ensure_order_columns(conn)
+            categorize.recategorize(conn)
+            recurring.update_recurring(conn)
+            anomaly.ensure_anomalies(conn)
         
-        # Insert data
-        df.to_sql('transactions', conn, if_exists='replace', index=False)
+            # Check the statement's running balance
+            reconcile.print_breaks(reconcile.reconcile_database(conn))
         
-        conn.commit()
-        print(f"\nDatabase created successfully at {db_path}")
+            print(f"\nDatabase created successfully at {db_path}")
         
-        # Display sample data
-        print("\nSample data from database:")
-        sample_df = pd.read_sql_query("SELECT * FROM transactions LIMIT 5", conn)
-        print(sample_df.to_string())
+            # Display sample data
+            print("\nSample data from database:")
+            sample_df = pd.read_sql_query("SELECT * FROM transactions LIMIT 5", conn)
+            print(sample_df.to_string())
         
     except Exception as e:
         print(f"Error creating database: {str(e)}")
         raise
-    finally:
-        conn.close()
 
 def main():
     excel_path = r"C:\Users\seren\OneDrive\Desktop\PythonRepo\ICICI_SA_0090(24-25).xls"
@@ -265,9 +247,5 @@ def main():
         print("No transactions were extracted!")
 
 if __name__ == "__main__":
-    main()
-
-
-
-
-
+    with instrument.session():
+        main()
@@ -1,16 +1,46 @@
 import pandas as pd
-import sqlite3
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from ledger import amounts
+from ledger import anomaly
+from ledger import atomic
+from ledger import categorize
+from ledger import dedup
+from ledger import instrument
+from ledger import ordering
+from ledger import recurring
+from ledger import storage
+
+# Determine transaction type (DR/CR) based on transaction description and amount
+def determine_transaction_type(row):
+    amount = row["Amount"]
+    details = str(row["TransactionDetails"]).lower()
+
+    # Keywords indicating money going out (DR)
+    debit_keywords = ["paid", "payment", "sent", "debited", "purchase", "withdrawn"]
+
+    # Keywords indicating money coming in (CR)
+    credit_keywords = ["received", "credited", "refund", "cashback", "added"]
+
+    # Check for debit keywords
+    if any(keyword in details for keyword in debit_keywords):
+        return "DR"
+    # Check for credit keywords
+    elif any(keyword in details for keyword in credit_keywords):
+        return "CR"
+    # If no keywords found, use amount sign
+    else:
+        return "DR" if amount < 0 else "CR"
 
-try:
+def extract_transactions_from_excel(excel_file_path, sheet_name="Passbook Payment History"):
     # === Step 1: Load Excel ===
-    excel_file_path = r"C:\Users\seren\OneDrive\Desktop\PythonTransaction\PaytmUPIStatement01Apr23-31Mar24.xlsx"
-    sheet_name = "Passbook Payment History"
+    with instrument.stage('open'):
+        df = pd.read_excel(excel_file_path, sheet_name=sheet_name)
 
-    # Load the sheet
-    df = pd.read_excel(excel_file_path, sheet_name=sheet_name)
-    
     print("Original columns:", df.columns.tolist())
-    
+
     # === Step 2: Clean and Format Data ===
     df_cleaned = df.copy()
 
@@ -34,30 +64,12 @@ try:
     else:
         raise ValueError("Transaction Details column not found in Excel file")
 
+    # UPI reference number (Order ID when it is missing)
+    df_cleaned["SourceTxnId"] = dedup.source_ids(df_cleaned)
+
     # Clean and convert Amount column
     df_cleaned["Amount"] = df_cleaned["Amount"].astype(str).str.replace(",", "").astype(float)
 
-    # Determine transaction type (DR/CR) based on transaction description and amount
-    def determine_transaction_type(row):
-        amount = row["Amount"]
-        details = str(row["TransactionDetails"]).lower()
-        
-        # Keywords indicating money going out (DR)
-        debit_keywords = ["paid", "payment", "sent", "debited", "purchase", "withdrawn"]
-        
-        # Keywords indicating money coming in (CR)
-        credit_keywords = ["received", "credited", "refund", "cashback", "added"]
-        
-        # Check for debit keywords
-        if any(keyword in details for keyword in debit_keywords):
-            return "DR"
-        # Check for credit keywords
-        elif any(keyword in details for keyword in credit_keywords):
-            return "CR"
-        # If no keywords found, use amount sign
-        else:
-            return "DR" if amount < 0 else "CR"
-
     # Apply transaction type determination
     df_cleaned["BillingAmountSign-DR,CR"] = df_cleaned.apply(determine_transaction_type, axis=1)
 
@@ -65,67 +77,83 @@ try:
     df_cleaned["Amount"] = df_cleaned["Amount"].abs()
 
     # === Step 3: Keep only necessary columns ===
-    final_df = df_cleaned[["SrNO", "Date", "TransactionDetails", "Amount", "BillingAmountSign-DR,CR"]]
+    final_df = df_cleaned[["SrNO", "Date", "TransactionDetails", "Amount", "BillingAmountSign-DR,CR", "SourceTxnId"]]
+
+    instrument.count('rows', len(final_df))
 
     # Check for null values
-    print("\nChecking for null values:")
-    print(final_df.isnull().sum())
+    instrument.echo("\nChecking for null values:")
+    instrument.echo(final_df.isnull().sum())
+
+    return final_df
 
+def create_database(final_df, db_path):
     # === Step 4: Export to SQLite ===
-    db_path = r"C:\Users\seren\OneDrive\Desktop\NewfolderOne\PaytmUPIStatement.db"
-    
-    conn = sqlite3.connect(db_path)
-    
-    # Create table with correct schema
-    create_table_sql = '''
-    CREATE TABLE IF NOT EXISTS transactions (
-        SrNO INTEGER,
-        Date TEXT,
-        TransactionDetails TEXT,
-        Amount REAL,
-        "BillingAmountSign-DR,CR" TEXT
-    )
-    '''
-    conn.execute(create_table_sql)
-    
-    # Clear existing data
-    conn.execute("DELETE FROM transactions")
-    
-    # Insert data
-    final_df.to_sql('transactions', conn, if_exists='replace', index=False)
-
-    # Display sample data to verify
-    print("\nFirst 5 transactions:")
-    sample = pd.read_sql_query("""
-        SELECT SrNO, Date, TransactionDetails, Amount, "BillingAmountSign-DR,CR"
-        FROM transactions 
-        ORDER BY Date 
-        LIMIT 5""", conn)
-    print(sample)
-
-    print("\nLast 5 transactions:")
-    sample = pd.read_sql_query("""
-        SELECT SrNO, Date, TransactionDetails, Amount, "BillingAmountSign-DR,CR"
-        FROM transactions 
-        ORDER BY Date DESC 
-        LIMIT 5""", conn)
-    print(sample)
-
-    # Verify DR/CR distribution
-    print("\nTransaction type distribution:")
-    type_dist = pd.read_sql_query("""
-        SELECT "BillingAmountSign-DR,CR", COUNT(*) as count 
-        FROM transactions 
-        GROUP BY "BillingAmountSign-DR,CR"
-        """, conn)
-    print(type_dist)
-
-    conn.close()
-    print("\n✅ Data successfully processed and saved to database")
-
-except Exception as e:
-    print(f"Error processing data: {str(e)}")
-    import traceback
-    print(f"Full error details:\n{traceback.format_exc()}")
-    if 'conn' in locals():
-        conn.close()
+    # Built in a temp file that replaces db_path only once complete, so a crash keeps the old database
+    with atomic.rebuild(db_path) as conn:
+        # Create table with correct schema
+        create_table_sql = '''
+        CREATE TABLE IF NOT EXISTS transactions (
+            SrNO INTEGER,
+            Date TEXT,
+            TransactionDetails TEXT,
+            Amount REAL,
+            AmountPaise INTEGER,
+            "BillingAmountSign-DR,CR" TEXT,
+            SourceTxnId TEXT
+        )
+        '''
+        conn.execute(create_table_sql)
+
+        # Insert data
+        final_df = amounts.add_paise_column(final_df.copy())
+        final_df.to_sql('transactions', conn, if_exists='replace', index=False)
+        storage.ensure_source_id(conn)
+        ordering.ensure_order_columns(conn)
+        categorize.recategorize(conn)
+        recurring.update_recurring(conn)
+        anomaly.ensure_anomalies(conn)
+
+        # Display sample data to verify
+        print("\nFirst 5 transactions:")
+        sample = pd.read_sql_query("""
+            SELECT SrNO, Date, TransactionDetails, Amount, "BillingAmountSign-DR,CR"
+            FROM transactions
+            ORDER BY Date
+            LIMIT 5""", conn)
+        print(sample)
+
+        print("\nLast 5 transactions:")
+        sample = pd.read_sql_query("""
+            SELECT SrNO, Date, TransactionDetails, Amount, "BillingAmountSign-DR,CR"
+            FROM transactions
+            ORDER BY Date DESC
+            LIMIT 5""", conn)
+        print(sample)
+
+        # Verify DR/CR distribution
+        print("\nTransaction type distribution:")
+        type_dist = pd.read_sql_query("""
+            SELECT "BillingAmountSign-DR,CR", COUNT(*) as count
+            FROM transactions
+            GROUP BY "BillingAmountSign-DR,CR"
+            """, conn)
+        print(type_dist)
+
+def main():
+    try:
+        excel_file_path = r"C:\Users\seren\OneDrive\Desktop\PythonTransaction\PaytmUPIStatement01Apr23-31Mar24.xlsx"
+        db_path = r"C:\Users\seren\OneDrive\Desktop\NewfolderOne\PaytmUPIStatement.db"
+
+        final_df = extract_transactions_from_excel(excel_file_path)
+        create_database(final_df, db_path)
+        print("\n✅ Data successfully processed and saved to database")
+
+    except Exception as e:
+        print(f"Error processing data: {str(e)}")
+        import traceback
+        print(f"Full error details:\n{traceback.format_exc()}")
+
+if __name__ == "__main__":
+    with instrument.session():
+        main()
@@ -1,132 +1,211 @@
-import sqlite3
+import numpy as np
 import pandas as pd
 import os
-from datetime import datetime
-import pdfplumber
 import re
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from ledger import amounts
+from ledger import anomaly
+from ledger import atomic
+from ledger import categorize
+from ledger import changefeed
+from ledger import dates
+from ledger import dedup
+from ledger import instrument
+from ledger import ordering
+from ledger import pagecache
+from ledger import pdfresources
+from ledger import recurring
+from ledger import storage
+
+# Existing database path
+DB_PATH = r"C:\Users\seren\OneDrive\Desktop\NewfolderOne\PaytmUPIMerge(2023-25)11.db"
+
+# Narration words that make a passbook row a debit or a credit, as in PaytmTransaction.py
+DEBIT_KEYWORDS = ["paid", "payment", "sent", "debited", "purchase", "withdrawn"]
+CREDIT_KEYWORDS = ["received", "credited", "refund", "cashback", "added"]
 
 def extract_transactions_from_pdf(pdf_path):
     """Extract transaction data from Paytm UPI statement PDF"""
     transactions = []
     
     try:
-        with pdfplumber.open(pdf_path) as pdf:
+        with instrument.stage('open'):
+            pdf = pdfresources.open_pdf(pdf_path)
+        with pdf:
             print(f"Processing PDF with {len(pdf.pages)} pages")
             
             for page_num, page in enumerate(pdf.pages, 1):
-                text = page.extract_text()
+                with instrument.stage('page_extract', page=page_num):
+                    text = pagecache.page_text(page)
+                instrument.count('pages')
                 lines = text.split('\n')
                 
-                for line in lines:
-                    if not line.strip():
-                        continue
+                with instrument.stage('parse', page=page_num):
+                    for line in lines:
+                        if not line.strip():
+                            continue
                     
-                    # Pattern for Paytm UPI transactions
-                    # Format typically includes date, transaction details, and amount
-                    pattern = r'(\d{2}(?:-|/)\w{3}(?:-|/)\d{2,4})\s+(.+?)\s+((?:CR|DR)\s*[\d,]+\.?\d*)'
-                    match = re.search(pattern, line)
+                        # Pattern for Paytm UPI transactions
+                        # Format typically includes date, transaction details, and amount
+                        pattern = r'(\d{2}(?:-|/)\w{3}(?:-|/)\d{2,4})\s+(.+?)\s+((?:CR|DR)\s*[\d,]+\.?\d*)'
+                        match = re.search(pattern, line)
+                        id_match = re.search(r'(?:UPI Ref(?:erence)?\.? No\.?|UTR(?: No\.?)?)\s*:?\s*(\w+)', line, re.IGNORECASE)
                     
-                    if match:
-                        try:
-                            date_str, details, amount_str = match.groups()
+                        if not match and id_match and transactions and transactions[-1]['SourceTxnId'] is None:
+                            # Reference number printed under the transaction line
+                            transactions[-1]['SourceTxnId'] = id_match.group(1)
+                        elif not match:
+                            instrument.reject('no_match')
+                        else:
+                            try:
+                                date_str, details, amount_str = match.groups()
                             
-                            # Clean amount string and determine transaction type
-                            amount_str = re.sub(r'[^\d.]', '', amount_str)
-                            amount = float(amount_str)
+                                # Clean amount string and determine transaction type
+                                amount_str = re.sub(r'[^\d.]', '', amount_str)
+                                amount = float(amount_str)
                             
-                            # Determine if it's credit (CR) or debit (DR)
-                            billing_sign = 'CR' if 'CR' in line.upper() else 'DR'
+                                # Determine if it's credit (CR) or debit (DR)
+                                billing_sign = 'CR' if 'CR' in line.upper() else 'DR'
                             
-                            transaction = {
-                                'Date': date_str,
-                                'TransactionDetails': details.strip(),
-                                'Amount': amount,
-                                'BillingAmountSign': billing_sign
-                            }
+                                transaction = {
+                                    'Date': date_str,
+                                    'TransactionDetails': details.strip(),
+                                    'Amount': amount,
+                                    'BillingAmountSign': billing_sign,
+                                    'SourceTxnId': id_match.group(1) if id_match else None
+                                }
                             
-                            transactions.append(transaction)
-                            print(f"Processed: {date_str} | {details.strip()} | {amount} | {billing_sign}")
+                                transactions.append(transaction)
+                                instrument.echo(f"Processed: {date_str} | {details.strip()} | {amount} | {billing_sign}")
                             
-                        except Exception as e:
-                            print(f"Error processing line: {line}")
-                            print(f"Error details: {str(e)}")
-                            continue
+                            except Exception as e:
+                                instrument.reject('parse_error', f"{line} ({e})")
+                                continue
     
     except Exception as e:
         print(f"Error processing PDF {pdf_path}: {e}")
-        return pd.DataFrame()
+        raise
     
     if not transactions:
         print("No transactions found in PDF")
         return pd.DataFrame()
         
+    instrument.count('rows', len(transactions))
     df = pd.DataFrame(transactions)
     print(f"\nExtracted {len(df)} transactions from PDF")
     return df
 
-def standardize_date(date_str):
-    """Convert various date formats to a standard format"""
+def extract_transactions_from_excel(excel_path, sheet_name="Passbook Payment History"):
+    """Extract transaction data from the Paytm passbook Excel export read by PaytmTransaction.py"""
     try:
-        if isinstance(date_str, str):
-            for fmt in ['%d-%b-%y', '%d-%b-%Y', '%d %b %Y', '%Y-%m-%d']:
-                try:
-                    return datetime.strptime(date_str, fmt).strftime('%Y-%m-%d')
-                except ValueError:
-                    continue
-        elif isinstance(date_str, pd.Timestamp):
-            return date_str.strftime('%Y-%m-%d')
-        return date_str
+        with instrument.stage('open'):
+            df = pd.read_excel(excel_path, sheet_name=sheet_name)
+        
+        details_col = next((col for col in ("Transaction Details", "Transaction_Details") if col in df.columns), None)
+        if details_col is None:
+            raise ValueError("Transaction Details column not found in Excel file")
+        
+        # DR/CR from the narration, else from the sign of the amount
+        signed_amounts = amounts.to_rupees(df["Amount"])
+        details = df[details_col].astype(str).str.lower()
+        is_debit = np.where(details.str.contains("|".join(DEBIT_KEYWORDS)), True,
+                            np.where(details.str.contains("|".join(CREDIT_KEYWORDS)), False, signed_amounts < 0))
+        
+        transactions = pd.DataFrame({
+            'Date': df["Date"],
+            'TransactionDetails': df[details_col],
+            'Amount': np.abs(signed_amounts),
+            'BillingAmountSign': np.where(is_debit, 'DR', 'CR'),
+            # UPI reference number (Order ID when it is missing)
+            'SourceTxnId': dedup.source_ids(df),
+        })
+        # The export lists the newest payment first
+        order = np.argsort(dates.to_datetime64(transactions['Date']), kind='stable')
+        transactions = transactions.iloc[order].reset_index(drop=True)
+        
     except Exception as e:
-        print(f"Date conversion error for {date_str}: {e}")
-        return date_str
+        print(f"Error processing Excel {excel_path}: {e}")
+        raise
+    
+    instrument.count('rows', len(transactions))
+    print(f"\nExtracted {len(transactions)} transactions from Excel")
+    return transactions
+
+def extract_transactions(path):
+    """Extract transaction data from a Paytm PDF statement or passbook Excel export"""
+    if path.lower().endswith(('.xls', '.xlsx')):
+        return extract_transactions_from_excel(path)
+    return extract_transactions_from_pdf(path)
 
-def append_new_transactions(pdf_path):
+def append_new_transactions(pdf_path, db_path=DB_PATH, conn=None, transactions=None):
     """Append new transactions from PDF to existing database"""
-    db_path = r"C:\Users\seren\OneDrive\Desktop\NewfolderOne\PaytmUPIMerge(2023-25)11.db"
     
     try:
         # Extract transactions from new PDF
         print(f"Processing new PDF: {pdf_path}")
-        new_transactions = extract_transactions_from_pdf(pdf_path)
+        # Rows a parser worker already extracted (ledger.writer) are used as they are
+        if transactions is None:
+            new_transactions = extract_transactions(pdf_path)
+        else:
+            new_transactions = transactions
         
         if new_transactions.empty:
             print("No new transactions found in PDF")
             return
             
-        # Standardize dates in new transactions
-        new_transactions['Date'] = new_transactions['Date'].apply(standardize_date)
+        # Standardize dates in new transactions to DD-Mon-YY, as stored by the create and merge scripts
+        new_transactions['Date'] = dates.format_dates(new_transactions['Date'], '%d-%b-%y')
         
         # Connect to existing database
-        conn = sqlite3.connect(db_path)
+        own_conn = conn is None
+        if own_conn:
+            conn = storage.connect(db_path)
         
-        # Get existing transactions
-        existing_df = pd.read_sql_query("SELECT * FROM transactions", conn)
+        # Databases written by older versions of these scripts are migrated in place, all or nothing
+        with atomic.savepoint(conn):
+            storage.ensure_amount_paise(conn)
+            storage.ensure_source_id(conn)
+            ordering.ensure_order_columns(conn)
+            dedup.ensure_dedup_index(conn)
+            categorize.ensure_category_columns(conn)
+            changefeed.ensure_changefeed(conn)
+            # Applies rule edits made since the last run
+            categorize.recategorize(conn)
+            anomaly.ensure_anomalies(conn)
         
-        # Get the last SrNo
-        last_srno = existing_df['SrNo'].max() if not existing_df.empty else 0
+        amounts.add_paise_column(new_transactions)
         
-        # Check for duplicates
-        merged_df = pd.concat([existing_df, new_transactions])
-        duplicates = merged_df.duplicated(subset=['Date', 'TransactionDetails', 'Amount'], keep='first')
-        unique_new_transactions = merged_df[~duplicates].iloc[len(existing_df):]
+        # Drop rows already stored, including near-duplicates from overlapping statements
+        duplicates = dedup.find_stored_duplicates(conn, new_transactions)
+        unique_new_transactions = new_transactions[~duplicates].copy()
         
         if len(unique_new_transactions) == 0:
             print("No new unique transactions to add")
-            conn.close()
+            if own_conn:
+                conn.close()
             return
             
-        # Add SrNo to new transactions
-        unique_new_transactions['SrNo'] = range(last_srno + 1, last_srno + len(unique_new_transactions) + 1)
+        # The new rows, their checks and the version bump commit together or not at all
+        with atomic.savepoint(conn):
+            # Stable SrNo and (DateKey, DaySeq) after the rows already stored; existing rows are not renumbered
+            ordering.assign_row_keys(conn, unique_new_transactions, 'Date')
+            categorize.add_category_columns(conn, unique_new_transactions)
         
-        # Insert only the new transactions
-        unique_new_transactions.to_sql('transactions', conn, if_exists='append', index=False)
+            # Insert only the new transactions
+            # Databases built by the create script rather than the merge script spell some columns differently
+            atomic.insert_rows(conn, storage.match_columns(conn, unique_new_transactions))
+            recurring.update_recurring(conn)
+            anomaly.print_alerts(anomaly.update_anomalies(conn))
+            storage.bump_version(conn)
         
         print(f"\nSuccessfully added {len(unique_new_transactions)} new transactions")
         print("\nNewly added transactions:")
         print(unique_new_transactions[['Date', 'TransactionDetails', 'Amount', 'BillingAmountSign']].head())
         
-        conn.commit()
-        conn.close()
+        if own_conn:
+            conn.close()
         
     except Exception as e:
         print(f"Error appending transactions: {e}")
@@ -135,16 +214,17 @@ def append_new_transactions(pdf_path):
 def verify_database(db_path):
     """Verify database contents and integrity"""
     try:
-        conn = sqlite3.connect(db_path)
+        conn = storage.connect(db_path, readonly=True)
+        paise = storage.amount_paise_sql(storage.table_columns(conn))
         
         # Get basic statistics
-        stats = pd.read_sql_query("""
+        stats = pd.read_sql_query(f"""
             SELECT 
                 COUNT(*) as total_transactions,
                 MIN(Date) as earliest_date,
                 MAX(Date) as latest_date,
-                SUM(CASE WHEN BillingAmountSign = 'DR' THEN Amount ELSE 0 END) as total_debits,
-                SUM(CASE WHEN BillingAmountSign = 'CR' THEN Amount ELSE 0 END) as total_credits
+                SUM(CASE WHEN BillingAmountSign = 'DR' THEN {paise} ELSE 0 END) / 100.0 as total_debits,
+                SUM(CASE WHEN BillingAmountSign = 'CR' THEN {paise} ELSE 0 END) / 100.0 as total_credits
             FROM transactions
         """, conn)
         
@@ -160,13 +240,13 @@ def verify_database(db_path):
         print(f"Error verifying database: {e}")
 
 if __name__ == "__main__":
-    # Example usage
-    pdf_path = r"C:\Users\seren\OneDrive\Desktop\PythonTransaction\new_phonepe_statement.pdf"
-    db_path = r"C:\Users\seren\OneDrive\Desktop\NewfolderOne\PaytmUPIMerge(2023-25)11.db"
+    with instrument.session():
+        # Example usage
+        pdf_path = r"C:\Users\seren\OneDrive\Desktop\PythonTransaction\new_phonepe_statement.pdf"
+        db_path = r"C:\Users\seren\OneDrive\Desktop\NewfolderOne\PaytmUPIMerge(2023-25)11.db"
     
-    # Append new transactions
-    append_new_transactions(pdf_path)
+        # Append new transactions
+        append_new_transactions(pdf_path)
     
-    # Verify database after update
-    verify_database(db_path)
-
+        # Verify database after update
+        verify_database(db_path)
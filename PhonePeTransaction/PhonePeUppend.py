@@ -1,75 +1,103 @@
-import sqlite3
 import pandas as pd
 import os
-from datetime import datetime
-import pdfplumber
 import re
+import sys
 
-def standardize_date(date_str):
-    """Convert various date formats to a standard format"""
-    try:
-        if isinstance(date_str, str):
-            for fmt in ['%d-%b-%y', '%d-%b-%Y', '%d %b %Y', '%Y-%m-%d', '%d/%m/%Y']:
-                try:
-                    return datetime.strptime(date_str, fmt).strftime('%d-%b-%y')
-                except ValueError:
-                    continue
-        elif isinstance(date_str, pd.Timestamp):
-            return date_str.strftime('%d-%b-%y')
-        return date_str
-    except Exception as e:
-        print(f"Date conversion error for {date_str}: {e}")
-        return date_str
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from ledger import amounts
+from ledger import anomaly
+from ledger import atomic
+from ledger import categorize
+from ledger import changefeed
+from ledger import dates
+from ledger import dedup
+from ledger import instrument
+from ledger import ordering
+from ledger import pagecache
+from ledger import pdfresources
+from ledger import recurring
+from ledger import storage
+
+# Existing database path
+DB_PATH = r"C:\Users\seren\OneDrive\Desktop\PythonTransaction\PhonePeMerge(2023-25).db"
 
 def extract_transactions_from_pdf(pdf_path):
     """Extract transaction data from PhonePe statement PDF"""
     transactions = []
+    current_transaction = {}
     
     try:
-        with pdfplumber.open(pdf_path) as pdf:
+        with instrument.stage('open'):
+            pdf = pdfresources.open_pdf(pdf_path)
+        with pdf:
             for page in pdf.pages:
-                text = page.extract_text()
+                with instrument.stage('page_extract', page=page.page_number):
+                    text = pagecache.page_text(page)
+                instrument.count('pages')
                 lines = text.split('\n')
                 
-                # Adjust this pattern based on your PhonePe PDF format
-                pattern = r'(\d{2}/\d{2}/\d{4})\s+(.*?)\s+([\d,]+\.\d{2})\s+(CR|DR)'
-                
-                for line in lines:
-                    match = re.search(pattern, line)
-                    if match:
-                        date, details, amount, trans_type = match.groups()
-                        # Convert date format from DD/MM/YYYY to DD-MMM-YY
-                        date_obj = datetime.strptime(date, '%d/%m/%Y')
-                        formatted_date = date_obj.strftime('%d-%b-%y')
+                # 'Feb 16, 2024 Paid to X Debit INR 120.00' lines, as read by phonepay.py
+                with instrument.stage('parse', page=page.page_number):
+                    for line in lines:
+                        line = line.strip()
+                        date_match = re.search(r'(Jan|Feb|Mar|Apr|May|Jun|Jul|Aug|Sep|Oct|Nov|Dec)\s+(\d{1,2}),?\s+(\d{4})', line)
                         
-                        # Remove commas from amount and convert to float
-                        amount = float(amount.replace(',', ''))
+                        if date_match:
+                            if current_transaction.get('Amount') is not None:
+                                transactions.append(current_transaction)
+                            
+                            trans_type = 'Debit' if 'Debit' in line else 'Credit' if 'Credit' in line else None
+                            amount_match = re.search(r'INR\s*(\d+\.?\d*)', line)
+                            description = line[date_match.end():].strip()
+                            if trans_type:
+                                description = description.split(trans_type)[0].strip()
+                            
+                            current_transaction = {
+                                'Date': '{} {}, {}'.format(*date_match.groups()),
+                                'TransactionDetails': description,
+                                'Amount': amount_match.group(1) if amount_match else None,
+                                'BillingAmountSign': 'Dr' if trans_type == 'Debit' else 'Cr' if trans_type == 'Credit' else None,
+                                'SourceTxnId': None
+                            }
                         
-                        # Set billing sign based on transaction type
-                        billing_sign = '+' if trans_type == 'CR' else '-'
+                        # The id line follows the transaction it belongs to
+                        elif current_transaction and re.match(r'Transaction ID\b', line):
+                            current_transaction['SourceTxnId'] = line[len('Transaction ID'):].strip(' :') or None
                         
-                        transactions.append({
-                            'Date': formatted_date,
-                            'TransactionDetails': details.strip(),
-                            'Amount': amount,
-                            'BillingAmountSign': billing_sign
-                        })
+                        # Amount printed on the line after the date line
+                        elif current_transaction and current_transaction['Amount'] is None:
+                            amount_match = re.search(r'(\d+\.?\d*)\s*$', line)
+                            if amount_match and float(amount_match.group(1)) > 0:
+                                current_transaction['Amount'] = amount_match.group(1)
+                        
+                        else:
+                            instrument.reject('no_match')
+            
+            if current_transaction.get('Amount') is not None:
+                transactions.append(current_transaction)
     
     except Exception as e:
         print(f"Error processing PDF {pdf_path}: {e}")
         raise
     
-    return pd.DataFrame(transactions)
+    df = pd.DataFrame(transactions, columns=['Date', 'TransactionDetails', 'Amount', 'BillingAmountSign', 'SourceTxnId'])
+    # Dates to DD-Mon-YY and amounts to rupees for the whole statement
+    df['Date'] = dates.format_dates(df['Date'], '%d-%b-%y')
+    df['Amount'] = amounts.to_rupees(df['Amount'])
+    instrument.count('rows', len(df))
+    return df
 
-def append_new_transactions(pdf_path):
+def append_new_transactions(pdf_path, db_path=DB_PATH, conn=None, transactions=None):
     """Append new transactions from PDF to existing database"""
-    # Existing database path
-    db_path = r"C:\Users\seren\OneDrive\Desktop\PythonTransaction\PhonePeMerge(2023-25).db"
     
     try:
         # Extract transactions from new PDF
         print(f"Processing new PDF: {pdf_path}")
-        new_transactions = extract_transactions_from_pdf(pdf_path)
+        # Rows a parser worker already extracted (ledger.writer) are used as they are
+        if transactions is None:
+            new_transactions = extract_transactions_from_pdf(pdf_path)
+        else:
+            new_transactions = transactions
         
         if new_transactions.empty:
             print("No new transactions found in PDF")
@@ -78,42 +106,53 @@ def append_new_transactions(pdf_path):
         print(f"Found {len(new_transactions)} new transactions")
         
         # Connect to existing database
-        conn = sqlite3.connect(db_path)
-        
-        # Get existing transactions
-        existing_df = pd.read_sql_query("SELECT * FROM transactions", conn)
-        
-        # Get the last SrNo from existing database
-        last_srno = existing_df['SrNo'].max() if not existing_df.empty else 0
-        
-        # Check for duplicates based on Date, Amount, and TransactionDetails
-        merged_df = pd.concat([existing_df, new_transactions])
-        duplicates = merged_df.duplicated(subset=['Date', 'TransactionDetails', 'Amount'], keep='first')
-        unique_transactions = merged_df[~duplicates]
-        
-        # Sort by date
-        unique_transactions['Date'] = pd.to_datetime(unique_transactions['Date'], format='%d-%b-%y')
-        unique_transactions = unique_transactions.sort_values('Date')
-        unique_transactions['Date'] = unique_transactions['Date'].dt.strftime('%d-%b-%y')
-        
-        # Reassign SrNo after sorting
-        unique_transactions['SrNo'] = range(1, len(unique_transactions) + 1)
-        
-        # Save back to database
-        unique_transactions.to_sql('transactions', conn, if_exists='replace', index=False)
-        
-        # Create index on date
-        conn.execute('CREATE INDEX IF NOT EXISTS idx_date ON transactions(Date)')
-        
-        conn.commit()
+        own_conn = conn is None
+        if own_conn:
+            conn = storage.connect(db_path)
+        
+        # Databases written by older versions of these scripts are migrated in place, all or nothing
+        with atomic.savepoint(conn):
+            storage.ensure_amount_paise(conn)
+            storage.ensure_source_id(conn)
+            ordering.ensure_order_columns(conn)
+            dedup.ensure_dedup_index(conn)
+            categorize.ensure_category_columns(conn)
+            changefeed.ensure_changefeed(conn)
+            # Applies rule edits made since the last run
+            categorize.recategorize(conn)
+            anomaly.ensure_anomalies(conn)
+        
+        # Only the row count: dedup looks up the stored rows it needs
+        existing_count = conn.execute("SELECT COUNT(*) FROM transactions").fetchone()[0]
+        
+        amounts.add_paise_column(new_transactions)
+        
+        # Drop rows already stored, including near-duplicates from overlapping statements
+        duplicates = dedup.find_stored_duplicates(conn, new_transactions)
+        unique_new_transactions = new_transactions[~duplicates].copy()
+        
+        # The new rows, their checks and the version bump commit together or not at all
+        with atomic.savepoint(conn):
+            # Stored rows keep their SrNo; date order comes from (DateKey, DaySeq), not from rewriting the table
+            ordering.assign_row_keys(conn, unique_new_transactions, 'Date')
+            categorize.add_category_columns(conn, unique_new_transactions)
+            # Databases built by the create script rather than the merge script spell some columns differently
+            atomic.insert_rows(conn, storage.match_columns(conn, unique_new_transactions))
+            recurring.update_recurring(conn)
+            anomaly.print_alerts(anomaly.update_anomalies(conn))
+        
+            # Create index on date
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_date ON transactions(Date)')
+            storage.bump_version(conn)
         
         # Print summary
         print(f"\nDatabase updated successfully:")
-        print(f"Previous number of transactions: {len(existing_df)}")
-        print(f"New transactions added: {len(unique_transactions) - len(existing_df)}")
-        print(f"Total transactions after update: {len(unique_transactions)}")
+        print(f"Previous number of transactions: {existing_count}")
+        print(f"New transactions added: {len(unique_new_transactions)}")
+        print(f"Total transactions after update: {existing_count + len(unique_new_transactions)}")
         
-        conn.close()
+        if own_conn:
+            conn.close()
         
     except Exception as e:
         print(f"Error appending transactions: {e}")
@@ -122,7 +161,8 @@ def append_new_transactions(pdf_path):
 def verify_database(db_path):
     """Verify database contents and integrity"""
     try:
-        conn = sqlite3.connect(db_path)
+        conn = storage.connect(db_path, readonly=True)
+        paise = storage.amount_paise_sql(storage.table_columns(conn))
         cursor = conn.cursor()
         
         # Get basic statistics
@@ -132,8 +172,8 @@ def verify_database(db_path):
         cursor.execute("SELECT MIN(Date), MAX(Date) FROM transactions")
         date_range = cursor.fetchone()
         
-        cursor.execute("""
-            SELECT BillingAmountSign, COUNT(*), SUM(Amount)
+        cursor.execute(f"""
+            SELECT BillingAmountSign, COUNT(*), SUM({paise}) / 100.0
             FROM transactions 
             GROUP BY BillingAmountSign
         """)
@@ -152,12 +192,12 @@ def verify_database(db_path):
         print(f"Error verifying database: {e}")
 
 if __name__ == "__main__":
-    # Example usage
-    pdf_path = r"C:\Users\seren\OneDrive\Desktop\PythonTransaction\new_phonepe_statement.pdf"
-    db_path = r"C:\Users\seren\OneDrive\Desktop\PythonTransaction\PhonePeMerge(2023-25).db"
+    with instrument.session():
+        # Example usage
+        pdf_path = r"C:\Users\seren\OneDrive\Desktop\PythonTransaction\new_phonepe_statement.pdf"
+        db_path = r"C:\Users\seren\OneDrive\Desktop\PythonTransaction\PhonePeMerge(2023-25).db"
     
-    # Append new transactions
-    append_new_transactions(pdf_path)
+        # Append new transactions
+        append_new_transactions(pdf_path)
     
-    # Verify database after update
-
+        # Verify database after update
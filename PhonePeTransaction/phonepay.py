@@ -1,82 +1,92 @@
-import pdfplumber
 import pandas as pd
-import sqlite3
 import re
-from datetime import datetime
 import os
+import sys
 
-def clean_amount(amount_str):
-    if pd.isna(amount_str) or amount_str == 'NA':
-        return 0.0
-    try:
-        return float(re.sub(r'[^\d.]', '', str(amount_str)))
-    except:
-        return 0.0
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from ledger import amounts
+from ledger import anomaly
+from ledger import atomic
+from ledger import categorize
+from ledger import dates
+from ledger import instrument
+from ledger import ordering
+from ledger import pagecache
+from ledger import pdfresources
+from ledger import recurring
+from ledger import storage
 
 def extract_transactions_from_pdf(pdf_path):
     transactions = []
     current_transaction = {}
     
     try:
-        with pdfplumber.open(pdf_path) as pdf:
+        with instrument.stage('open'):
+            pdf = pdfresources.open_pdf(pdf_path)
+        with pdf:
             print(f"Successfully opened PDF with {len(pdf.pages)} pages")
             
             for page_num, page in enumerate(pdf.pages, 1):
-                text = page.extract_text()
+                with instrument.stage('page_extract', page=page_num):
+                    text = pagecache.page_text(page)
+                instrument.count('pages')
                 lines = text.split('\n')
                 
-                for line in lines:
-                    line = line.strip()
-                    if not line or 'Date Transaction Details Type Amount' in line:
-                        continue
+                with instrument.stage('parse', page=page_num):
+                    for line in lines:
+                        line = line.strip()
+                        if not line or 'Date Transaction Details Type Amount' in line:
+                            continue
 
-                    # Modified date pattern to match format "Feb 16, 2024"
-                    date_match = re.search(r'(Jan|Feb|Mar|Apr|May|Jun|Jul|Aug|Sep|Oct|Nov|Dec)\s+(\d{1,2}),?\s+(\d{4})', line)
+                        # Modified date pattern to match format "Feb 16, 2024"
+                        date_match = re.search(r'(Jan|Feb|Mar|Apr|May|Jun|Jul|Aug|Sep|Oct|Nov|Dec)\s+(\d{1,2}),?\s+(\d{4})', line)
                     
-                    if date_match:
-                        # If we have a previous transaction, save it
-                        if current_transaction and current_transaction.get('Amount') is not None:
-                            transactions.append(current_transaction)
+                        if date_match:
+                            # If we have a previous transaction, save it
+                            if current_transaction and current_transaction.get('Amount') is not None:
+                                transactions.append(current_transaction)
+                        
+                            # Extract transaction details
+                            month = date_match.group(1)
+                            day = date_match.group(2)
+                            year = date_match.group(3)
                         
-                        # Extract transaction details
-                        month = date_match.group(1)
-                        day = date_match.group(2)
-                        year = date_match.group(3)
+                            # Kept as text, converted for all rows at the end
+                            date_str = f"{month} {day}, {year}"
                         
-                        # Parse the date
-                        date_str = f"{month} {day}, {year}"
-                        date_obj = datetime.strptime(date_str, '%b %d, %Y')
+                            # Determine transaction type and amount
+                            trans_type = 'Debit' if 'Debit' in line else 'Credit' if 'Credit' in line else None
                         
-                        # Determine transaction type and amount
-                        trans_type = 'Debit' if 'Debit' in line else 'Credit' if 'Credit' in line else None
+                            # Extract amount (kept as text, parsed for all rows at the end)
+                            amount = None
+                            amount_match = re.search(r'INR\s*(\d+\.?\d*)', line)
+                            if amount_match:
+                                amount = amount_match.group(1)
                         
-                        # Extract amount
-                        amount = None
-                        amount_match = re.search(r'INR\s*(\d+\.?\d*)', line)
-                        if amount_match:
-                            amount = clean_amount(amount_match.group(1))
+                            # Get description
+                            description = line[date_match.end():].strip()
+                            if trans_type:
+                                description = description.split(trans_type)[0].strip()
                         
-                        # Get description
-                        description = line[date_match.end():].strip()
-                        if trans_type:
-                            description = description.split(trans_type)[0].strip()
+                            current_transaction = {
+                                'SrNo': str(len(transactions) + 1),
+                                'TransactionDate': date_str,
+                                'TransactionDetails': description,
+                                'Amount': amount,
+                                'BillingAmountSign': 'Dr' if trans_type == 'Debit' else 'Cr' if trans_type == 'Credit' else None,
+                                'SourceTxnId': None
+                            }
                         
-                        current_transaction = {
-                            'SrNo': str(len(transactions) + 1),
-                            'TransactionDate': date_obj.strftime('%d-%b-%y'),
-                            'TransactionDetails': description,
-                            'Amount': amount,
-                            'BillingAmountSign': 'Dr' if trans_type == 'Debit' else 'Cr' if trans_type == 'Credit' else None
-                        }
+                        # 'Transaction ID T2304...' on the line after the date line
+                        elif current_transaction and re.match(r'Transaction ID\b', line):
+                            current_transaction['SourceTxnId'] = line[len('Transaction ID'):].strip(' :') or None
                         
-                    # If amount was not on the same line, check for amount in this line
-                    elif current_transaction and (current_transaction['Amount'] is None or current_transaction['Amount'] == 0):
-                        # Try to find amount at the end of the line
-                        amount_match = re.search(r'(\d+\.?\d*)\s*$', line)
-                        if amount_match:
-                            amount = clean_amount(amount_match.group(1))
-                            if amount > 0:  # Only update if we found a valid amount
-                                current_transaction['Amount'] = amount
+                        # If amount was not on the same line, check for amount in this line
+                        elif current_transaction and (current_transaction['Amount'] is None or float(current_transaction['Amount']) == 0):
+                            # Try to find amount at the end of the line
+                            amount_match = re.search(r'(\d+\.?\d*)\s*$', line)
+                            if amount_match and float(amount_match.group(1)) > 0:  # Only update if we found a valid amount
+                                current_transaction['Amount'] = amount_match.group(1)
                         
             # Don't forget to add the last transaction
             if current_transaction and current_transaction.get('Amount') is not None:
@@ -87,9 +97,17 @@ def extract_transactions_from_pdf(pdf_path):
         import traceback
         print(f"Full error details:\n{traceback.format_exc()}")
     
+    formatted_dates = dates.format_dates([t['TransactionDate'] for t in transactions], '%d-%b-%y')
+    parsed_amounts = amounts.to_rupees([t['Amount'] for t in transactions])
+    for transaction, date, amount in zip(transactions, formatted_dates, parsed_amounts):
+        transaction['TransactionDate'] = date
+        transaction['Amount'] = float(amount)
+
+    instrument.count('rows', len(transactions))
+
     # Print summary of extracted transactions
     print(f"\nTotal transactions found: {len(transactions)}")
-    if transactions:
+    if transactions and not instrument.is_quiet():
         print("\nSample transactions:")
         for t in transactions[:5]:  # Show first 5 transactions
             print(f"Found transaction: {t['TransactionDate']} - {t['TransactionDetails']} - {t['Amount']} {t['BillingAmountSign']}")
@@ -108,51 +126,45 @@ def create_database(transactions, db_path):
         'Amount': float,
         'BillingAmountSign': str
     })
+    amounts.add_paise_column(df)
     
-    # Connect to SQLite database
-    conn = sqlite3.connect(db_path)
-    
+    # Built in a temp file that replaces db_path only once complete, so a crash keeps the old database
     try:
-        # Create table manually first
-        create_table_sql = '''
-        CREATE TABLE IF NOT EXISTS transactions (
-            SrNo TEXT,
-            TransactionDate TEXT,
-            TransactionDetails TEXT,
-            Amount REAL,
-            BillingAmountSign TEXT
-        )
-        '''
-        conn.execute(create_table_sql)
-        
-        # Clear existing data
-        conn.execute('DELETE FROM transactions')
+        with atomic.rebuild(db_path) as conn:
+            # Create table manually first
+            create_table_sql = '''
+            CREATE TABLE IF NOT EXISTS transactions (
+                SrNo TEXT,
+                TransactionDate TEXT,
+                TransactionDetails TEXT,
+                Amount REAL,
+                AmountPaise INTEGER,
+                BillingAmountSign TEXT,
+                SourceTxnId TEXT
+            )
+            '''
+            conn.execute(create_table_sql)
         
-        # Insert data
-        for _, row in df.iterrows():
+            # Insert data
             insert_sql = '''
-            INSERT INTO transactions (SrNo, TransactionDate, TransactionDetails, Amount, BillingAmountSign)
-            VALUES (?, ?, ?, ?, ?)
+            INSERT INTO transactions (SrNo, TransactionDate, TransactionDetails, Amount, AmountPaise, BillingAmountSign, SourceTxnId)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
             '''
-            conn.execute(insert_sql, (
-                row['SrNo'],
-                row['TransactionDate'],
-                row['TransactionDetails'],
-                row['Amount'],
-                row['BillingAmountSign']
-            ))
-        
-        # Create index
-        conn.execute('CREATE INDEX IF NOT EXISTS idx_date ON transactions(TransactionDate)')
+            conn.executemany(insert_sql, df[[
+                'SrNo', 'TransactionDate', 'TransactionDetails', 'Amount', 'AmountPaise', 'BillingAmountSign', 'SourceTxnId'
+            ]].itertuples(index=False, name=None))
         
-        # Commit changes
-        conn.commit()
+            # Create indexes
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_date ON transactions(TransactionDate)')
+            storage.ensure_source_id(conn)
+            ordering.ensure_order_columns(conn)
+            categorize.recategorize(conn)
+            recurring.update_recurring(conn)
+            anomaly.ensure_anomalies(conn)
         
     except Exception as e:
         print(f"Error creating database: {e}")
         raise
-    finally:
-        conn.close()
 
 def main():
     pdf_path = r'C:\Users\91861\Downloads/PhonePe_Transaction_Statement 2024-25.pdf'
@@ -179,7 +191,7 @@ def main():
     print(f"Processed {len(transactions)} transactions successfully!")
     
     try:
-        conn = sqlite3.connect(db_path)
+        conn = storage.connect(db_path)
         df = pd.read_sql_query("SELECT * FROM transactions LIMIT 5", conn)
         print("\nSample data:")
         print(df)
@@ -188,7 +200,5 @@ def main():
         print(f"Error displaying sample data: {e}")
 
 if __name__ == "__main__":
-    main()
-
-
-
+    with instrument.session():
+        main()
@@ -1,65 +1,92 @@
-import sqlite3
 import pandas as pd
 import os
-from datetime import datetime
-import pdfplumber
 import re
+import sys
 
-def standardize_date(date_str):
-    """Convert various date formats to a standard format"""
-    try:
-        if isinstance(date_str, str):
-            for fmt in ['%d-%b-%y', '%d-%b-%Y', '%d %b %Y', '%Y-%m-%d']:
-                try:
-                    return datetime.strptime(date_str, fmt).strftime('%d-%b-%y')
-                except ValueError:
-                    continue
-        elif isinstance(date_str, pd.Timestamp):
-            return date_str.strftime('%d-%b-%y')
-        return date_str
-    except Exception as e:
-        print(f"Date conversion error for {date_str}: {e}")
-        return date_str
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from ledger import amounts
+from ledger import anomaly
+from ledger import atomic
+from ledger import categorize
+from ledger import changefeed
+from ledger import cycles
+from ledger import dates
+from ledger import dedup
+from ledger import instrument
+from ledger import ordering
+from ledger import pagecache
+from ledger import pdfresources
+from ledger import recurring
+from ledger import storage
 
-def extract_transactions_from_pdf(pdf_path):
-    """Extract transaction data from SBI credit card statement PDF"""
+# Existing database path
+DB_PATH = r"C:\Users\seren\OneDrive\Desktop\NewfolderOne\SBI_CCMerge_7670.db"
+
+def extract_transactions_from_pdf(pdf_path, statement=None):
+    """Extract transaction data from SBI credit card statement PDF; a statement dict is filled with its header fields"""
     transactions = []
+    current_date = None
     
     try:
-        with pdfplumber.open(pdf_path) as pdf:
+        with instrument.stage('open'):
+            pdf = pdfresources.open_pdf(pdf_path)
+        with pdf:
             for page in pdf.pages:
-                text = page.extract_text()
+                with instrument.stage('page_extract', page=page.page_number):
+                    text = pagecache.page_text(page)
+                instrument.count('pages')
+                if statement is not None and page.page_number <= cycles.HEADER_PAGES:
+                    cycles.parse_summary(text, statement)
                 lines = text.split('\n')
                 
-                pattern = r'(\d{2}-[A-Za-z]{3}-\d{2})\s+(.*?)\s+([-+]?\d+\.?\d*)'
-                
-                for line in lines:
-                    match = re.search(pattern, line)
-                    if match:
-                        date, details, amount = match.groups()
-                        billing_sign = '-' if float(amount) < 0 else '+'
-                        amount = abs(float(amount))
-                        
+                # 'DD Mon YY DETAILS 1,234.00 D', as read by SBI_CC_7670.py; same-day rows omit the date
+                with instrument.stage('parse', page=page.page_number):
+                    for line in lines:
+                        match = re.match(r"(\d{2} \w{3} \d{2}) (.+?) (\d{1,3}(?:,\d{3})*(?:\.\d{2})?) ([MDC])$", line)
+                        if match:
+                            date, details, amount, sign = match.groups()
+                            current_date = date
+                        else:
+                            match = re.match(r"(.+?) (\d{1,3}(?:,\d{3})*(?:\.\d{2})?) ([MDC])$", line)
+                            if match and current_date:
+                                details, amount, sign = match.groups()
+                                date = current_date
+                            else:
+                                instrument.reject('no_match')
+                                continue
+
+                        # The statement's D/C/M letter is kept as the sign, as the create and merge scripts do
                         transactions.append({
                             'Date': date,
                             'TransactionDetails': details.strip(),
                             'Amount': amount,
-                            'BillingAmountSign': billing_sign
+                            'BillingAmountSign': sign
                         })
     
     except Exception as e:
         print(f"Error processing PDF {pdf_path}: {e}")
+        raise
     
-    return pd.DataFrame(transactions)
+    df = pd.DataFrame(transactions, columns=['Date', 'TransactionDetails', 'Amount', 'BillingAmountSign'])
+    # Dates to DD-Mon-YY and amounts to rupees for the whole statement, as the merge script stores them
+    df['Date'] = dates.format_dates(df['Date'], '%d-%b-%y')
+    df['Amount'] = amounts.to_rupees(df['Amount'])
+    instrument.count('rows', len(df))
+    return df
 
-def append_new_transactions(pdf_path):
+def append_new_transactions(pdf_path, db_path=DB_PATH, conn=None, transactions=None, statement=None):
     """Append new transactions from PDF to existing database"""
-    db_path = r"C:\Users\seren\OneDrive\Desktop\NewfolderOne\SBI_CCMerge_7670.db"
     
     try:
         # Extract transactions from new PDF
         print(f"Processing PDF: {pdf_path}")
-        new_transactions = extract_transactions_from_pdf(pdf_path)
+        # Rows a parser worker already extracted (ledger.writer) are used as they are,
+        # with the header it read alongside them; the PDF is not opened again here
+        if transactions is None:
+            statement = {}
+            new_transactions = extract_transactions_from_pdf(pdf_path, statement)
+        else:
+            new_transactions = transactions
         
         if new_transactions.empty:
             print("No transactions found in PDF")
@@ -68,29 +95,56 @@ def append_new_transactions(pdf_path):
         print(f"Found {len(new_transactions)} potential new transactions")
         
         # Connect to existing database
-        conn = sqlite3.connect(db_path)
-        
-        # Get existing transactions
-        existing_df = pd.read_sql_query("SELECT * FROM transactions", conn)
-        
-        # Get the last SrNo
-        last_srno = existing_df['SrNo'].max() if not existing_df.empty else 0
-        
-        # Check for duplicates
-        merged_df = pd.concat([existing_df, new_transactions])
-        duplicates = merged_df.duplicated(subset=['Date', 'TransactionDetails', 'Amount'], keep='first')
-        unique_new_transactions = merged_df[~duplicates].iloc[len(existing_df):]
+        own_conn = conn is None
+        if own_conn:
+            conn = storage.connect(db_path)
+        
+        # Databases written by older versions of these scripts are migrated in place, all or nothing
+        with atomic.savepoint(conn):
+            storage.ensure_amount_paise(conn)
+            ordering.ensure_order_columns(conn)
+            dedup.ensure_dedup_index(conn)
+            categorize.ensure_category_columns(conn)
+            cycles.ensure_cycles(conn)
+            changefeed.ensure_changefeed(conn)
+            # Applies rule edits made since the last run
+            categorize.recategorize(conn)
+            anomaly.ensure_anomalies(conn)
+        
+        # Only the row count: dedup looks up the stored rows it needs
+        existing_count = conn.execute("SELECT COUNT(*) FROM transactions").fetchone()[0]
+        
+        amounts.add_paise_column(new_transactions)
+        # Cycle totals come from the whole statement, including rows already stored from an overlapping one
+        cycle = cycles.statement_cycle(new_transactions, statement, 'Date')
+        
+        # Drop rows already stored, including near-duplicates from overlapping statements
+        duplicates = dedup.find_stored_duplicates(conn, new_transactions)
+        unique_new_transactions = new_transactions[~duplicates].copy()
         
         if len(unique_new_transactions) == 0:
             print("No new unique transactions to add")
-            conn.close()
+            # Its rows came in with an overlapping statement, but this statement's cycle is still new
+            with atomic.savepoint(conn):
+                cycles.record_cycle(conn, cycle)
+            if own_conn:
+                conn.close()
             return
             
-        # Add SrNo to new transactions
-        unique_new_transactions['SrNo'] = range(last_srno + 1, last_srno + len(unique_new_transactions) + 1)
-        
-        # Insert only the new transactions
-        unique_new_transactions.to_sql('transactions', conn, if_exists='append', index=False)
+        # The new rows, their checks and the version bump commit together or not at all
+        with atomic.savepoint(conn):
+            # Stable SrNo and (DateKey, DaySeq) after the rows already stored; existing rows are not renumbered
+            ordering.assign_row_keys(conn, unique_new_transactions, 'Date')
+            categorize.add_category_columns(conn, unique_new_transactions)
+            cycles.tag_rows(unique_new_transactions, cycle)
+        
+            # Insert only the new transactions
+            # Databases built by the create script rather than the merge script spell some columns differently
+            atomic.insert_rows(conn, storage.match_columns(conn, unique_new_transactions))
+            recurring.update_recurring(conn)
+            anomaly.print_alerts(anomaly.update_anomalies(conn))
+            cycles.record_cycle(conn, cycle)
+            storage.bump_version(conn)
         
         print(f"\nSuccessfully added {len(unique_new_transactions)} new transactions")
         print("\nNewly added transactions:")
@@ -98,23 +152,24 @@ def append_new_transactions(pdf_path):
         
         # Display summary statistics
         print("\nDatabase Summary:")
-        total_transactions = len(existing_df) + len(unique_new_transactions)
-        print(f"Previous transactions: {len(existing_df)}")
+        total_transactions = existing_count + len(unique_new_transactions)
+        print(f"Previous transactions: {existing_count}")
         print(f"New transactions added: {len(unique_new_transactions)}")
         print(f"Total transactions: {total_transactions}")
         
         # Show latest transactions
         print("\nLatest 5 transactions in database:")
-        latest = pd.read_sql_query("""
-            SELECT Date, TransactionDetails, Amount, BillingAmountSign 
+        shown = storage.match_columns(conn, unique_new_transactions[['Date', 'TransactionDetails', 'Amount', 'BillingAmountSign']])
+        latest = pd.read_sql_query(f"""
+            SELECT {', '.join(f'"{col}"' for col in shown.columns)}
             FROM transactions 
-            ORDER BY Date DESC 
+            ORDER BY DateKey DESC, DaySeq DESC
             LIMIT 5
         """, conn)
         print(latest)
         
-        conn.commit()
-        conn.close()
+        if own_conn:
+            conn.close()
         
     except Exception as e:
         print(f"Error appending transactions: {e}")
@@ -123,16 +178,17 @@ def append_new_transactions(pdf_path):
 def verify_database(db_path):
     """Verify database contents and integrity"""
     try:
-        conn = sqlite3.connect(db_path)
+        conn = storage.connect(db_path, readonly=True)
+        paise = storage.amount_paise_sql(storage.table_columns(conn))
         
         # Get basic statistics
-        stats = pd.read_sql_query("""
+        stats = pd.read_sql_query(f"""
             SELECT 
                 COUNT(*) as total_transactions,
                 MIN(Date) as earliest_date,
                 MAX(Date) as latest_date,
-                SUM(CASE WHEN BillingAmountSign = '-' THEN Amount ELSE 0 END) as total_debits,
-                SUM(CASE WHEN BillingAmountSign = '+' THEN Amount ELSE 0 END) as total_credits
+                SUM(CASE WHEN BillingAmountSign = '-' THEN {paise} ELSE 0 END) / 100.0 as total_debits,
+                SUM(CASE WHEN BillingAmountSign = '+' THEN {paise} ELSE 0 END) / 100.0 as total_credits
             FROM transactions
         """, conn)
         
@@ -148,12 +204,12 @@ def verify_database(db_path):
         print(f"Error verifying database: {e}")
 
 if __name__ == "__main__":
-    # Example usage
-    pdf_path = r"C:\Users\seren\OneDrive\Desktop\PythonTransaction\new_statement.pdf"
-    db_path = r"C:\Users\seren\OneDrive\Desktop\NewfolderOne\SBI_CCMerge_7670.db"
+    with instrument.session():
+        # Example usage
+        pdf_path = r"C:\Users\seren\OneDrive\Desktop\PythonTransaction\new_statement.pdf"
+        db_path = r"C:\Users\seren\OneDrive\Desktop\NewfolderOne\SBI_CCMerge_7670.db"
     
-    # Append new transactions
-    append_new_transactions(pdf_path)
+        # Append new transactions
+        append_new_transactions(pdf_path)
     
-    # Verify database after update
-
+        # Verify database after update
@@ -1,128 +1,151 @@
-import pdfplumber
 import pandas as pd
 import re
-import sqlite3
 import os
+import sys
 from datetime import datetime
 
-# Load PDF and extract transactions
-pdf_path = r"C:\Users\seren\OneDrive\Desktop\PythonTransaction\SBICardStatement_7670_01-03-2024.pdf"
-db_path = r"C:\Users\seren\OneDrive\Desktop\PythonTransaction\SBI_CC_7670(T1).db"
-transactions = []
-current_date = None
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from ledger import amounts
+from ledger import anomaly
+from ledger import atomic
+from ledger import categorize
+from ledger import cycles
+from ledger import instrument
+from ledger import ordering
+from ledger import pagecache
+from ledger import pdfresources
+from ledger import recurring
 
-# Delete existing database file if it exists
-if os.path.exists(db_path):
-    try:
-        os.remove(db_path)
-        print(f"Removed existing database: {db_path}")
-    except Exception as e:
-        print(f"Error removing existing database: {e}")
-        exit(1)
+def extract_transactions_from_pdf(pdf_path):
+    """Extract transactions from SBI card statement PDF"""
+    transactions = []
+    current_date = None
 
-# Extract data from PDF
-try:
-    with pdfplumber.open(pdf_path) as pdf:
+    with instrument.stage('open'):
+        pdf = pdfresources.open_pdf(pdf_path)
+    with pdf:
         for page in pdf.pages:
-            text = page.extract_text()
+            with instrument.stage('page_extract', page=page.page_number):
+                text = pagecache.page_text(page)
+            instrument.count('pages')
             lines = text.split('\n')
-            for line in lines:
-                # Pattern: Full line with date
-                match = re.match(r"(\d{2} \w{3} \d{2}) (.+?) (\d{1,3}(?:,\d{3})*(?:\.\d{2})?) ([MDC])$", line)
-                if match:
-                    date, details, amount, sign = match.groups()
-                    current_date = date
-                else:
-                    # Pattern: Line without date
-                    match = re.match(r"(.+?) (\d{1,3}(?:,\d{3})*(?:\.\d{2})?) ([MDC])$", line)
-                    if match and current_date:
-                        details, amount, sign = match.groups()
-                        date = current_date
+            with instrument.stage('parse', page=page.page_number):
+                for line in lines:
+                    # Pattern: Full line with date
+                    match = re.match(r"(\d{2} \w{3} \d{2}) (.+?) (\d{1,3}(?:,\d{3})*(?:\.\d{2})?) ([MDC])$", line)
+                    if match:
+                        date, details, amount, sign = match.groups()
+                        current_date = date
                     else:
-                        continue
-
-                amount = float(amount.replace(',', ''))
-                transactions.append({
-                    'Date': date,
-                    'Transaction_Details': details.strip(),
-                    'Amount': amount,
-                    'BillingAmountSign': sign
-                })
-except Exception as e:
-    print(f"Error reading PDF: {e}")
-    exit(1)
-
-if not transactions:
-    print("No transactions found in PDF!")
-    exit(1)
-
-# Convert to DataFrame
-df = pd.DataFrame(transactions)
-
-# Convert dates to datetime for proper sorting
-df['Date'] = pd.to_datetime(df['Date'], format='%d %b %y')
-
-# Sort by date
-df = df.sort_values('Date')
-
-# Convert back to original format
-df['Date'] = df['Date'].dt.strftime('%d %b %y')
-
-# Create and populate database
-try:
-    # Create new database connection
-    conn = sqlite3.connect(db_path)
-    cursor = conn.cursor()
-
-    # Create table
-    cursor.execute('''
-    CREATE TABLE IF NOT EXISTS transactions (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        Date TEXT NOT NULL,
-        Transaction_Details TEXT NOT NULL,
-        Amount REAL NOT NULL,
-        BillingAmountSign TEXT NOT NULL
-    )
-    ''')
-
-    # Insert data row by row (now in sorted order)
-    for _, row in df.iterrows():
-        cursor.execute('''
-        INSERT INTO transactions (Date, Transaction_Details, Amount, BillingAmountSign)
-        VALUES (?, ?, ?, ?)
-        ''', (
-            row['Date'],
-            row['Transaction_Details'],
-            row['Amount'],
-            row['BillingAmountSign']
-        ))
-
-    # Create index
-    cursor.execute('CREATE INDEX IF NOT EXISTS idx_date ON transactions(Date)')
-    
-    # Commit changes
-    conn.commit()
-    
-    print(f"✅ Successfully saved {len(df)} transactions to database")
-    
-    # Verify data
-    cursor.execute("SELECT COUNT(*) FROM transactions")
-    count = cursor.fetchone()[0]
-    print(f"Total records in database: {count}")
-    
-    # Show sample data
-    print("\nSample data from database:")
-    cursor.execute("SELECT * FROM transactions LIMIT 5")
-    for row in cursor.fetchall():
-        print(row)
-
-except Exception as e:
-    print(f"Error creating/populating database: {e}")
-    if os.path.exists(db_path):
-        os.remove(db_path)
-    raise
-
-finally:
-    if 'conn' in locals():
-        conn.close()
+                        # Pattern: Line without date
+                        match = re.match(r"(.+?) (\d{1,3}(?:,\d{3})*(?:\.\d{2})?) ([MDC])$", line)
+                        if match and current_date:
+                            details, amount, sign = match.groups()
+                            date = current_date
+                        else:
+                            instrument.reject('no_match')
+                            continue
+
+                    amount = float(amount.replace(',', ''))
+                    transactions.append({
+                        'Date': date,
+                        'Transaction_Details': details.strip(),
+                        'Amount': amount,
+                        'BillingAmountSign': sign
+                    })
+
+    instrument.count('rows', len(transactions))
+    return transactions
+
+def create_database(transactions, db_path, statement=None):
+    # Convert to DataFrame
+    df = pd.DataFrame(transactions)
+
+    # Convert dates to datetime for proper sorting
+    df['Date'] = pd.to_datetime(df['Date'], format='%d %b %y')
+
+    # Sort by date
+    df = df.sort_values('Date')
+
+    # Convert back to original format
+    df['Date'] = df['Date'].dt.strftime('%d %b %y')
+    amounts.add_paise_column(df)
+
+    # Every row belongs to this statement's billing cycle
+    cycle = cycles.statement_cycle(df, statement, 'Date')
+    cycles.tag_rows(df, cycle)
+
+    # Built in a temp file that replaces db_path only once complete, so a crash keeps the old database
+    try:
+        with atomic.rebuild(db_path) as conn:
+            cursor = conn.cursor()
+
+            # Create table
+            cursor.execute('''
+            CREATE TABLE IF NOT EXISTS transactions (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                Date TEXT NOT NULL,
+                Transaction_Details TEXT NOT NULL,
+                Amount REAL NOT NULL,
+                AmountPaise INTEGER NOT NULL,
+                BillingAmountSign TEXT NOT NULL,
+                StatementDate TEXT
+            )
+            ''')
+
+            # Insert data (now in sorted order)
+            cursor.executemany('''
+            INSERT INTO transactions (Date, Transaction_Details, Amount, AmountPaise, BillingAmountSign, StatementDate)
+            VALUES (?, ?, ?, ?, ?, ?)
+            ''', df[[
+                'Date', 'Transaction_Details', 'Amount', 'AmountPaise', 'BillingAmountSign', 'StatementDate'
+            ]].itertuples(index=False, name=None))
+
+            # Create index
+            cursor.execute('CREATE INDEX IF NOT EXISTS idx_date ON transactions(Date)')
+            ordering.ensure_order_columns(conn)
+            categorize.recategorize(conn)
+            recurring.update_recurring(conn)
+            anomaly.ensure_anomalies(conn)
+            cycles.record_cycle(conn, cycle)
+
+            print(f"✅ Successfully saved {len(df)} transactions to database")
+
+            # Verify data
+            cursor.execute("SELECT COUNT(*) FROM transactions")
+            count = cursor.fetchone()[0]
+            print(f"Total records in database: {count}")
+
+            # Show sample data
+            print("\nSample data from database:")
+            cursor.execute("SELECT * FROM transactions LIMIT 5")
+            for row in cursor.fetchall():
+                instrument.echo(row)
+
         print(f"✅ Successfully saved {len(df)} transactions to '{db_path}' in table 'transactions'")
+
+    except Exception as e:
+        print(f"Error creating/populating database: {e}")
+        raise
+
+def main():
+    # Load PDF and extract transactions
+    pdf_path = r"C:\Users\seren\OneDrive\Desktop\PythonTransaction\SBICardStatement_7670_01-03-2024.pdf"
+    db_path = r"C:\Users\seren\OneDrive\Desktop\PythonTransaction\SBI_CC_7670(T1).db"
+
+    # Extract data from PDF
+    try:
+        transactions = extract_transactions_from_pdf(pdf_path)
+    except Exception as e:
+        print(f"Error reading PDF: {e}")
+        exit(1)
+
+    if not transactions:
+        print("No transactions found in PDF!")
+        exit(1)
+
+    create_database(transactions, db_path, cycles.read_statement(pdf_path))
+
+if __name__ == "__main__":
+    with instrument.session():
+        main()
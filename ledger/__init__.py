@@ -0,0 +1,6 @@
+"""Shared helpers for the per-account statement scripts.
+
+Each account folder (DBS_CC_2009, ICICI_SA_0090, ...) keeps its own
+extract / append / merge scripts. This package holds the pieces they
+share, such as the account registry and the drop-folder daemon.
+"""
@@ -0,0 +1,185 @@
+"""One command line for the account databases.
+
+    python -m ledger ingest ACCOUNT STATEMENT OUTPUT_DB
+    python -m ledger append STATEMENT... [--account ACCOUNT] [--db ACCOUNT=PATH]
+    python -m ledger merge ACCOUNT FIRST_DB SECOND_DB OUTPUT_DB
+    python -m ledger verify [ACCOUNT...] [--db ACCOUNT=PATH]
+    python -m ledger query {summary,balance,monthly} [ACCOUNT...] [--db ACCOUNT=PATH] [--json]
+
+Every subcommand imports what it needs when it runs. verify and query read
+the databases with plain sqlite3 and never load pandas or pdfplumber, so
+they start about as fast as the interpreter itself. Cold start per
+subcommand is measured by ``python -m ledger.bench --startup``.
+"""
+import os
+import sys
+import argparse
+
+from ledger import accounts
+
+QUERY_NAMES = ['summary', 'balance', 'monthly']
+
+def ingest(args):
+    """Build a new database from one statement with the account's create script"""
+    from ledger import instrument
+
+    config = accounts.ACCOUNTS[args.account]
+    script = accounts.load_module(config['create'])
+    with instrument.session():
+        print(f"Extracting transactions from {args.statement}...")
+        transactions = getattr(script, config['extract'])(args.statement)
+        if transactions is None or len(transactions) == 0:
+            print("No transactions found in the statement!")
+            return 1
+        print(f"Found {len(transactions)} transactions")
+        if config['statement']:
+            from ledger import cycles
+            script.create_database(transactions, args.output, cycles.read_statement(args.statement))
+        else:
+            script.create_database(transactions, args.output)
+    print(f"Created {args.output}")
+    return 0
+
+def append(args):
+    """Append statements to their accounts' databases, routed by file name unless --account is given"""
+    from ledger import instrument
+
+    db_paths = accounts.db_paths(accounts.parse_db_overrides(args.db))
+    failed = 0
+    with instrument.session():
+        for path in args.statements:
+            account = args.account or accounts.route_file(path)
+            if account is None:
+                print(f"No account matches {path}, use --account")
+                failed += 1
+                continue
+            try:
+                accounts.load_script(account).append_new_transactions(path, db_path=db_paths[account])
+            except Exception as e:
+                print(f"Error appending {path} to {account}: {e}")
+                failed += 1
+    return 1 if failed else 0
+
+def merge(args):
+    """Merge two databases of an account with its merge script"""
+    from ledger import instrument
+
+    config = accounts.ACCOUNTS[args.account]
+    if not config['merge']:
+        raise SystemExit(f"{args.account} has no merge script")
+    script = accounts.load_module(config['merge'])
+    with instrument.session():
+        script.merge_databases(args.first, args.second, args.output)
+    return 0 if os.path.exists(args.output) else 1
+
+def _open_databases(names, overrides):
+    """(account, connection) for each existing database, printing the ones skipped"""
+    from ledger import storage
+
+    db_paths = accounts.db_paths(accounts.parse_db_overrides(overrides))
+    for account in names or list(accounts.ACCOUNTS):
+        if account not in db_paths:
+            raise SystemExit(f"Unknown account: {account}")
+        if not os.path.exists(db_paths[account]):
+            print(f"[{account}] skipped: {db_paths[account]} not found")
+            continue
+        conn = storage.connect(db_paths[account], readonly=True)
+        try:
+            yield account, conn
+        finally:
+            conn.close()
+
+def verify(args):
+    """Integrity check, totals and stored paise of each database"""
+    from ledger import queries
+    from ledger import storage
+
+    failed = 0
+    for account, conn in _open_databases(args.accounts, args.db):
+        print(f"[{account}]")
+        try:
+            check = conn.execute('PRAGMA quick_check').fetchone()[0]
+            summary = queries.summary(conn)
+            columns = storage.table_columns(conn)
+            mismatched = 0
+            if storage.AMOUNT_PAISE_COLUMN in columns:
+                mismatched = conn.execute(f'''
+                    SELECT COUNT(*) FROM transactions
+                    WHERE {storage.AMOUNT_PAISE_COLUMN} IS NOT NULL AND {storage.AMOUNT_PAISE_COLUMN} != {storage.AMOUNT_TO_PAISE_SQL}
+                ''').fetchone()[0]
+        except Exception as e:
+            print(f"Error verifying database: {e}")
+            failed += 1
+            continue
+        print(f"Integrity: {check}")
+        print(f"Total Transactions: {summary['total_transactions']}")
+        print(f"Date Range: {summary['earliest_date']} to {summary['latest_date']}")
+        print(f"Total Debits: ₹{summary['total_debits']:,.2f}")
+        print(f"Total Credits: ₹{summary['total_credits']:,.2f}")
+        print(f"Version: {storage.data_version(conn)}")
+        if mismatched:
+            print(f"{mismatched} rows have an AmountPaise that does not match Amount")
+        if check != 'ok' or mismatched:
+            failed += 1
+    return 1 if failed else 0
+
+def _print_result(result):
+    rows = result if isinstance(result, list) else [result]
+    for row in rows:
+        print('  ' + ', '.join(f"{key}={value}" for key, value in row.items()))
+
+def query(args):
+    """Run one of the service queries against each database"""
+    import json
+    from ledger import queries
+
+    results = {}
+    for account, conn in _open_databases(args.accounts, args.db):
+        results[account] = queries.QUERIES[args.name](conn)
+        if not args.json:
+            print(f"[{account}]")
+            _print_result(results[account])
+    if args.json:
+        print(json.dumps(results, indent=2))
+    return 0
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m ledger', description="Ingest, append, merge, verify and query the account databases")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    sub = subparsers.add_parser('ingest', help="Create a database from one statement")
+    sub.add_argument('account', choices=list(accounts.ACCOUNTS))
+    sub.add_argument('statement')
+    sub.add_argument('output', help="Database to create (replaced if it exists)")
+    sub.set_defaults(run=ingest)
+
+    sub = subparsers.add_parser('append', help="Append statements to the account databases")
+    sub.add_argument('statements', nargs='+')
+    sub.add_argument('--account', choices=list(accounts.ACCOUNTS), help="Account of every statement (default: by file name)")
+    sub.add_argument('--db', action='append', metavar='ACCOUNT=PATH', help="Override the database path of an account")
+    sub.set_defaults(run=append)
+
+    sub = subparsers.add_parser('merge', help="Merge two databases of an account")
+    sub.add_argument('account', choices=[name for name, config in accounts.ACCOUNTS.items() if config['merge']])
+    sub.add_argument('first', help="Database whose rows keep their SrNo")
+    sub.add_argument('second')
+    sub.add_argument('output', help="Database to create (replaced if it exists)")
+    sub.set_defaults(run=merge)
+
+    sub = subparsers.add_parser('verify', help="Check integrity and totals of the account databases")
+    sub.add_argument('accounts', nargs='*', help="Accounts to check (default: all)")
+    sub.add_argument('--db', action='append', metavar='ACCOUNT=PATH', help="Override the database path of an account")
+    sub.set_defaults(run=verify)
+
+    sub = subparsers.add_parser('query', help="Summary, balance or monthly totals of the account databases")
+    sub.add_argument('name', choices=QUERY_NAMES)
+    sub.add_argument('accounts', nargs='*', help="Accounts to query (default: all)")
+    sub.add_argument('--db', action='append', metavar='ACCOUNT=PATH', help="Override the database path of an account")
+    sub.add_argument('--json', action='store_true', help="Print the results as JSON")
+    sub.set_defaults(run=query)
+
+    args = parser.parse_args(argv)
+    return args.run(args)
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,134 @@
+import os
+import ast
+import fnmatch
+import importlib.util
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Account name -> Upend script and the file name patterns routed to it.
+# The database path defaults to DB_PATH in the script and can be overridden.
+# 'create' builds a new database from one statement with its 'extract'
+# function ('statement': card header read for the cycle too); 'merge'
+# combines two databases, for the accounts that have a merge script.
+# 'script_extract' is the Upend script's own parse function, which the
+# daemon's workers run before handing the rows to the database's writer;
+# for 'statement' accounts it also fills a dict with the card header.
+ACCOUNTS = {
+    'DBS_CC_2009': {
+        'script': os.path.join('DBS_CC_2009', 'DBS_CC_2009_Uppend.py'),
+        'script_extract': 'extract_transactions_from_pdf',
+        'patterns': ['*dbs*.pdf'],
+        'create': os.path.join('DBS_CC_2009', 'DBS_CC_2009.py'),
+        'extract': 'extract_transactions_from_pdf',
+        'statement': True,
+        'merge': None,
+    },
+    'ICICI_CA_1849': {
+        'script': os.path.join('ICICI_CA_1849', 'ICICI_CAUppend_1849.py'),
+        'script_extract': 'extract_transactions_from_pdf',
+        'patterns': ['*1849*.pdf', '*icici*ca*.pdf'],
+        'create': os.path.join('ICICI_CA_1849', 'ICICI_CA_1849.py'),
+        'extract': 'extract_transactions_from_pdf',
+        'statement': False,
+        'merge': None,
+    },
+    'ICICI_SA_0090': {
+        'script': os.path.join('ICICI_SA_0090', 'ICICI_SAUppend_0090.py'),
+        'script_extract': 'extract_transactions_from_excel',
+        'patterns': ['*0090*.xls', '*0090*.xlsx', '*icici*.xls', '*icici*.xlsx'],
+        'create': os.path.join('ICICI_SA_0090', 'ICICI_SA_0090.py'),
+        'extract': 'extract_transactions_from_excel',
+        'statement': False,
+        'merge': os.path.join('ICICI_SA_0090', 'ICICI_SAMerge_0090.py'),
+    },
+    'PaytmTransactions': {
+        'script': os.path.join('PaytmTransactions', 'PaytmUPIUppend.py'),
+        'script_extract': 'extract_transactions',
+        'patterns': ['*paytm*.pdf', '*paytm*.xls', '*paytm*.xlsx'],
+        'create': os.path.join('PaytmTransactions', 'PaytmTransaction.py'),
+        'extract': 'extract_transactions_from_excel',
+        'statement': False,
+        'merge': os.path.join('PaytmTransactions', 'PaytmUPIMerge.py'),
+    },
+    'PhonePeTransaction': {
+        'script': os.path.join('PhonePeTransaction', 'PhonePeUppend.py'),
+        'script_extract': 'extract_transactions_from_pdf',
+        'patterns': ['*phonepe*.pdf'],
+        'create': os.path.join('PhonePeTransaction', 'phonepay.py'),
+        'extract': 'extract_transactions_from_pdf',
+        'statement': False,
+        'merge': os.path.join('PhonePeTransaction', 'PhonePeMerge.py'),
+    },
+    'SBI_CC_7670': {
+        'script': os.path.join('SBI_CC_7670', 'SBI_CCUppend_7670.py'),
+        'script_extract': 'extract_transactions_from_pdf',
+        'patterns': ['*7670*.pdf', '*sbi*.pdf'],
+        'create': os.path.join('SBI_CC_7670', 'SBI_CC_7670.py'),
+        'extract': 'extract_transactions_from_pdf',
+        'statement': True,
+        'merge': os.path.join('SBI_CC_7670', 'SBI_CCMerge_7670.py'),
+    },
+}
+
+_modules = {}
+
+def load_module(relative_path):
+    """Import a script by its path relative to the repo root, once"""
+    if relative_path not in _modules:
+        script_path = os.path.join(REPO_ROOT, relative_path)
+        module_name = 'ledger_script_' + os.path.splitext(relative_path)[0].replace(os.sep, '_').replace('/', '_')
+        spec = importlib.util.spec_from_file_location(module_name, script_path)
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        _modules[relative_path] = module
+    return _modules[relative_path]
+
+def load_script(account):
+    """Import an account's Upend script once and keep it loaded"""
+    return load_module(ACCOUNTS[account]['script'])
+
+def default_db_path(account):
+    """Database path the account's Upend script appends into
+
+    Read from the script source so callers that only query the database
+    do not pay for importing pandas and pdfplumber.
+    """
+    script_path = os.path.join(REPO_ROOT, ACCOUNTS[account]['script'])
+    with open(script_path, encoding='utf-8') as f:
+        tree = ast.parse(f.read(), script_path)
+    for node in tree.body:
+        if isinstance(node, ast.Assign) and any(
+                isinstance(target, ast.Name) and target.id == 'DB_PATH' for target in node.targets):
+            return ast.literal_eval(node.value)
+    raise ValueError(f"{script_path} does not define DB_PATH")
+
+def parse_db_overrides(values):
+    """Turn repeated ACCOUNT=PATH command line values into a dict"""
+    db_paths = {}
+    for value in values or []:
+        account, _, path = value.partition('=')
+        if account not in ACCOUNTS or not path:
+            raise SystemExit(f"Invalid --db value: {value} (expected ACCOUNT=PATH)")
+        db_paths[account] = path
+    return db_paths
+
+def db_paths(overrides=None):
+    """Database path of every account, with overrides applied"""
+    paths = {account: default_db_path(account) for account in ACCOUNTS}
+    paths.update(overrides or {})
+    return paths
+
+def route_file(path, watch_dir=None):
+    """Return the account a statement file belongs to, or None"""
+    # A file dropped into <watch_dir>/<ACCOUNT>/ always goes to that account
+    if watch_dir:
+        relative = os.path.relpath(path, watch_dir)
+        parts = relative.split(os.sep)
+        if len(parts) > 1 and parts[0] in ACCOUNTS:
+            return parts[0]
+
+    name = os.path.basename(path).lower()
+    for account, config in ACCOUNTS.items():
+        if any(fnmatch.fnmatch(name, pattern) for pattern in config['patterns']):
+            return account
+    return None
@@ -0,0 +1,90 @@
+"""Exact debit/credit totals in integer paise.
+
+The sums run in SQLite over AmountPaise, or over Amount rounded to paise
+row by row for databases that have not been migrated yet, so totals never
+pick up float drift however many years of rows are summed. Only the
+figures handed to a user are converted back to rupees.
+
+Dates come from the ISO DateKey column (see ledger.ordering), so the
+read-only paths here need neither pandas nor numpy; only databases from
+before DateKey existed have their dates parsed, with ledger.datekeys.
+"""
+from ledger import datekeys
+from ledger import storage
+
+# BillingAmountSign values used by the different account scripts
+DEBIT_SIGNS = ('Dr', 'DR', '-', 'D', 'M')
+CREDIT_SIGNS = ('Cr', 'CR', '+', 'C')
+
+# Column names vary between the per-account schemas
+DATE_COLUMNS = ('Date', 'TransactionDate')
+SIGN_COLUMNS = ('BillingAmountSign', 'BillingAmountSign-DR,CR')
+# Same as ordering.DATE_KEY_COLUMN; ordering imports pandas, so it is not imported here
+DATE_KEY_COLUMN = 'DateKey'
+
+def find_column(columns, candidates):
+    for name in candidates:
+        if name in columns:
+            return name
+    raise ValueError(f"None of the columns {candidates} found in {columns}")
+
+def to_rupees(paise):
+    return round(paise / 100, 2)
+
+def grouped_by_date(conn):
+    """(ISO date or None, sign, count, paise) rows; few distinct dates, so the rest is cheap"""
+    columns = storage.table_columns(conn)
+    sign_col = find_column(columns, SIGN_COLUMNS)
+    date_col = DATE_KEY_COLUMN if DATE_KEY_COLUMN in columns else find_column(columns, DATE_COLUMNS)
+    rows = conn.execute(f'''
+        SELECT "{date_col}", "{sign_col}", COUNT(*), SUM({storage.amount_paise_sql(columns)})
+        FROM transactions
+        GROUP BY "{date_col}", "{sign_col}"
+    ''').fetchall()
+    if date_col == DATE_KEY_COLUMN:
+        return rows
+    return [(datekeys.date_key(row[0]),) + tuple(row[1:]) for row in rows]
+
+def totals(conn):
+    """Count, ISO date range and per-sign totals for one database, in paise"""
+    rows = grouped_by_date(conn)
+    by_sign = {}
+    for _, sign, count, paise in rows:
+        entry = by_sign.setdefault(sign, {'sign': sign, 'count': 0, 'paise': 0})
+        entry['count'] += count
+        entry['paise'] += paise or 0
+
+    keys = [row[0] for row in rows if row[0]]
+    return {
+        'count': sum(e['count'] for e in by_sign.values()),
+        'earliest': min(keys) if keys else None,
+        'latest': max(keys) if keys else None,
+        'by_sign': by_sign,
+        'debit_paise': sum(e['paise'] for s, e in by_sign.items() if s in DEBIT_SIGNS),
+        'credit_paise': sum(e['paise'] for s, e in by_sign.items() if s in CREDIT_SIGNS),
+    }
+
+def monthly_totals(conn):
+    """{'YYYY-MM': {'count', 'debit_paise', 'credit_paise'}} in calendar order"""
+    result = {}
+    for key, sign, count, paise in grouped_by_date(conn):
+        if not key:
+            continue
+        entry = result.setdefault(key[:7], {'count': 0, 'debit_paise': 0, 'credit_paise': 0})
+        entry['count'] += count
+        if sign in DEBIT_SIGNS:
+            entry['debit_paise'] += paise or 0
+        elif sign in CREDIT_SIGNS:
+            entry['credit_paise'] += paise or 0
+    return {month: result[month] for month in sorted(result)}
+
+def account_monthly_totals(db_paths):
+    """monthly_totals() for each account in an {account: db_path} mapping"""
+    result = {}
+    for account, db_path in db_paths.items():
+        conn = storage.connect(db_path, readonly=True)
+        try:
+            result[account] = monthly_totals(conn)
+        finally:
+            conn.close()
+    return result
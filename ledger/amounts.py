@@ -0,0 +1,116 @@
+"""Amount parsing for whole columns at once.
+
+Statements write amounts as '1,234.50', '₹1,234.50', '1,234.50 CR',
+'(1,234.50)', '-1234.5', 'NA' or '-'. to_paise() turns a column of any
+of these into an int64 array of paise: minus signs, parentheses and a DR
+suffix make the value negative; other characters are ignored, so blanks,
+'NA', '-' and anything without digits become 0, as with the old
+per-script clean_amount functions.
+Distinct strings are parsed once, in blocks, by NumPy operations over a
+character matrix, so no Python code runs per value.
+"""
+import numpy as np
+import pandas as pd
+
+# Rows per block when parsing strings as a character matrix
+CHUNK_ROWS = 65536
+
+def _parse_numbers(values):
+    """int64 paise for an object array of ints/floats"""
+    numbers = pd.to_numeric(pd.Series(values, dtype=object), errors='coerce').to_numpy(dtype='float64')
+    numbers = np.nan_to_num(numbers, nan=0.0, posinf=0.0, neginf=0.0)
+    return np.round(numbers * 100).astype('int64')
+
+def _parse_chunk(values):
+    """int64 paise for a block of strings
+
+    The strings become a (width, rows) matrix of byte codes that is scanned
+    one character column at a time, so every step works on all rows at once.
+    """
+    chars = np.array(values, dtype=str)
+    rows = len(chars)
+    width = chars.dtype.itemsize // 4
+    if width == 0:
+        return np.zeros(rows, dtype='int64')
+    # Non-ASCII characters such as '₹' are clamped to 255 and ignored
+    codes = np.minimum(chars.view(np.uint32).reshape(rows, width), 255).astype(np.uint8).T.copy()
+    digits = codes - np.uint8(48)
+    is_digit = digits < 10
+
+    rupees = np.zeros(rows, dtype='int64')
+    thousandths = np.zeros(rows, dtype='int64')
+    scale = np.zeros(rows, dtype='int64')  # 0 before the decimal point, then 100, 10, 1, 0
+    seen_point = np.zeros(rows, dtype=bool)
+    previous_digit = np.zeros(rows, dtype=bool)
+    previous_d = np.zeros(rows, dtype=bool)
+    negative = np.zeros(rows, dtype=bool)
+    opened = np.zeros(rows, dtype=bool)
+    closed = np.zeros(rows, dtype=bool)
+    no_digit = np.zeros(rows, dtype=bool)
+
+    for column in range(width):
+        code = codes[column]
+        digit = is_digit[column]
+        next_digit = is_digit[column + 1] if column + 1 < width else no_digit
+        # A '.' is the decimal point only next to a digit, so 'Rs. 5' stays 5 rupees
+        point = (code == 46) & (previous_digit | next_digit) & ~seen_point
+        rupees = np.where(digit & ~seen_point, rupees * 10 + digits[column], rupees)
+        thousandths += np.where(digit, digits[column], 0) * scale
+        scale = np.where(point, 100, np.where(digit, scale // 10, scale))
+        seen_point |= point
+        negative |= (code == 45) | (previous_d & ((code == 82) | (code == 114)))
+        opened |= code == 40
+        closed |= code == 41
+        previous_d = (code == 68) | (code == 100)
+        previous_digit = digit
+
+    paise = rupees * 100 + (thousandths + 5) // 10
+    negative |= opened & closed
+    return np.where(negative, -paise, paise)
+
+def _parse_strings(values):
+    """int64 paise for an object array of strings"""
+    result = np.empty(len(values), dtype='int64')
+    for start in range(0, len(values), CHUNK_ROWS):
+        result[start:start + CHUNK_ROWS] = _parse_chunk(values[start:start + CHUNK_ROWS])
+    return result
+
+def to_paise(values, absolute=False):
+    """Parse a column of amounts into an int64 NumPy array of paise"""
+    codes, uniques = pd.factorize(pd.Series(values, dtype=object), use_na_sentinel=True)
+    uniques = np.asarray(uniques, dtype=object)
+    parsed = np.zeros(len(uniques), dtype='int64')
+    if pd.api.types.infer_dtype(uniques, skipna=True) == 'string':
+        is_text = np.ones(len(uniques), dtype=bool)
+    else:
+        is_text = np.array([isinstance(v, str) for v in uniques], dtype=bool)
+    if is_text.any():
+        parsed[is_text] = _parse_strings(uniques[is_text])
+    if (~is_text).any():
+        parsed[~is_text] = _parse_numbers(uniques[~is_text])
+    if absolute:
+        parsed = np.abs(parsed)
+
+    result = np.zeros(len(codes), dtype='int64')
+    known = codes >= 0
+    result[known] = parsed[codes[known]]
+    return result
+
+def to_rupees(values, absolute=False):
+    """Like to_paise() but as float64 rupees, for the REAL Amount columns"""
+    return to_paise(values, absolute=absolute) / 100.0
+
+def debit_credit(withdrawals, deposits):
+    """(amount, is_debit) arrays from withdrawal/deposit column pairs
+
+    The withdrawal wins when both are filled, as in the statement scripts.
+    """
+    withdrawals = to_rupees(withdrawals, absolute=True)
+    deposits = to_rupees(deposits, absolute=True)
+    is_debit = withdrawals > 0
+    return np.where(is_debit, withdrawals, deposits), is_debit
+
+def add_paise_column(df, column='Amount'):
+    """Set the integer AmountPaise column from the rupee Amount column"""
+    df['AmountPaise'] = to_paise(df[column])
+    return df
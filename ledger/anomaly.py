@@ -0,0 +1,341 @@
+"""Unusual debits flagged as they are appended.
+
+For every counterparty and every category the database keeps streaming
+statistics of its debit amounts in `anomaly_stats`: count, mean and
+variance of log(amount) (Welford's update) and a t-digest, a few dozen
+(mean, weight) centroids that estimate quantiles. A new debit is scored
+against its counterparty's statistics, or its category's while the
+counterparty has too little history, and then folded into both. Each row
+costs a constant amount of work, and only rows after the `anomaly_rowid`
+watermark in ledger_meta are read.
+
+A row is flagged in `alerts` when it is both far above the usual amount
+(z-score of the log amount) and beyond the 99th percentile of the digest.
+A large first debit to a counterparty and category never seen is flagged
+too. The first run on a database seeds the statistics from the rows
+already stored, without flagging them.
+"""
+import os
+import sys
+import math
+import json
+import bisect
+import sqlite3
+import argparse
+
+import numpy as np
+import pandas as pd
+
+from ledger import accounts
+from ledger import aggregates
+from ledger import dedup
+from ledger import instrument
+from ledger import ordering
+from ledger import recurring
+from ledger import storage
+
+WATERMARK_KEY = 'anomaly_rowid'
+# t-digest size: about this many centroids per key, twice that before compressing
+COMPRESSION = 50
+# Debits needed before a key's statistics are trusted
+MIN_HISTORY = 5
+# Flag when the log amount is this many standard deviations above the mean ...
+Z_THRESHOLD = 3.0
+# ... and beyond this quantile of the amounts seen
+QUANTILE_THRESHOLD = 0.99
+# Keeps a key that always charged the same amount from flagging a small price change
+MIN_LOG_STD = 0.25
+# Nothing below this is worth an alert
+MIN_ALERT_PAISE = 100000
+# First debit to an unknown counterparty and category this large is flagged
+LARGE_UNSEEN_PAISE = 2500000
+
+STATS_TABLE_SQL = """
+CREATE TABLE IF NOT EXISTS anomaly_stats (
+    scope TEXT NOT NULL,
+    key TEXT NOT NULL,
+    n INTEGER NOT NULL,
+    mean REAL NOT NULL,
+    m2 REAL NOT NULL,
+    digest TEXT NOT NULL,
+    PRIMARY KEY (scope, key)
+)
+"""
+
+ALERTS_TABLE_SQL = """
+CREATE TABLE IF NOT EXISTS alerts (
+    row_id INTEGER PRIMARY KEY,
+    date TEXT,
+    scope TEXT NOT NULL,
+    key TEXT NOT NULL,
+    paise INTEGER NOT NULL,
+    typical_paise INTEGER,
+    z_score REAL,
+    quantile REAL,
+    reason TEXT NOT NULL
+)
+"""
+
+ALERT_COLUMNS = ['row_id', 'date', 'scope', 'key', 'paise', 'typical_paise', 'z_score', 'quantile', 'reason']
+
+class TDigest:
+    """Merging t-digest: sorted (mean, weight) centroids, small near the tails"""
+
+    def __init__(self, means=(), weights=(), compression=COMPRESSION):
+        self.means = list(means)
+        self.weights = list(weights)
+        self.compression = compression
+
+    @classmethod
+    def from_json(cls, text):
+        centroids = json.loads(text)
+        return cls([c[0] for c in centroids], [c[1] for c in centroids])
+
+    def to_json(self):
+        return json.dumps([[round(m, 6), w] for m, w in zip(self.means, self.weights)])
+
+    @classmethod
+    def from_values(cls, values):
+        digest = cls(np.sort(np.asarray(values, dtype='float64')).tolist(), [1] * len(values))
+        digest.compress()
+        return digest
+
+    def add(self, value):
+        position = bisect.bisect(self.means, value)
+        self.means.insert(position, value)
+        self.weights.insert(position, 1)
+        if len(self.means) > 2 * self.compression:
+            self.compress()
+
+    def _q_limit(self, q):
+        """Largest quantile a centroid starting at q may reach (k1 scale function)"""
+        k = self.compression / (2 * math.pi) * math.asin(2 * min(max(q, 0.0), 1.0) - 1) + 1
+        if k >= self.compression / 4:
+            return 1.0
+        return (math.sin(2 * math.pi * k / self.compression) + 1) / 2
+
+    def compress(self):
+        total = sum(self.weights)
+        means, weights = [], []
+        seen = 0
+        limit = self._q_limit(0.0)
+        for mean, weight in zip(self.means, self.weights):
+            if weights and (seen + weight) / total <= limit:
+                weights[-1] += weight
+                means[-1] += (mean - means[-1]) * weight / weights[-1]
+            else:
+                limit = self._q_limit(seen / total)
+                means.append(mean)
+                weights.append(weight)
+            seen += weight
+        self.means, self.weights = means, weights
+
+    def cdf(self, value):
+        """Estimated share of the values seen that are <= value"""
+        if not self.means:
+            return float('nan')
+        if value < self.means[0]:
+            return 0.0
+        if value >= self.means[-1]:
+            return 1.0
+        weights = np.asarray(self.weights, dtype='float64')
+        centers = np.cumsum(weights) - weights / 2
+        return float(np.interp(value, self.means, centers) / weights.sum())
+
+    def quantile(self, q):
+        if not self.means:
+            return float('nan')
+        weights = np.asarray(self.weights, dtype='float64')
+        centers = np.cumsum(weights) - weights / 2
+        return float(np.interp(q * weights.sum(), centers, self.means))
+
+class KeyStats:
+    """Streaming statistics of one counterparty's or category's debits"""
+
+    def __init__(self, n=0, mean=0.0, m2=0.0, digest=None):
+        self.n, self.mean, self.m2 = n, mean, m2
+        self.digest = digest or TDigest()
+
+    def add(self, x):
+        # Welford: mean and sum of squared deviations without keeping the values
+        self.n += 1
+        delta = x - self.mean
+        self.mean += delta / self.n
+        self.m2 += delta * (x - self.mean)
+        self.digest.add(x)
+
+    def std(self):
+        return math.sqrt(self.m2 / self.n) if self.n > 1 else 0.0
+
+    def score(self, x):
+        """(z-score, quantile) of a log amount"""
+        return (x - self.mean) / max(self.std(), MIN_LOG_STD), self.digest.cdf(x)
+
+def log_amount(paise):
+    return np.log1p(np.asarray(paise, dtype='float64') / 100)
+
+def ensure_anomaly_tables(conn):
+    conn.execute(STATS_TABLE_SQL)
+    conn.execute(ALERTS_TABLE_SQL)
+
+def read_rows(conn, watermark=0, table='transactions'):
+    """Debits after the watermark with their counterparty and category keys, plus the last rowid read"""
+    columns = storage.table_columns(conn, table)
+    sign_col = aggregates.find_column(columns, aggregates.SIGN_COLUMNS)
+    details_col = aggregates.find_column(columns, dedup.DETAILS_COLUMNS)
+    category = 'CategoryId' if 'CategoryId' in columns else 'NULL'
+    counterparty = 'Counterparty' if 'Counterparty' in columns else 'NULL'
+    date_key = ordering.DATE_KEY_COLUMN if ordering.DATE_KEY_COLUMN in columns else 'NULL'
+    rows = pd.read_sql_query(f'''
+        SELECT rowid AS row_id, {date_key} AS date, "{sign_col}" AS sign, {storage.amount_paise_sql(columns)} AS paise,
+               {counterparty} AS counterparty, "{details_col}" AS narration, {category} AS category
+        FROM "{table}" WHERE rowid > ? ORDER BY rowid
+    ''', conn, params=(watermark,))
+    last = int(rows['row_id'].iloc[-1]) if len(rows) else watermark
+    rows = rows[rows['sign'].isin(aggregates.DEBIT_SIGNS) & rows['paise'].notna()].copy()
+    rows['paise'] = np.abs(rows['paise'].astype('int64'))
+    # Rows stored before Counterparty was filled in get the same normalization here
+    missing = rows['counterparty'].isna().to_numpy()
+    rows.loc[missing, 'counterparty'] = recurring.normalize_counterparty(rows.loc[missing, 'narration']).to_numpy()
+    rows['counterparty'] = rows['counterparty'].fillna('').astype(str)
+    rows['category'] = ['' if pd.isna(c) else str(int(c)) for c in rows['category']]
+    return rows, last
+
+def row_keys(row):
+    keys = []
+    if row.counterparty:
+        keys.append(('counterparty', row.counterparty))
+    if row.category:
+        keys.append(('category', row.category))
+    return keys
+
+def load_stats(conn, keys):
+    stats = {}
+    for scope in ('counterparty', 'category'):
+        names = sorted({key for s, key in keys if s == scope})
+        for start in range(0, len(names), 500):
+            chunk = names[start:start + 500]
+            for key, n, mean, m2, digest in conn.execute(
+                    f"SELECT key, n, mean, m2, digest FROM anomaly_stats WHERE scope = ? AND key IN ({', '.join('?' * len(chunk))})",
+                    [scope] + chunk):
+                stats[(scope, key)] = KeyStats(n, mean, m2, TDigest.from_json(digest))
+    return stats
+
+def save_stats(conn, stats):
+    conn.executemany('INSERT OR REPLACE INTO anomaly_stats VALUES (?, ?, ?, ?, ?, ?)',
+                     [(scope, key, s.n, s.mean, s.m2, s.digest.to_json()) for (scope, key), s in stats.items()])
+
+def seed(conn, table='transactions'):
+    """Statistics of every debit already stored, computed per key in one pass; nothing is flagged"""
+    rows, last = read_rows(conn, 0, table)
+    rows['x'] = log_amount(rows['paise'])
+    stats = {}
+    for scope in ('counterparty', 'category'):
+        keyed = rows[rows[scope] != '']
+        for key, values in keyed.groupby(scope)['x']:
+            x = values.to_numpy()
+            stats[(scope, key)] = KeyStats(len(x), float(x.mean()), float(((x - x.mean()) ** 2).sum()),
+                                           TDigest.from_values(x))
+    save_stats(conn, stats)
+    storage.set_meta(conn, WATERMARK_KEY, last)
+    return len(rows)
+
+def ensure_anomalies(conn, table='transactions'):
+    """Create the tables and seed them from the stored rows if this database has no statistics yet"""
+    ensure_anomaly_tables(conn)
+    if storage.get_meta(conn, WATERMARK_KEY) is None:
+        with instrument.stage('anomaly_seed'):
+            instrument.count('anomaly_seeded', seed(conn, table))
+        return True
+    return False
+
+def check_row(row, x, stats, category_names):
+    """(scope, key, typical paise, z, quantile, reason) when the row is unusual, else None"""
+    for scope, key in row_keys(row):
+        known = stats.get((scope, key))
+        if known is None or known.n < MIN_HISTORY:
+            continue
+        z, quantile = known.score(x)
+        if z < Z_THRESHOLD or quantile < QUANTILE_THRESHOLD or row.paise < MIN_ALERT_PAISE:
+            return None
+        typical = int(round(math.expm1(known.mean) * 100))
+        name = category_names.get(key, key) if scope == 'category' else key
+        reason = (f"{aggregates.to_rupees(row.paise):,.2f} is {z:.1f} sd above the usual "
+                  f"{aggregates.to_rupees(typical):,.2f} for {scope} '{name}'")
+        return scope, key, typical, z, quantile, reason
+    keys = row_keys(row)
+    if keys and row.paise >= LARGE_UNSEEN_PAISE and not any(key in stats for key in keys):
+        scope, key = keys[0]
+        return scope, key, None, None, None, f"{aggregates.to_rupees(row.paise):,.2f} to a new {scope} '{key}'"
+    return None
+
+def update_anomalies(conn, table='transactions'):
+    """Score the debits added since the last run and fold them into the statistics; returns the new alerts"""
+    if ensure_anomalies(conn, table):
+        return pd.DataFrame(columns=ALERT_COLUMNS)
+    watermark = storage.get_meta(conn, WATERMARK_KEY, 0)
+
+    with instrument.stage('anomaly'):
+        rows, last = read_rows(conn, watermark, table)
+        keys = {key for row in rows.itertuples(index=False) for key in row_keys(row)}
+        stats = load_stats(conn, keys)
+        try:
+            category_names = {str(i): name for name, i in conn.execute('SELECT name, id FROM categories')}
+        except sqlite3.OperationalError:
+            category_names = {}
+
+        alerts = []
+        for row, x in zip(rows.itertuples(index=False), log_amount(rows['paise'])):
+            flagged = check_row(row, x, stats, category_names)
+            if flagged:
+                alerts.append((int(row.row_id), row.date, *flagged[:2], int(row.paise), *flagged[2:]))
+            for key in row_keys(row):
+                stats.setdefault(key, KeyStats()).add(float(x))
+
+        alerts = pd.DataFrame(alerts, columns=['row_id', 'date', 'scope', 'key', 'paise', 'typical_paise',
+                                               'z_score', 'quantile', 'reason'])
+        conn.executemany(f"INSERT OR REPLACE INTO alerts VALUES ({', '.join('?' * len(ALERT_COLUMNS))})",
+                         alerts[ALERT_COLUMNS].astype(object).where(alerts.notna(), None).itertuples(index=False, name=None))
+        save_stats(conn, stats)
+        storage.set_meta(conn, WATERMARK_KEY, last)
+
+    instrument.count('anomaly_scored', len(rows))
+    instrument.count('alerts', len(alerts))
+    return alerts
+
+def print_alerts(alerts):
+    if alerts.empty:
+        print("No unusual transactions")
+        return
+    print(f"{len(alerts)} unusual transaction(s):")
+    for row in alerts.itertuples(index=False):
+        print(f"  row {row.row_id} ({row.date}): {row.reason}")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Show the unusual transactions flagged per account")
+    parser.add_argument('accounts', nargs='*', help="Accounts to show (default: all)")
+    parser.add_argument('--db', action='append', metavar='ACCOUNT=PATH',
+                        help="Override the database path of an account")
+    parser.add_argument('--limit', type=int, default=20, help="Most recent alerts to show per account")
+    args = parser.parse_args(argv)
+
+    db_paths = accounts.db_paths(accounts.parse_db_overrides(args.db))
+    for account in args.accounts or sorted(db_paths):
+        if account not in db_paths:
+            raise SystemExit(f"Unknown account: {account}")
+        if not os.path.exists(db_paths[account]):
+            print(f"[{account}] skipped: {db_paths[account]} not found")
+            continue
+        conn = storage.connect(db_paths[account], readonly=True)
+        try:
+            print(f"[{account}]")
+            try:
+                alerts = pd.read_sql_query('SELECT * FROM alerts ORDER BY row_id DESC LIMIT ?', conn, params=(args.limit,))
+            except pd.errors.DatabaseError:
+                alerts = pd.DataFrame(columns=ALERT_COLUMNS)   # never appended to since alerts existed
+            print_alerts(alerts)
+        finally:
+            conn.close()
+
+if __name__ == "__main__":
+    sys.exit(main())
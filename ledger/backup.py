@@ -0,0 +1,214 @@
+"""Point-in-time snapshots of the account databases.
+
+snapshot() copies a live database with SQLite's online backup API, a few
+hundred pages per step with a short pause in between, into
+snapshots/<name>.<timestamp>.db next to it. The source connection holds
+one read transaction for the whole copy, so in WAL mode the snapshot is
+consistent, appends carry on while it runs, and the copy never has to
+restart because of them.
+
+prune() keeps the newest KEEP_RECENT snapshots plus the newest one of
+each of the last KEEP_DAILY days. restore() swaps a snapshot back in with
+atomic.replace() after taking a snapshot of the current state, so a
+restore can itself be undone. Like atomic.rebuild(), the restored file
+carries on the data version and change log numbering of the one it
+replaces and logs a 'reset', so caches and change log readers redo their
+work instead of treating the older contents as current.
+"""
+import os
+import sys
+import time
+import shutil
+import sqlite3
+import argparse
+from datetime import datetime
+
+from ledger import accounts
+from ledger import atomic
+from ledger import changefeed
+from ledger import storage
+
+# Pages copied per backup step, and the pause between steps
+PAGES_PER_STEP = 256
+STEP_PAUSE = 0.001
+
+# Retention
+KEEP_RECENT = 10
+KEEP_DAILY = 30
+
+TIMESTAMP_FORMAT = '%Y%m%dT%H%M%S'
+SNAPSHOT_DIR = 'snapshots'
+
+def snapshot_dir(db_path):
+    return os.path.join(os.path.dirname(os.path.abspath(db_path)), SNAPSHOT_DIR)
+
+def snapshot_prefix(db_path):
+    return os.path.splitext(os.path.basename(db_path))[0] + '.'
+
+def list_snapshots(db_path):
+    """[(datetime, path)] of a database's snapshots, oldest first"""
+    folder = snapshot_dir(db_path)
+    prefix = snapshot_prefix(db_path)
+    if not os.path.isdir(folder):
+        return []
+    found = []
+    for name in os.listdir(folder):
+        if not (name.startswith(prefix) and name.endswith('.db')):
+            continue
+        stamp = name[len(prefix):-len('.db')]
+        try:
+            taken = datetime.strptime(stamp, TIMESTAMP_FORMAT)
+        except ValueError:
+            continue
+        found.append((taken, os.path.join(folder, name)))
+    return sorted(found)
+
+def snapshot(db_path, pages=PAGES_PER_STEP, pause=STEP_PAUSE):
+    """Copy db_path into a new snapshot file and return its path"""
+    if not os.path.exists(db_path):
+        raise FileNotFoundError(db_path)
+    folder = snapshot_dir(db_path)
+    os.makedirs(folder, exist_ok=True)
+
+    taken = datetime.now()
+    path = os.path.join(folder, f"{snapshot_prefix(db_path)}{taken.strftime(TIMESTAMP_FORMAT)}.db")
+    while os.path.exists(path):
+        # Two snapshots within one second
+        time.sleep(1)
+        taken = datetime.now()
+        path = os.path.join(folder, f"{snapshot_prefix(db_path)}{taken.strftime(TIMESTAMP_FORMAT)}.db")
+
+    tmp_path = atomic.temp_path(path)
+    source = sqlite3.connect(db_path)
+    target = sqlite3.connect(tmp_path)
+    try:
+        if source.execute('PRAGMA journal_mode').fetchone()[0] == 'wal':
+            # Pin one read snapshot: writers are not blocked and never force the copy to restart.
+            # Without WAL this would lock writers out, so the copy just restarts if they write.
+            source.execute('BEGIN')
+            source.execute('SELECT COUNT(*) FROM sqlite_master').fetchone()
+        source.backup(target, pages=pages, progress=lambda status, remaining, total: time.sleep(pause))
+        if source.in_transaction:
+            source.rollback()
+        # A snapshot is a plain file with no -wal beside it
+        target.execute('PRAGMA journal_mode=DELETE')
+        target.close()
+        atomic.fsync_path(tmp_path)
+        os.replace(tmp_path, path)
+    except BaseException:
+        target.close()
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    finally:
+        source.close()
+    return path
+
+def snapshot_if_due(db_path, interval_seconds):
+    """Take a snapshot unless the newest one is younger than interval_seconds"""
+    existing = list_snapshots(db_path)
+    if existing and (datetime.now() - existing[-1][0]).total_seconds() < interval_seconds:
+        return None
+    path = snapshot(db_path)
+    prune(db_path)
+    return path
+
+def prune(db_path, keep=KEEP_RECENT, daily=KEEP_DAILY):
+    """Delete snapshots outside the retention policy; returns the deleted paths"""
+    existing = list_snapshots(db_path)
+    kept = {path for _, path in existing[-keep:]} if keep else set()
+
+    newest_per_day = {}
+    for taken, path in existing:
+        newest_per_day[taken.date()] = path
+    for day in sorted(newest_per_day)[-daily:] if daily else []:
+        kept.add(newest_per_day[day])
+
+    deleted = []
+    for _, path in existing:
+        if path not in kept:
+            os.remove(path)
+            deleted.append(path)
+    return deleted
+
+def find_snapshot(db_path, at=None):
+    """Newest snapshot taken at or before `at` (a datetime), or the newest overall"""
+    candidates = [(taken, path) for taken, path in list_snapshots(db_path) if at is None or taken <= at]
+    if not candidates:
+        raise FileNotFoundError(f"No snapshot of {db_path}" + (f" at or before {at}" if at else ""))
+    return candidates[-1][1]
+
+def restore(db_path, snapshot_path=None, at=None):
+    """Replace db_path with a snapshot; the current database is snapshotted first"""
+    snapshot_path = snapshot_path or find_snapshot(db_path, at)
+    if os.path.exists(db_path):
+        snapshot(db_path)
+    version, seq = atomic.previous_state(db_path)
+
+    tmp_path = atomic.temp_path(db_path)
+    try:
+        shutil.copyfile(snapshot_path, tmp_path)
+        conn = sqlite3.connect(tmp_path)
+        try:
+            # Keep counting from the replaced file's version and change seq, as atomic.rebuild() does
+            storage.set_meta(conn, 'version', max(version, storage.data_version(conn)))
+            seq = max(seq, changefeed.last_seq(conn))
+            conn.execute(changefeed.CHANGES_TABLE_SQL)
+            conn.execute('DELETE FROM changes')
+            changefeed.record_rebuild(conn, seq)
+            storage.bump_version(conn)
+            conn.commit()
+        finally:
+            conn.close()
+        atomic.replace(tmp_path, db_path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return snapshot_path
+
+def parse_time(value):
+    for fmt in ('%Y-%m-%d %H:%M:%S', '%Y-%m-%dT%H:%M:%S', '%Y-%m-%d %H:%M', '%Y-%m-%d', TIMESTAMP_FORMAT):
+        try:
+            return datetime.strptime(value, fmt)
+        except ValueError:
+            pass
+    raise SystemExit(f"Invalid time: {value} (expected YYYY-MM-DD[ HH:MM[:SS]])")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Snapshot, list, prune and restore account databases")
+    parser.add_argument('command', choices=['snapshot', 'list', 'prune', 'restore'])
+    parser.add_argument('accounts', nargs='*', help="Accounts to act on (default: all)")
+    parser.add_argument('--db', action='append', metavar='ACCOUNT=PATH',
+                        help="Override the database path of an account")
+    parser.add_argument('--at', help="restore: newest snapshot taken at or before this time")
+    parser.add_argument('--keep', type=int, default=KEEP_RECENT)
+    parser.add_argument('--daily', type=int, default=KEEP_DAILY)
+    args = parser.parse_args(argv)
+
+    db_paths = accounts.db_paths(accounts.parse_db_overrides(args.db))
+    names = args.accounts or sorted(db_paths)
+    for account in names:
+        if account not in db_paths:
+            raise SystemExit(f"Unknown account: {account}")
+        db_path = db_paths[account]
+        try:
+            if args.command == 'snapshot':
+                start = time.perf_counter()
+                path = snapshot(db_path)
+                prune(db_path, args.keep, args.daily)
+                print(f"[{account}] {path} ({time.perf_counter() - start:.2f}s)")
+            elif args.command == 'list':
+                for taken, path in list_snapshots(db_path):
+                    print(f"[{account}] {taken:%Y-%m-%d %H:%M:%S}  {os.path.getsize(path):>12,}  {path}")
+            elif args.command == 'prune':
+                for path in prune(db_path, args.keep, args.daily):
+                    print(f"[{account}] deleted {path}")
+            else:
+                path = restore(db_path, at=parse_time(args.at) if args.at else None)
+                print(f"[{account}] restored {path}")
+        except FileNotFoundError as e:
+            print(f"[{account}] skipped: {e}")
+
+if __name__ == "__main__":
+    sys.exit(main())
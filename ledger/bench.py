@@ -0,0 +1,509 @@
+"""Benchmark the account scripts on synthetic statements.
+
+    python -m ledger.bench --sizes 1k,10k --output results.json
+    python -m ledger.bench --sizes 1k --compare results.json
+    python -m ledger.bench --sizes '' --startup
+    python -m ledger.bench --sizes '' --handoff 10k,100k
+
+Every stage is timed per format and written as JSON so runs from
+different commits can be compared.
+"""
+import os
+import re
+import sys
+import json
+import time
+import shutil
+import sqlite3
+import argparse
+import platform
+import warnings
+import tempfile
+import subprocess
+import contextlib
+from datetime import datetime
+
+from ledger import accounts
+from ledger import amounts
+from ledger import dates
+from ledger import dedup
+from ledger import instrument
+from ledger import pagecache
+from ledger import storage
+from ledger import synthetic
+
+# Script that parses each synthetic format, and the merge script used for it
+FORMATS = {
+    'dbs': {
+        'script': 'DBS_CC_2009/DBS_CC_2009.py',
+        'extract': 'extract_transactions_from_pdf',
+        'merge': None,
+        'date_column': 'Date',
+    },
+    'sbi': {
+        'script': 'SBI_CC_7670/SBI_CC_7670.py',
+        'extract': 'extract_transactions_from_pdf',
+        'merge': 'SBI_CC_7670/SBI_CCMerge_7670.py',
+        'date_column': 'Date',
+    },
+    'phonepe': {
+        'script': 'PhonePeTransaction/phonepay.py',
+        'extract': 'extract_transactions_from_pdf',
+        'merge': 'PhonePeTransaction/PhonePeMerge.py',
+        'date_column': 'TransactionDate',
+    },
+    'icici_ca': {
+        'script': 'ICICI_CA_1849/ICICI_CA_1849.py',
+        'extract': 'extract_transactions_from_pdf',
+        'merge': None,
+        'date_column': 'TransactionDate',
+        'page_method': 'tables',
+    },
+    'icici_sa': {
+        'script': 'ICICI_SA_0090/ICICI_SA_0090.py',
+        'extract': 'extract_transactions_from_excel',
+        'merge': 'ICICI_SA_0090/ICICI_SAMerge_0090.py',
+        'date_column': 'Date',
+    },
+    'paytm': {
+        'script': 'PaytmTransactions/PaytmTransaction.py',
+        'extract': 'extract_transactions_from_excel',
+        'merge': 'PaytmTransactions/PaytmUPIMerge.py',
+        'date_column': 'Date',
+    },
+}
+
+STAGES = ['generate', 'open', 'page_extract', 'parse', 'normalize', 'dedup', 'write', 'index', 'merge', 'replay']
+# Not part of a run's total: generating inputs, and re-parsing over a warm page cache
+UNTIMED_STAGES = ('generate', 'replay')
+
+def parse_size(text):
+    text = text.strip().lower()
+    multiplier = 1
+    if text.endswith('k'):
+        multiplier, text = 1000, text[:-1]
+    elif text.endswith('m'):
+        multiplier, text = 1000000, text[:-1]
+    return int(float(text) * multiplier)
+
+@contextlib.contextmanager
+def quiet():
+    """Silence the scripts' progress printing while a stage is timed"""
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull), warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        yield
+
+class Timer:
+    def __init__(self):
+        self.stages = {}
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stages[name] = self.stages.get(name, 0.0) + time.perf_counter() - start
+
+def _is_pdf(path):
+    return path.lower().endswith('.pdf')
+
+def time_open_and_extract(path, config, timer):
+    if _is_pdf(path):
+        from ledger import pdfresources
+
+        with timer.stage('open'):
+            pdf = pdfresources.open_pdf(path)
+            page_count = len(pdf.pages)
+        try:
+            with timer.stage('page_extract'):
+                for page in pdf.pages:
+                    if config.get('page_method') == 'tables':
+                        page.extract_tables()
+                    else:
+                        page.extract_text()
+        finally:
+            pdf.close()
+        return page_count
+
+    import pandas as pd
+    import openpyxl  # noqa: F401 - imported lazily by pandas, keep it out of the timings
+
+    with timer.stage('open'):
+        sheets = pd.ExcelFile(path).sheet_names
+    with timer.stage('page_extract'):
+        pd.read_excel(path, sheet_name=None, header=None)
+    return len(sheets)
+
+def _records_frame(records):
+    import pandas as pd
+    return records.copy() if isinstance(records, pd.DataFrame) else pd.DataFrame(records)
+
+def run_format(name, rows, data_dir, work_dir):
+    import pandas as pd
+
+    config = FORMATS[name]
+    generator, extension = synthetic.GENERATORS[name]
+    script = accounts.load_module(config['script'])
+    merge_script = accounts.load_module(config['merge']) if config['merge'] else None
+    timer = Timer()
+
+    # Inputs are reused between runs; generating 1M-row statements is slow
+    input_path = os.path.join(data_dir, f"{name}_{rows}{extension}")
+    if not os.path.exists(input_path):
+        with timer.stage('generate'):
+            generator(input_path, rows)
+
+    pages = time_open_and_extract(input_path, config, timer)
+
+    # The scripts open, extract and parse in one function; parse is the remainder.
+    # Each run starts from an empty page cache, which that call fills
+    pagecache.configure(os.path.join(work_dir, f"{name}_{rows}_pages.db"))
+    instrument.reset()
+    start = time.perf_counter()
+    with quiet():
+        records = getattr(script, config['extract'])(input_path)
+    extract_total = time.perf_counter() - start
+    script_report = instrument.report()
+    timer.stages['parse'] = max(0.0, extract_total - timer.stages['open'] - timer.stages['page_extract'])
+
+    # A parser change replayed over the cached layout of the same statement
+    with timer.stage('replay'), quiet():
+        getattr(script, config['extract'])(input_path)
+
+    df = _records_frame(records)
+    date_column = config['date_column']
+
+    with timer.stage('normalize'), quiet():
+        dates.to_datetime64(df[date_column])
+
+    # Re-importing a statement that half overlaps what is already stored
+    with timer.stage('dedup'):
+        stored = amounts.add_paise_column(df.copy())
+        incoming = stored.sample(frac=0.5, random_state=0).reset_index(drop=True)
+        dedup.find_duplicates(stored, incoming)
+
+    db_path = os.path.join(work_dir, f"{name}_{rows}.db")
+    with timer.stage('write'), quiet():
+        script.create_database(records, db_path)
+    storage.close_pool(db_path)
+
+    conn = sqlite3.connect(db_path)
+    try:
+        conn.execute('DROP INDEX IF EXISTS idx_date')
+        with timer.stage('index'):
+            conn.execute(f'CREATE INDEX idx_date ON transactions("{date_column}")')
+            conn.commit()
+    finally:
+        conn.close()
+
+    if config['merge']:
+        half = len(df) // 2
+        part_paths = []
+        for i, part in enumerate([df.iloc[:half], df.iloc[half:]]):
+            part_path = os.path.join(work_dir, f"{name}_{rows}_part{i}.db")
+            part_records = part if isinstance(records, pd.DataFrame) else part.to_dict('records')
+            with quiet():
+                script.create_database(part_records, part_path)
+            storage.close_pool(part_path)
+            part_paths.append(part_path)
+        with timer.stage('merge'), quiet():
+            merge_script.merge_databases(part_paths[0], part_paths[1], os.path.join(work_dir, f"{name}_{rows}_merged.db"))
+
+    total = sum(seconds for stage, seconds in timer.stages.items() if stage not in UNTIMED_STAGES)
+    return {
+        'format': name,
+        'rows': rows,
+        'parsed_rows': len(df),
+        'pages': pages,
+        'stages': {stage: round(timer.stages[stage], 6) for stage in STAGES if stage in timer.stages},
+        'extract_total': round(extract_total, 6),
+        'total': round(total, 6),
+        'rows_per_sec': round(len(df) / total, 1) if total else None,
+        'script_stages': script_report['stages'],
+        'counters': script_report['counters'],
+        'rejects': script_report['rejects'],
+        'peak_memory_bytes': instrument.peak_memory_bytes(),
+    }
+
+def _clean_amount_per_value(value):
+    """The per-value approach ledger.amounts replaced, kept as the baseline"""
+    if value is None or value in ('NA', '-', ''):
+        return 0.0
+    try:
+        return float(re.sub(r'[^\d.-]', '', str(value)))
+    except ValueError:
+        return 0.0
+
+def bench_amounts(count, seed=0):
+    """Time amounts.to_paise against per-value parsing on count statement-style strings"""
+    import random
+
+    rng = random.Random(seed)
+    styles = ['{:,.2f}', '₹{:,.2f}', '{:,.2f} CR', '{:,.2f} DR', '({:,.2f})', '-{:.2f}', '{:.1f}']
+    values = []
+    for _ in range(count):
+        if rng.random() < 0.05:
+            values.append(rng.choice(['NA', '-', '']))
+        else:
+            values.append(rng.choice(styles).format(rng.randint(1, 5000000) / 100))
+
+    start = time.perf_counter()
+    for value in values:
+        _clean_amount_per_value(value)
+    per_value = time.perf_counter() - start
+
+    start = time.perf_counter()
+    amounts.to_paise(values)
+    vectorized = time.perf_counter() - start
+    return {
+        'values': count,
+        'per_value_seconds': round(per_value, 6),
+        'to_paise_seconds': round(vectorized, 6),
+        'speedup': round(per_value / vectorized, 1) if vectorized else None,
+    }
+
+# Subcommands of python -m ledger timed by --startup; {db} is a small database made for the run
+STARTUP_COMMANDS = {
+    'interpreter': None,
+    'ingest': ['ingest', '--help'],
+    'append': ['append', '--help'],
+    'merge': ['merge', '--help'],
+    'verify': ['verify', 'SBI_CC_7670', '--db', 'SBI_CC_7670={db}'],
+    'query': ['query', 'summary', 'SBI_CC_7670', '--db', 'SBI_CC_7670={db}'],
+}
+HEAVY_MODULES = ('numpy', 'pandas', 'pdfplumber')
+
+# Rows parsed from a statement this long are repeated up to each --sizes count
+HANDOFF_SAMPLE_ROWS = 200
+
+_handoff_rows = {}
+
+def _fresh(value):
+    """An equal str that is a new object, as a parser would produce"""
+    return value.encode('utf-8').decode('utf-8') if isinstance(value, str) else value
+
+def _tile(rows, count):
+    """count rows made by repeating a parsed sample
+
+    Every row and string is a new object: repeats of the same object would
+    pickle as back references and flatter the pickled baseline.
+    """
+    import numpy as np
+    import pandas as pd
+
+    copies = count // max(len(rows), 1) + 1
+    if isinstance(rows, pd.DataFrame):
+        frame = pd.concat([rows] * copies, ignore_index=True).iloc[:count].reset_index(drop=True)
+        for i, dtype in enumerate(frame.dtypes):
+            if dtype == object or isinstance(dtype, pd.StringDtype):
+                values = [_fresh(value) for value in frame.iloc[:, i].to_numpy(dtype=object)]
+                frame[frame.columns[i]] = pd.array(np.array(values, dtype=object), dtype=dtype)
+        return frame
+    return [{key: _fresh(value) for key, value in row.items()} for row in (rows * copies)[:count]]
+
+def _handoff_rows_in_child(name, path, count, shared):
+    """Parser process side of bench_handoff(): the rows, returned to be pickled or shared"""
+    from ledger import handoff
+
+    key = (path, count)
+    if key not in _handoff_rows:
+        config = FORMATS[name]
+        with quiet():
+            records = getattr(accounts.load_module(config['script']), config['extract'])(path)
+        _handoff_rows[key] = _tile(records, count)
+    rows = _handoff_rows[key]
+    return handoff.share(rows) if shared else rows
+
+def bench_handoff(names, sizes, data_dir, repeat=5):
+    """Parsed rows from a parser process to this one: pickled by the pool vs handoff.share()
+
+    Best of repeat wall times from submit() to a DataFrame of the rows here
+    (what the append scripts work on), for each format's parser output
+    repeated to each of sizes rows. The child parses once and keeps the
+    rows, so only the handoff is timed.
+    """
+    import pickle
+    import multiprocessing
+    import pandas as pd
+    from concurrent.futures import ProcessPoolExecutor
+    from ledger import handoff
+
+    results = []
+    with ProcessPoolExecutor(1, mp_context=multiprocessing.get_context('spawn')) as pool:
+        for name in names:
+            generator, extension = synthetic.GENERATORS[name]
+            path = os.path.join(data_dir, f"handoff_{name}_{HANDOFF_SAMPLE_ROWS}{extension}")
+            if not os.path.exists(path):
+                generator(path, HANDOFF_SAMPLE_ROWS)
+            for count in sizes:
+                pool.submit(_handoff_rows_in_child, name, path, count, False).result()
+                pickled_times, shared_times = [], []
+                for _ in range(repeat):
+                    start = time.perf_counter()
+                    pickled = pool.submit(_handoff_rows_in_child, name, path, count, False).result()
+                    pickled_frame = pickled if isinstance(pickled, pd.DataFrame) else pd.DataFrame(pickled)
+                    pickled_times.append(time.perf_counter() - start)
+
+                    start = time.perf_counter()
+                    handle = pool.submit(_handoff_rows_in_child, name, path, count, True).result()
+                    batch = handoff.attach(handle)
+                    shared_frame = batch.frame()
+                    shared_times.append(time.perf_counter() - start)
+                    same = shared_frame.equals(pickled_frame)
+                    del shared_frame
+                    batch.close()
+                results.append({
+                    'format': name,
+                    'rows': count,
+                    'records': type(pickled).__name__,
+                    'pickle_seconds': round(min(pickled_times), 6),
+                    'shared_seconds': round(min(shared_times), 6),
+                    'pickle_bytes': len(pickle.dumps(pickled, protocol=pickle.HIGHEST_PROTOCOL)),
+                    'shared_bytes': handle['size'],
+                    'same_rows': same,
+                })
+    return results
+
+def _startup_db(path):
+    conn = sqlite3.connect(path)
+    conn.execute('CREATE TABLE transactions (Date TEXT, TransactionDetails TEXT, Amount REAL, AmountPaise INTEGER, '
+                 'BillingAmountSign TEXT, DateKey TEXT, DaySeq INTEGER)')
+    conn.executemany('INSERT INTO transactions VALUES (?, ?, ?, ?, ?, ?, ?)', [
+        ('01-Apr-23', 'AMAZON', 1250.0, 125000, 'D', '2023-04-01', 1),
+        ('02-Apr-23', 'PAYMENT RECEIVED', 1250.0, 125000, 'C', '2023-04-02', 1),
+    ])
+    conn.commit()
+    conn.close()
+
+def bench_startup(repeat=5):
+    """Cold start of every python -m ledger subcommand in fresh interpreters
+
+    Best of repeat wall times, and which of HEAVY_MODULES the subcommand
+    imported (from -X importtime). 'interpreter' is python -c pass.
+    """
+    work_dir = tempfile.mkdtemp(prefix='ledger_startup_')
+    db_path = os.path.join(work_dir, 'startup.db')
+    _startup_db(db_path)
+    results = {}
+    try:
+        for name, args in STARTUP_COMMANDS.items():
+            command = ['-c', 'pass'] if args is None else ['-m', 'ledger'] + [arg.format(db=db_path) for arg in args]
+            times = []
+            for _ in range(repeat):
+                start = time.perf_counter()
+                subprocess.run([sys.executable] + command, cwd=accounts.REPO_ROOT, capture_output=True, check=True)
+                times.append(time.perf_counter() - start)
+            trace = subprocess.run([sys.executable, '-X', 'importtime'] + command, cwd=accounts.REPO_ROOT,
+                                   capture_output=True, text=True, check=True)
+            imported = {line.rsplit('|', 1)[-1].strip() for line in trace.stderr.splitlines() if line.startswith('import time:')}
+            results[name] = {
+                'seconds': round(min(times), 4),
+                'heavy_imports': [module for module in HEAVY_MODULES if module in imported],
+            }
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    return results
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=accounts.REPO_ROOT,
+                                       stderr=subprocess.DEVNULL, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def compare(results, baseline):
+    """Print per-stage ratios against an earlier run (>1.00 means slower now)"""
+    previous = {(r['format'], r['rows']): r for r in baseline['results']}
+    print(f"\nCompared with {baseline['meta'].get('commit')} ({baseline['meta'].get('timestamp')}):")
+    for result in results:
+        old = previous.get((result['format'], result['rows']))
+        if old is None:
+            continue
+        parts = []
+        for stage in STAGES[1:] + ['total']:
+            new_value = result['stages'].get(stage) if stage != 'total' else result['total']
+            old_value = old['stages'].get(stage) if stage != 'total' else old['total']
+            if new_value is not None and old_value:
+                parts.append(f"{stage} x{new_value / old_value:.2f}")
+        print(f"{result['format']:>9} {result['rows']:>8}: " + ', '.join(parts))
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Time every pipeline stage on synthetic statements")
+    parser.add_argument('--sizes', default='1k,10k', help="Comma separated row counts, e.g. 1k,10k,100k,1M")
+    parser.add_argument('--formats', default=','.join(FORMATS), help="Comma separated subset of " + ', '.join(FORMATS))
+    parser.add_argument('--data-dir', help="Keep generated statements here between runs")
+    parser.add_argument('--output', help="Write JSON results to this file (default: stdout)")
+    parser.add_argument('--compare', help="Earlier JSON results to compare against")
+    parser.add_argument('--amounts', help="Also time amount parsing on this many values, e.g. 1M")
+    parser.add_argument('--startup', action='store_true', help="Also time the cold start of every python -m ledger subcommand")
+    parser.add_argument('--handoff', help="Also time handing this many parsed rows back from a parser process, "
+                                           "pickled vs shared memory, e.g. 10k,100k")
+    args = parser.parse_args(argv)
+
+    instrument.configure(quiet=True)
+    sizes = [parse_size(s) for s in args.sizes.split(',') if s.strip()]
+    formats = [f.strip() for f in args.formats.split(',') if f.strip()]
+    for name in formats:
+        if name not in FORMATS:
+            raise SystemExit(f"Unknown format: {name}")
+
+    data_dir = args.data_dir or tempfile.mkdtemp(prefix='ledger_bench_data_')
+    os.makedirs(data_dir, exist_ok=True)
+    work_dir = tempfile.mkdtemp(prefix='ledger_bench_')
+
+    results = []
+    try:
+        for rows in sizes:
+            for name in formats:
+                print(f"Running {name} with {rows} rows...", file=sys.stderr)
+                result = run_format(name, rows, data_dir, work_dir)
+                print(f"  {result['total']:.2f}s, {result['rows_per_sec']} rows/s", file=sys.stderr)
+                results.append(result)
+    finally:
+        storage.close_all()
+        shutil.rmtree(work_dir, ignore_errors=True)
+        if not args.data_dir:
+            shutil.rmtree(data_dir, ignore_errors=True)
+
+    report = {
+        'meta': {
+            'commit': git_commit(),
+            'timestamp': datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+        },
+        'results': results,
+    }
+    if args.amounts:
+        print(f"Timing amount parsing on {args.amounts} values...", file=sys.stderr)
+        report['amounts'] = bench_amounts(parse_size(args.amounts))
+    if args.handoff:
+        print("Timing the parser process handoff...", file=sys.stderr)
+        handoff_dir = args.data_dir or tempfile.mkdtemp(prefix='ledger_bench_data_')
+        try:
+            report['handoff'] = bench_handoff(formats, [parse_size(s) for s in args.handoff.split(',') if s.strip()], handoff_dir)
+        finally:
+            if not args.data_dir:
+                shutil.rmtree(handoff_dir, ignore_errors=True)
+        for result in report['handoff']:
+            print(f"  {result['format']:>9} {result['rows']:>8}: pickled {result['pickle_seconds']:.4f}s, "
+                  f"shared {result['shared_seconds']:.4f}s ({result['records']})", file=sys.stderr)
+    if args.startup:
+        print("Timing subcommand cold start...", file=sys.stderr)
+        report['startup'] = bench_startup()
+        for name, result in report['startup'].items():
+            print(f"  {name:>11}: {result['seconds']:.3f}s {' '.join(result['heavy_imports'])}", file=sys.stderr)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"Results written to {args.output}", file=sys.stderr)
+    else:
+        print(json.dumps(report, indent=2))
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare(results, json.load(f))
+
+if __name__ == "__main__":
+    sys.exit(main())
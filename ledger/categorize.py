@@ -0,0 +1,227 @@
+"""Rule-based categorization with a stored CategoryId per transaction.
+
+The rules live in a JSON file (categories.json next to this module, or the
+file named by LEDGER_CATEGORIES). Matcher compiles them once: each rule's
+keywords, regex and counterparty ids become one case-insensitive regex,
+evaluated over the distinct narrations of a batch only, and its amount
+band and direction become array comparisons. For every row the first rule
+(in file order) whose conditions all hold wins.
+
+Each row stores the category id (names are kept in the `categories`
+table) and the fingerprint of the rule that matched. The fingerprints of
+the rules last applied are kept in ledger_meta, so after an edit
+recategorize() only re-evaluates rows that matched an edited, removed or
+moved rule, or that an added or edited rule now matches, and only writes
+the rows whose category actually changes.
+"""
+import os
+import re
+import sys
+import json
+import hashlib
+import argparse
+
+import numpy as np
+import pandas as pd
+
+from ledger import accounts
+from ledger import aggregates
+from ledger import amounts
+from ledger import dedup
+from ledger import instrument
+from ledger import storage
+
+RULES_PATH = os.environ.get('LEDGER_CATEGORIES', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'categories.json'))
+CATEGORY_COLUMNS = [('CategoryId', 'INTEGER'), ('CategoryRule', 'TEXT')]
+APPLIED_RULES_KEY = 'category_rules'
+
+CATEGORIES_TABLE_SQL = """
+CREATE TABLE IF NOT EXISTS categories (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL UNIQUE
+)
+"""
+
+def load_rules(path=None):
+    with open(path or RULES_PATH, encoding='utf-8') as f:
+        return json.load(f)['rules']
+
+def rule_fingerprint(rule):
+    return hashlib.sha1(json.dumps(rule, sort_keys=True).encode('utf-8')).hexdigest()[:12]
+
+def rule_pattern(rule):
+    """One regex for a rule's text conditions, or None when it has none"""
+    parts = [re.escape(word.lower()) for word in rule.get('keywords', [])]
+    if rule.get('regex'):
+        parts.append(f"(?:{rule['regex']})")
+    parts += [rf"(?<![\w@.]){re.escape(str(cid).lower())}(?![\w@.])" for cid in rule.get('counterparty', [])]
+    return re.compile('|'.join(parts), re.IGNORECASE) if parts else None
+
+class Matcher:
+    """A rules file compiled for batch matching"""
+
+    def __init__(self, rules):
+        self.rules = []
+        seen = set()
+        for rule in rules:
+            fingerprint = rule_fingerprint(rule)
+            if fingerprint in seen:
+                continue
+            seen.add(fingerprint)
+            self.rules.append(rule)
+        self.fingerprints = [rule_fingerprint(rule) for rule in self.rules]
+        self.patterns = [rule_pattern(rule) for rule in self.rules]
+        self.categories = [rule['category'] for rule in self.rules]
+
+    def match(self, narrations, paise, is_debit, only=None):
+        """Index of the first matching rule per row, -1 for none
+
+        only limits the search to a set of rule indexes.
+        """
+        codes, distinct = pd.factorize(pd.Series(narrations, dtype=object).fillna('').astype(str))
+        paise = np.abs(np.asarray(paise, dtype='int64'))
+        is_debit = np.asarray(is_debit, dtype=bool)
+        result = np.full(len(codes), -1, dtype='int64')
+
+        for index, rule in enumerate(self.rules):
+            if only is not None and index not in only:
+                continue
+            open_rows = result < 0
+            if not open_rows.any():
+                break
+            matched = open_rows.copy()
+            if self.patterns[index] is not None:
+                search = self.patterns[index].search
+                hits = np.fromiter((search(text) is not None for text in distinct), dtype=bool, count=len(distinct))
+                matched &= hits[codes]
+            if 'min_amount' in rule:
+                matched &= paise >= round(rule['min_amount'] * 100)
+            if 'max_amount' in rule:
+                matched &= paise <= round(rule['max_amount'] * 100)
+            if rule.get('direction') == 'debit':
+                matched &= is_debit
+            elif rule.get('direction') == 'credit':
+                matched &= ~is_debit
+            result[matched] = index
+        return result
+
+def match_inputs(df):
+    """(narrations, paise, is_debit) from a transactions frame of any account schema"""
+    columns = list(df.columns)
+    details_col = aggregates.find_column(columns, dedup.DETAILS_COLUMNS)
+    paise = df['AmountPaise'].fillna(0).to_numpy(dtype='int64') if 'AmountPaise' in columns else amounts.to_paise(df['Amount'])
+    sign_col = aggregates.find_column(columns, aggregates.SIGN_COLUMNS)
+    return df[details_col].to_numpy(dtype=object), paise, df[sign_col].isin(aggregates.DEBIT_SIGNS).to_numpy()
+
+def category_ids(conn, names):
+    """{name: id}, adding names not seen before"""
+    conn.execute(CATEGORIES_TABLE_SQL)
+    conn.executemany('INSERT OR IGNORE INTO categories (name) VALUES (?)', [(name,) for name in sorted(set(names))])
+    return dict(conn.execute('SELECT name, id FROM categories').fetchall())
+
+def ensure_category_columns(conn, table='transactions'):
+    columns = storage.table_columns(conn, table)
+    for name, sql_type in CATEGORY_COLUMNS:
+        if name not in columns:
+            conn.execute(f'ALTER TABLE "{table}" ADD COLUMN {name} {sql_type}')
+    conn.execute(f'CREATE INDEX IF NOT EXISTS idx_category ON "{table}"(CategoryId)')
+    conn.execute(f'CREATE INDEX IF NOT EXISTS idx_category_rule ON "{table}"(CategoryRule)')
+    conn.execute(CATEGORIES_TABLE_SQL)
+
+def add_category_columns(conn, df, matcher=None):
+    """Set CategoryId / CategoryRule on rows about to be stored"""
+    matcher = matcher or Matcher(load_rules())
+    with instrument.stage('categorize'):
+        rule_index = matcher.match(*match_inputs(df))
+    ids = category_ids(conn, matcher.categories)
+    df['CategoryId'] = [ids[matcher.categories[i]] if i >= 0 else None for i in rule_index]
+    df['CategoryRule'] = [matcher.fingerprints[i] if i >= 0 else None for i in rule_index]
+    instrument.count('categorized', int((rule_index >= 0).sum()))
+    return df
+
+def changed_rules(old, new):
+    """Fingerprints whose rows may move: removed, added, or moved relative to the rules they share"""
+    changed = set(old) ^ set(new)
+    common = set(old) & set(new)
+    old_common = [f for f in old if f in common]
+    new_common = [f for f in new if f in common]
+    for fingerprint in common:
+        # A rule's outcome can only change if the rules ahead of it changed
+        if set(old_common[:old_common.index(fingerprint)]) != set(new_common[:new_common.index(fingerprint)]):
+            changed.add(fingerprint)
+    return changed
+
+def recategorize(conn, matcher=None, table='transactions'):
+    """Bring stored categories in line with the current rules; returns the number of rows updated"""
+    ensure_category_columns(conn, table)
+    matcher = matcher or Matcher(load_rules())
+    applied = storage.get_meta(conn, APPLIED_RULES_KEY)
+    old = json.loads(applied) if applied else None
+    if old == matcher.fingerprints:
+        return 0
+
+    with instrument.stage('recategorize'):
+        columns = storage.table_columns(conn, table)
+        details_col = aggregates.find_column(columns, dedup.DETAILS_COLUMNS)
+        sign_col = aggregates.find_column(columns, aggregates.SIGN_COLUMNS)
+        rows = pd.read_sql_query(f'''
+            SELECT rowid AS row_id, "{details_col}", "{sign_col}",
+                   {storage.amount_paise_sql(columns)} AS AmountPaise, CategoryId, CategoryRule
+            FROM "{table}"
+        ''', conn)
+
+        if old is None:
+            candidates = np.ones(len(rows), dtype=bool)
+        else:
+            changed = changed_rules(old, matcher.fingerprints)
+            # Rows whose rule was edited, removed or moved ...
+            candidates = rows['CategoryRule'].isin(changed).to_numpy().copy()
+            # ... and rows an added, edited or moved rule now matches
+            new_rules = {i for i, f in enumerate(matcher.fingerprints) if f in changed}
+            if new_rules:
+                candidates |= matcher.match(*match_inputs(rows), only=new_rules) >= 0
+
+        rows = rows[candidates]
+        rule_index = matcher.match(*match_inputs(rows))
+        ids = category_ids(conn, matcher.categories)
+        new_rule = np.array([matcher.fingerprints[i] if i >= 0 else None for i in rule_index], dtype=object)
+        # A rule always maps to the same category, so comparing rules finds every row that moves
+        moved = rows['CategoryRule'].fillna('').to_numpy() != np.where(rule_index >= 0, new_rule, '')
+
+        updates = [(ids[matcher.categories[i]] if i >= 0 else None, rule, int(row_id))
+                   for i, rule, row_id in zip(rule_index[moved], new_rule[moved], rows['row_id'].to_numpy()[moved])]
+        conn.executemany(f'UPDATE "{table}" SET CategoryId = ?, CategoryRule = ? WHERE rowid = ?', updates)
+        storage.set_meta(conn, APPLIED_RULES_KEY, json.dumps(matcher.fingerprints))
+
+    instrument.count('recategorize_checked', len(rows))
+    instrument.count('recategorize_updated', len(updates))
+    return len(updates)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Apply the categorization rules to the account databases")
+    parser.add_argument('accounts', nargs='*', help="Accounts to update (default: all)")
+    parser.add_argument('--db', action='append', metavar='ACCOUNT=PATH',
+                        help="Override the database path of an account")
+    parser.add_argument('--rules', help="Rules file (default: LEDGER_CATEGORIES or ledger/categories.json)")
+    args = parser.parse_args(argv)
+
+    matcher = Matcher(load_rules(args.rules))
+    db_paths = accounts.db_paths(accounts.parse_db_overrides(args.db))
+    for account in args.accounts or sorted(db_paths):
+        if account not in db_paths:
+            raise SystemExit(f"Unknown account: {account}")
+        if not os.path.exists(db_paths[account]):
+            print(f"[{account}] skipped: {db_paths[account]} not found")
+            continue
+        conn = storage.connect(db_paths[account])
+        try:
+            updated = recategorize(conn, matcher)
+            if updated:
+                storage.bump_version(conn)
+            conn.commit()
+            print(f"[{account}] {updated} row(s) recategorized")
+        finally:
+            conn.close()
+
+if __name__ == "__main__":
+    sys.exit(main())
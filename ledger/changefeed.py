@@ -0,0 +1,104 @@
+"""Append-only change log of the transactions table.
+
+Triggers record every insert, update and delete in `changes` under an
+increasing seq. Inserts and updates keep only the rowid (the row itself is
+read back when the change is consumed); deletes keep the old row as JSON
+because it is gone by then.
+
+A consumer remembers the last seq it applied and calls changes_since()
+with it to get only what happened after. A rebuild (create_database or a
+merge writing a new file) continues the old file's numbering with a
+'reset' change followed by an 'insert' for every row, so the consumer
+drops its state and loads the new contents.
+"""
+import json
+import sqlite3
+
+import pandas as pd
+
+from ledger import storage
+
+CHANGES_TABLE_SQL = """
+CREATE TABLE IF NOT EXISTS changes (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    op TEXT NOT NULL,
+    row_id INTEGER,
+    old_row TEXT
+)
+"""
+
+def last_seq(conn):
+    """Highest seq handed out so far; 0 when there is no change log"""
+    try:
+        row = conn.execute("SELECT seq FROM sqlite_sequence WHERE name = 'changes'").fetchone()
+    except sqlite3.OperationalError:
+        return 0
+    return row[0] if row else 0
+
+def install_triggers(conn, table='transactions'):
+    """(Re)create the logging triggers; the delete trigger lists the table's current columns"""
+    old_row = ', '.join(f"'{col}', OLD.\"{col}\"" for col in storage.table_columns(conn, table))
+    conn.execute(f'DROP TRIGGER IF EXISTS {table}_log_insert')
+    conn.execute(f'DROP TRIGGER IF EXISTS {table}_log_update')
+    conn.execute(f'DROP TRIGGER IF EXISTS {table}_log_delete')
+    conn.execute(f'''
+        CREATE TRIGGER {table}_log_insert AFTER INSERT ON "{table}"
+        BEGIN INSERT INTO changes (op, row_id) VALUES ('insert', NEW.rowid); END''')
+    conn.execute(f'''
+        CREATE TRIGGER {table}_log_update AFTER UPDATE ON "{table}"
+        BEGIN INSERT INTO changes (op, row_id) VALUES ('update', NEW.rowid); END''')
+    conn.execute(f'''
+        CREATE TRIGGER {table}_log_delete AFTER DELETE ON "{table}"
+        BEGIN INSERT INTO changes (op, row_id, old_row) VALUES ('delete', OLD.rowid, json_object({old_row})); END''')
+
+def log_all_rows(conn, table='transactions'):
+    conn.execute(f'INSERT INTO changes (op, row_id) SELECT \'insert\', rowid FROM "{table}" ORDER BY rowid')
+
+def ensure_changefeed(conn, table='transactions'):
+    """Start logging changes; rows stored before the log existed are logged as inserts
+
+    Call after any migration that adds columns, so deletes keep them too.
+    """
+    is_new = conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'changes'").fetchone() is None
+    conn.execute(CHANGES_TABLE_SQL)
+    if is_new:
+        log_all_rows(conn, table)
+    install_triggers(conn, table)
+
+def record_rebuild(conn, previous_seq, table='transactions'):
+    """Log a freshly built table as 'reset' plus one insert per row, numbered after previous_seq"""
+    conn.execute(CHANGES_TABLE_SQL)
+    conn.execute("INSERT INTO changes (seq, op) VALUES (?, 'reset')", (previous_seq + 1,))
+    log_all_rows(conn, table)
+    install_triggers(conn, table)
+
+def changes_since(conn, cursor=0, limit=None, table='transactions'):
+    """(changes, new_cursor) for everything logged after cursor
+
+    changes has seq, op, row_id and the row's columns: the current values
+    for inserts and updates (all None if the row was deleted later), the
+    old values for deletes. Pass new_cursor to the next call.
+    """
+    if conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'changes'").fetchone() is None:
+        return pd.DataFrame(columns=['seq', 'op', 'row_id']), cursor
+    query = f'''
+        SELECT c.seq, c.op, c.row_id, c.old_row, t.*
+        FROM changes c LEFT JOIN "{table}" t ON t.rowid = c.row_id AND c.op != 'delete'
+        WHERE c.seq > ?
+        ORDER BY c.seq
+    '''
+    params = [cursor]
+    if limit:
+        query += ' LIMIT ?'
+        params.append(limit)
+    changes = pd.read_sql_query(query, conn, params=params)
+
+    deleted = changes['op'] == 'delete'
+    if deleted.any():
+        old = pd.DataFrame([json.loads(v) for v in changes.loc[deleted, 'old_row']], index=changes.index[deleted])
+        columns = [col for col in old.columns if col in changes.columns]
+        changes[columns] = changes[columns].astype(object)
+        changes.loc[old.index, columns] = old[columns].astype(object)
+    changes = changes.drop(columns='old_row')
+    new_cursor = int(changes['seq'].iloc[-1]) if len(changes) else cursor
+    return changes, new_cursor
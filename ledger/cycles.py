@@ -0,0 +1,251 @@
+"""Statement (billing) cycles of the credit card ledgers.
+
+Every card statement is one cycle. read_statement() picks the statement
+date, period, payment due date, previous balance and printed total due off
+the statement header; statement_cycle() adds the purchase, payment and
+refund totals of the statement's own rows. record_cycle() keeps one row
+per cycle in `cycles`, keyed by statement date, and the stored
+transactions carry that date in StatementDate (indexed), so "what was
+billed in the March cycle" reads one cycles row and its rows through
+idx_statement instead of scanning the table with date arithmetic.
+
+check_cycles() compares each cycle's printed total with previous balance +
+purchases - payments - refunds. The previous balance is the one printed on
+the statement, or the printed total of the cycle before it.
+"""
+import os
+import re
+import sys
+import sqlite3
+import argparse
+
+import numpy as np
+import pandas as pd
+
+from ledger import accounts
+from ledger import aggregates
+from ledger import amounts
+from ledger import categorize
+from ledger import dates
+from ledger import instrument
+from ledger import ordering
+from ledger import pagecache
+from ledger import storage
+
+STATEMENT_COLUMN = 'StatementDate'
+# Header fields are looked for on the first pages only
+HEADER_PAGES = 2
+
+_DATE = r'(\d{1,2}[-/ ][A-Za-z]{3}[-/ ,]+\d{2,4}|\d{1,2}[-/]\d{1,2}[-/]\d{2,4}|\d{4}-\d{2}-\d{2})'
+_AMOUNT = r'(?:\(\s*\S?\s*\)\s*)?:?\s*(?:Rs\.?|INR|₹)?\s*(-?[\d,]+\.\d{2})(\s*CR\b)?'
+HEADER_PATTERNS = {
+    'period': re.compile(r'(?:statement|billing) period\s*:?\s*' + _DATE + r'\s*(?:to|-|–)\s*' + _DATE, re.IGNORECASE),
+    'statement_date': re.compile(r'statement date\s*:?\s*' + _DATE, re.IGNORECASE),
+    'due_date': re.compile(r'due date\s*:?\s*' + _DATE, re.IGNORECASE),
+    'previous_balance': re.compile(r'(?:previous|opening) balance\s*' + _AMOUNT, re.IGNORECASE),
+    'printed_total': re.compile(r'total (?:amount )?dues?\s*' + _AMOUNT, re.IGNORECASE),
+}
+
+HEADER_FIELDS = ['period_start', 'period_end', 'statement_date', 'due_date', 'previous_balance', 'printed_total']
+
+# Card credits that are not bill payments
+REFUND_PATTERN = re.compile(r'refund|reversal|cashback|cash back', re.IGNORECASE)
+
+CYCLES_TABLE_SQL = """
+CREATE TABLE IF NOT EXISTS cycles (
+    statement_date TEXT PRIMARY KEY,
+    period_start TEXT NOT NULL,
+    period_end TEXT NOT NULL,
+    due_date TEXT,
+    row_count INTEGER NOT NULL,
+    purchases_paise INTEGER NOT NULL,
+    payments_paise INTEGER NOT NULL,
+    refunds_paise INTEGER NOT NULL,
+    previous_balance_paise INTEGER,
+    printed_total_paise INTEGER,
+    expected_total_paise INTEGER,
+    difference_paise INTEGER
+)
+"""
+
+CYCLE_COLUMNS = ['statement_date', 'period_start', 'period_end', 'due_date', 'row_count', 'purchases_paise',
+                 'payments_paise', 'refunds_paise', 'previous_balance_paise', 'printed_total_paise']
+
+def _iso(text):
+    parsed = dates.parse_date(text.replace(',', ' ').replace('  ', ' ')) if text else np.datetime64('NaT')
+    return None if np.isnat(parsed) else str(np.datetime_as_string(parsed, unit='D'))
+
+def _paise(amount, credit):
+    paise = int(amounts.to_paise([amount])[0])
+    return -abs(paise) if credit else paise
+
+def parse_summary(text, summary=None):
+    """Fill the header fields found in a page's text into summary (a dict); fields already found are kept"""
+    summary = summary if summary is not None else {}
+    for field, pattern in HEADER_PATTERNS.items():
+        if summary.get('period_end' if field == 'period' else field) is not None:
+            continue
+        match = pattern.search(text or '')
+        if not match:
+            continue
+        if field == 'period':
+            summary['period_start'], summary['period_end'] = _iso(match.group(1)), _iso(match.group(2))
+        elif field in ('statement_date', 'due_date'):
+            summary[field] = _iso(match.group(1))
+        else:
+            summary[field] = _paise(match.group(1), bool(match.group(2)))
+    return summary
+
+def read_statement(pdf_path):
+    """Header fields of a card statement PDF; missing ones are None"""
+    from ledger import pdfresources
+
+    summary = {}
+    with instrument.stage('statement_header'):
+        with pdfresources.open_pdf(pdf_path) as pdf:
+            for page in pdf.pages[:HEADER_PAGES]:
+                parse_summary(pagecache.page_text(page), summary)
+                if all(summary.get(field) is not None for field in HEADER_FIELDS):
+                    break
+    return summary
+
+def statement_cycle(df, statement, date_column):
+    """The cycles row of one statement from its parsed rows (all of them, before dedup) and header
+
+    Without a header the period is the span of the rows' dates and the
+    statement date its last day; nothing is printed to check against then.
+    """
+    statement = statement or {}
+    keys = pd.Series(ordering.date_keys(df[date_column]), dtype=object).dropna()
+    first, last = (keys.min(), keys.max()) if len(keys) else (None, None)
+    period_end = statement.get('period_end') or statement.get('statement_date') or last
+    if period_end is None:
+        return None
+
+    narrations, paise, is_debit = categorize.match_inputs(df)
+    paise = np.abs(paise)
+    is_refund = ~is_debit & pd.Series(narrations, dtype=object).fillna('').astype(str).str.contains(REFUND_PATTERN).to_numpy()
+    return {
+        'statement_date': statement.get('statement_date') or period_end,
+        'period_start': statement.get('period_start') or first or period_end,
+        'period_end': period_end,
+        'due_date': statement.get('due_date'),
+        'row_count': len(df),
+        'purchases_paise': int(paise[is_debit].sum()),
+        'payments_paise': int(paise[~is_debit & ~is_refund].sum()),
+        'refunds_paise': int(paise[is_refund].sum()),
+        'previous_balance_paise': statement.get('previous_balance'),
+        'printed_total_paise': statement.get('printed_total'),
+    }
+
+def tag_rows(df, cycle):
+    """Set StatementDate on the rows of a statement about to be stored"""
+    df[STATEMENT_COLUMN] = cycle['statement_date'] if cycle else None
+    return df
+
+def has_cycles(conn):
+    return conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'cycles'").fetchone() is not None
+
+def ensure_cycles(conn, table='transactions'):
+    if STATEMENT_COLUMN not in storage.table_columns(conn, table):
+        conn.execute(f'ALTER TABLE "{table}" ADD COLUMN {STATEMENT_COLUMN} TEXT')
+    conn.execute(f'CREATE INDEX IF NOT EXISTS idx_statement ON "{table}"({STATEMENT_COLUMN})')
+    conn.execute(CYCLES_TABLE_SQL)
+
+def check_cycles(conn):
+    """Recompute every cycle's expected total and its difference from the printed one; returns the mismatches"""
+    cycles = pd.read_sql_query('SELECT * FROM cycles ORDER BY statement_date', conn)
+    printed = pd.to_numeric(cycles['printed_total_paise'], errors='coerce')
+    opening = pd.to_numeric(cycles['previous_balance_paise'], errors='coerce').fillna(printed.shift(1))
+    expected = opening + cycles['purchases_paise'] - cycles['payments_paise'] - cycles['refunds_paise']
+    difference = printed - expected
+    to_int = lambda values: [None if pd.isna(v) else int(v) for v in values]
+    conn.executemany('UPDATE cycles SET expected_total_paise = ?, difference_paise = ? WHERE statement_date = ?',
+                     zip(to_int(expected), to_int(difference), cycles['statement_date']))
+    mismatched = cycles[difference.fillna(0) != 0].assign(expected_total_paise=expected, difference_paise=difference)
+    instrument.count('cycle_mismatches', len(mismatched))
+    return mismatched
+
+def record_cycle(conn, cycle, table='transactions'):
+    """Store (or replace) a statement's cycle and check it against its printed total"""
+    ensure_cycles(conn, table)
+    if cycle is None:
+        return
+    conn.execute(f"INSERT OR REPLACE INTO cycles ({', '.join(CYCLE_COLUMNS)}) VALUES ({', '.join('?' * len(CYCLE_COLUMNS))})",
+                 [cycle[column] for column in CYCLE_COLUMNS])
+    mismatched = check_cycles(conn)
+    for row in mismatched[mismatched['statement_date'] == cycle['statement_date']].itertuples(index=False):
+        print(f"Cycle {row.statement_date}: printed total {aggregates.to_rupees(row.printed_total_paise):,.2f} "
+              f"but the statement adds up to {aggregates.to_rupees(row.expected_total_paise):,.2f}")
+
+def merge_cycles(conn, source_paths, table='transactions'):
+    """Copy the cycles of the source databases; the first source wins for a statement date in both"""
+    ensure_cycles(conn, table)
+    for path in source_paths:
+        if not os.path.exists(path):
+            continue
+        source = sqlite3.connect(path)
+        try:
+            if not has_cycles(source):
+                continue
+            rows = source.execute(f"SELECT {', '.join(CYCLE_COLUMNS)} FROM cycles").fetchall()
+        finally:
+            source.close()
+        conn.executemany(f"INSERT OR IGNORE INTO cycles ({', '.join(CYCLE_COLUMNS)}) "
+                         f"VALUES ({', '.join('?' * len(CYCLE_COLUMNS))})", rows)
+    check_cycles(conn)
+
+def find_cycles(conn, month):
+    """Cycles whose statement date falls in a 'YYYY-MM' month"""
+    return pd.read_sql_query("SELECT * FROM cycles WHERE statement_date >= ? AND statement_date < ? ORDER BY statement_date",
+                             conn, params=[f'{month}-01', f'{month}-32'])
+
+def cycle_rows(conn, statement_date, table='transactions'):
+    """Rows stored from one statement, through idx_statement"""
+    return pd.read_sql_query(f'SELECT * FROM "{table}" WHERE {STATEMENT_COLUMN} = ? ORDER BY {ordering.ORDER_BY}',
+                             conn, params=[statement_date])
+
+def print_cycles(cycles):
+    if cycles.empty:
+        print("No statement cycles recorded")
+        return
+    rupees = lambda paise: '' if pd.isna(paise) else f"{aggregates.to_rupees(paise):,.2f}"
+    print(f"{'Statement':10}  {'Period':23}  {'Due':10}  {'Purchases':>12}  {'Payments':>12}  {'Refunds':>10}  {'Printed':>12}  {'Difference':>10}")
+    for row in cycles.itertuples(index=False):
+        print(f"{row.statement_date:10}  {row.period_start} to {row.period_end}  {row.due_date or '':10}  "
+              f"{rupees(row.purchases_paise):>12}  {rupees(row.payments_paise):>12}  {rupees(row.refunds_paise):>10}  "
+              f"{rupees(row.printed_total_paise):>12}  {rupees(row.difference_paise):>10}")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Show the statement cycles of the card accounts")
+    parser.add_argument('accounts', nargs='*', default=['DBS_CC_2009', 'SBI_CC_7670'], help="Accounts to show (default: the cards)")
+    parser.add_argument('--db', action='append', metavar='ACCOUNT=PATH',
+                        help="Override the database path of an account")
+    parser.add_argument('--month', help="Only the cycle(s) with a statement date in this month (YYYY-MM), with their rows")
+    args = parser.parse_args(argv)
+
+    db_paths = accounts.db_paths(accounts.parse_db_overrides(args.db))
+    for account in args.accounts:
+        if account not in db_paths:
+            raise SystemExit(f"Unknown account: {account}")
+        if not os.path.exists(db_paths[account]):
+            print(f"[{account}] skipped: {db_paths[account]} not found")
+            continue
+        conn = storage.connect(db_paths[account], readonly=True)
+        try:
+            print(f"[{account}]")
+            if not has_cycles(conn):
+                print("No statement cycles recorded")
+                continue
+            if not args.month:
+                print_cycles(pd.read_sql_query('SELECT * FROM cycles ORDER BY statement_date', conn))
+                continue
+            found = find_cycles(conn, args.month)
+            print_cycles(found)
+            for statement_date in found['statement_date']:
+                print(cycle_rows(conn, statement_date).to_string(index=False))
+        finally:
+            conn.close()
+
+if __name__ == "__main__":
+    sys.exit(main())
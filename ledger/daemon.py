@@ -0,0 +1,340 @@
+import os
+import sys
+import time
+import queue
+import shutil
+import argparse
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+from ledger import accounts
+from ledger import backup
+from ledger import handoff
+from ledger import matching
+from ledger import storage
+from ledger import writer
+
+try:
+    import inotify_simple
+except ImportError:
+    inotify_simple = None
+
+STATEMENT_EXTENSIONS = ('.pdf', '.xls', '.xlsx')
+
+# Names written by browsers / office apps while a download is still in progress
+PARTIAL_SUFFIXES = ('.part', '.crdownload', '.tmp', '.download')
+
+def is_candidate(path):
+    """Check whether a path looks like a finished statement file"""
+    name = os.path.basename(path).lower()
+    if name.startswith('.') or name.startswith('~$'):
+        return False
+    if name.endswith(PARTIAL_SUFFIXES):
+        return False
+    return name.endswith(STATEMENT_EXTENSIONS)
+
+class InotifyWatcher:
+    """Report changed paths under a directory using inotify"""
+
+    def __init__(self, watch_dir):
+        self.inotify = inotify_simple.INotify()
+        self.flags = (inotify_simple.flags.CLOSE_WRITE | inotify_simple.flags.MOVED_TO
+                      | inotify_simple.flags.CREATE | inotify_simple.flags.MODIFY)
+        self.dirs = {}
+        for root, dirnames, _ in os.walk(watch_dir):
+            dirnames[:] = [d for d in dirnames if d not in ('processed', 'failed')]
+            self._add(root)
+
+    def _add(self, path):
+        wd = self.inotify.add_watch(path, self.flags)
+        self.dirs[wd] = path
+
+    def poll(self, timeout):
+        changed = []
+        for event in self.inotify.read(timeout=int(timeout * 1000)):
+            parent = self.dirs.get(event.wd)
+            if parent is None or not event.name:
+                continue
+            path = os.path.join(parent, event.name)
+            if os.path.isdir(path):
+                if event.name not in ('processed', 'failed'):
+                    self._add(path)
+                continue
+            changed.append(path)
+        return changed
+
+class PollingWatcher:
+    """Report changed paths by rescanning the directory"""
+
+    def __init__(self, watch_dir):
+        self.watch_dir = watch_dir
+        self.seen = {}
+
+    def poll(self, timeout):
+        time.sleep(timeout)
+        changed = []
+        current = {}
+        for root, dirnames, filenames in os.walk(self.watch_dir):
+            dirnames[:] = [d for d in dirnames if d not in ('processed', 'failed')]
+            for name in filenames:
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                current[path] = (stat.st_size, stat.st_mtime)
+                if self.seen.get(path) != current[path]:
+                    changed.append(path)
+        self.seen = current
+        return changed
+
+class IngestionDaemon:
+    """Watch a drop folder and append new statements into the account databases"""
+
+    def __init__(self, watch_dir, db_paths=None, workers=2, queue_size=16,
+                 settle_seconds=2.0, poll_seconds=1.0, use_inotify=True, snapshot_seconds=None,
+                 links_path=None, parse_processes=0):
+        self.watch_dir = os.path.abspath(watch_dir)
+        self.db_paths = dict(db_paths or {})
+        self.workers = workers
+        self.settle_seconds = settle_seconds
+        self.poll_seconds = poll_seconds
+        self.use_inotify = use_inotify and inotify_simple is not None
+        self.snapshot_seconds = snapshot_seconds
+        self.links_path = links_path
+        # Parse in this many processes instead of on the worker threads (0)
+        self.parse_processes = parse_processes
+        self.parse_pool = None
+
+        # Bounded: the watcher blocks instead of piling up files in memory
+        self.jobs = queue.Queue(maxsize=queue_size)
+        self.pending = {}    # path -> (size, mtime, first time this size was seen)
+        self.queued = set()
+        self.snapshot_locks = {account: threading.Lock() for account in accounts.ACCOUNTS}
+        self.links_lock = threading.Lock()
+        self.stop_event = threading.Event()
+        self.threads = []
+
+    def db_path(self, account):
+        if account not in self.db_paths:
+            self.db_paths[account] = accounts.default_db_path(account)
+        return self.db_paths[account]
+
+    def warm_up(self):
+        """Import every account script up front so the first file is not slow"""
+        for account in accounts.ACCOUNTS:
+            try:
+                accounts.load_script(account)
+            except Exception as e:
+                print(f"Could not load parser for {account}: {e}")
+
+    def note_change(self, path):
+        if not is_candidate(path) or path in self.queued:
+            return
+        try:
+            stat = os.stat(path)
+        except OSError:
+            self.pending.pop(path, None)
+            return
+        previous = self.pending.get(path)
+        if previous is None or previous[:2] != (stat.st_size, stat.st_mtime):
+            self.pending[path] = (stat.st_size, stat.st_mtime, time.monotonic())
+
+    def settled_files(self):
+        """Files whose size and mtime have not changed for settle_seconds"""
+        now = time.monotonic()
+        ready = []
+        for path, (size, mtime, since) in list(self.pending.items()):
+            try:
+                stat = os.stat(path)
+            except OSError:
+                del self.pending[path]
+                continue
+            if (stat.st_size, stat.st_mtime) != (size, mtime):
+                self.pending[path] = (stat.st_size, stat.st_mtime, now)
+            elif size > 0 and now - since >= self.settle_seconds:
+                ready.append(path)
+                del self.pending[path]
+        return ready
+
+    def process_file(self, path):
+        account = accounts.route_file(path, self.watch_dir)
+        if account is None:
+            print(f"No account matches {path}, leaving it in place")
+            return False
+
+        script = accounts.load_script(account)
+        db_path = self.db_path(account)
+        start = time.perf_counter()
+        # Parse here or in a parser process; the database's writer thread dedups and stores, grouped with other files
+        if self.parse_pool is not None:
+            handle, statement = self.parse_pool.submit(handoff.parse_shared, account, path).result()
+            batch = handoff.attach(handle)
+        else:
+            rows, statement = handoff.extract(account, path)
+            batch = handoff.LocalRows(rows)
+        # Card statements carry the header read during parsing, so the writer never reopens the PDF
+        extra = {} if statement is None else {'statement': statement}
+        try:
+            # Fresh rows per run: the writer may rerun a job whose group met a lock
+            job = lambda conn: script.append_new_transactions(path, db_path=db_path, conn=conn, transactions=batch.frame(), **extra)
+            writer.get_writer(db_path).write(job, rows=len(batch))
+        finally:
+            batch.close()
+        print(f"[{account}] ingested {os.path.basename(path)} in {time.perf_counter() - start:.2f}s")
+        if self.snapshot_seconds:
+            self.snapshot(account)
+        if self.links_path:
+            self.update_links()
+        return True
+
+    def snapshot(self, account):
+        """Snapshot an account once snapshot_seconds have passed since the last one
+
+        Runs outside the writer: the backup reads a pinned WAL snapshot,
+        so the next append does not wait for it.
+        """
+        lock = self.snapshot_locks[account]
+        if not lock.acquire(blocking=False):
+            return  # another worker is already copying this account
+        try:
+            path = backup.snapshot_if_due(self.db_path(account), self.snapshot_seconds)
+            if path:
+                print(f"[{account}] snapshot {os.path.basename(path)}")
+        except Exception as e:
+            print(f"[{account}] snapshot failed: {e}")
+        finally:
+            lock.release()
+
+    def update_links(self):
+        """Link the rows just appended to the other accounts
+
+        Only one worker matches at a time; a worker that finds it busy skips,
+        since the running pass or the next one picks its rows up from the change logs.
+        """
+        if not self.links_lock.acquire(blocking=False):
+            return
+        try:
+            added = matching.update_links({account: self.db_path(account) for account in accounts.ACCOUNTS}, self.links_path)
+            if any(added.values()):
+                print(f"Linked {sum(added.values())} transaction(s) across accounts")
+        except Exception as e:
+            print(f"Linking failed: {e}")
+        finally:
+            self.links_lock.release()
+
+    def move_to(self, path, folder):
+        target_dir = os.path.join(self.watch_dir, folder)
+        os.makedirs(target_dir, exist_ok=True)
+        target = os.path.join(target_dir, os.path.basename(path))
+        if os.path.exists(target):
+            base, ext = os.path.splitext(target)
+            target = f"{base}_{int(time.time())}{ext}"
+        shutil.move(path, target)
+
+    def worker(self):
+        while True:
+            path = self.jobs.get()
+            if path is None:
+                self.jobs.task_done()
+                return
+            try:
+                if self.process_file(path):
+                    self.move_to(path, 'processed')
+            except Exception as e:
+                print(f"Error ingesting {path}: {e}")
+                try:
+                    self.move_to(path, 'failed')
+                except OSError as move_error:
+                    print(f"Error moving {path} to failed/: {move_error}")
+            finally:
+                self.queued.discard(path)
+                self.jobs.task_done()
+
+    def start(self):
+        self.warm_up()
+        if self.parse_processes:
+            # spawn: forking a process that already runs threads is not safe
+            self.parse_pool = ProcessPoolExecutor(self.parse_processes, mp_context=multiprocessing.get_context('spawn'),
+                                                  initializer=handoff.load_parsers)
+        for _ in range(self.workers):
+            thread = threading.Thread(target=self.worker, daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+    def run(self):
+        """Watch until stop() is called or the process is interrupted"""
+        os.makedirs(self.watch_dir, exist_ok=True)
+        watcher = InotifyWatcher(self.watch_dir) if self.use_inotify else PollingWatcher(self.watch_dir)
+        print(f"Watching {self.watch_dir} ({'inotify' if self.use_inotify else 'polling'}, "
+              f"{self.workers} workers{f', {self.parse_processes} parser processes' if self.parse_processes else ''})")
+        self.start()
+
+        # Files already sitting in the folder when the daemon starts
+        for root, dirnames, filenames in os.walk(self.watch_dir):
+            dirnames[:] = [d for d in dirnames if d not in ('processed', 'failed')]
+            for name in filenames:
+                self.note_change(os.path.join(root, name))
+
+        try:
+            while not self.stop_event.is_set():
+                for path in watcher.poll(self.poll_seconds):
+                    self.note_change(path)
+                for path in self.settled_files():
+                    self.queued.add(path)
+                    self.jobs.put(path)
+        except KeyboardInterrupt:
+            print("Stopping...")
+        finally:
+            self.shutdown()
+
+    def stop(self):
+        self.stop_event.set()
+
+    def shutdown(self):
+        for _ in self.threads:
+            self.jobs.put(None)
+        for thread in self.threads:
+            thread.join()
+        self.threads = []
+        if self.parse_pool is not None:
+            self.parse_pool.shutdown()
+            self.parse_pool = None
+        writer.close_all()
+        storage.close_all()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Watch a folder and append new statements as they land")
+    parser.add_argument('watch_dir')
+    parser.add_argument('--db', action='append', metavar='ACCOUNT=PATH',
+                        help="Override the database path of an account")
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--parse-processes', type=int, default=0,
+                        help="Parse statements in this many processes, handing rows back through shared memory")
+    parser.add_argument('--queue-size', type=int, default=16)
+    parser.add_argument('--settle', type=float, default=2.0,
+                        help="Seconds a file must stay unchanged before it is ingested")
+    parser.add_argument('--poll', type=float, default=1.0)
+    parser.add_argument('--no-inotify', action='store_true', help="Always use the polling watcher")
+    parser.add_argument('--snapshot-hours', type=float,
+                        help="Snapshot an account after ingesting if its newest snapshot is older than this")
+    parser.add_argument('--links-db', help="Link new rows across accounts after each file, keeping the links here")
+    args = parser.parse_args(argv)
+
+    daemon = IngestionDaemon(
+        args.watch_dir,
+        db_paths=accounts.parse_db_overrides(args.db),
+        workers=args.workers,
+        queue_size=args.queue_size,
+        settle_seconds=args.settle,
+        poll_seconds=args.poll,
+        use_inotify=not args.no_inotify,
+        snapshot_seconds=args.snapshot_hours * 3600 if args.snapshot_hours else None,
+        links_path=args.links_db,
+        parse_processes=args.parse_processes,
+    )
+    daemon.run()
+
+if __name__ == "__main__":
+    sys.exit(main())
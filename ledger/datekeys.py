@@ -0,0 +1,31 @@
+"""Statement date formats and ISO date keys, with the standard library only.
+
+ledger.dates parses whole columns with pandas; this is the part the
+read-only paths (ledger.aggregates, python -m ledger verify/query) need
+for databases written before DateKey existed, without importing pandas.
+"""
+from datetime import datetime
+from functools import lru_cache
+
+# Formats seen across the statements; order matters for the fallback only
+DATE_FORMATS = [
+    '%d-%b-%y', '%d-%b-%Y', '%d %b %y', '%d %b %Y', '%Y-%m-%d',
+    '%d/%m/%Y', '%d-%m-%Y', '%d/%m/%y', '%b %d, %Y', '%Y-%m-%d %H:%M:%S',
+]
+CACHE_SIZE = 65536
+
+def parse_text(text):
+    """datetime for a date string in one of DATE_FORMATS, or None"""
+    text = text.strip()
+    for fmt in DATE_FORMATS:
+        try:
+            return datetime.strptime(text, fmt)
+        except ValueError:
+            continue
+    return None
+
+@lru_cache(maxsize=CACHE_SIZE)
+def date_key(value):
+    """ISO 'YYYY-MM-DD' for a stored date value; None where unparseable"""
+    parsed = parse_text(value) if isinstance(value, str) else None
+    return parsed.strftime('%Y-%m-%d') if parsed else None
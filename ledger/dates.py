@@ -0,0 +1,87 @@
+"""Date normalization shared by the account scripts.
+
+A statement holds a few hundred distinct dates repeated many times, so
+columns are factorized and only the unique values are parsed. The format
+is inferred once per column from a sample; values that do not match it
+fall back to trying every known format, with results kept in a bounded
+LRU cache across calls.
+"""
+from datetime import datetime
+from functools import lru_cache
+
+import numpy as np
+import pandas as pd
+
+from ledger.datekeys import CACHE_SIZE, DATE_FORMATS, parse_text
+
+SAMPLE_SIZE = 64
+
+def infer_format(values, sample_size=SAMPLE_SIZE):
+    """First known format that parses every string in a sample of values, or None"""
+    sample = [v.strip() for v in values[:sample_size] if isinstance(v, str) and v.strip()]
+    if not sample:
+        return None
+    for fmt in DATE_FORMATS:
+        try:
+            for value in sample:
+                datetime.strptime(value, fmt)
+            return fmt
+        except ValueError:
+            continue
+    return None
+
+@lru_cache(maxsize=CACHE_SIZE)
+def parse_date(text):
+    """Parse one date string by trying every known format; NaT if none match"""
+    parsed = parse_text(text)
+    if parsed is not None:
+        return np.datetime64(parsed, 'ns')
+    parsed = pd.to_datetime(text.strip(), dayfirst=True, errors='coerce')
+    return np.datetime64('NaT', 'ns') if pd.isna(parsed) else parsed.to_datetime64()
+
+def _parse_uniques(uniques):
+    """datetime64[ns] array for an object array of distinct values"""
+    result = np.full(len(uniques), np.datetime64('NaT'), dtype='datetime64[ns]')
+    is_text = np.array([isinstance(v, str) for v in uniques], dtype=bool)
+
+    # Timestamps, datetimes and Excel dates need no format
+    if (~is_text).any():
+        others = pd.to_datetime(pd.Series(uniques[~is_text], dtype=object), errors='coerce')
+        result[~is_text] = others.to_numpy(dtype='datetime64[ns]')
+
+    if is_text.any():
+        texts = uniques[is_text]
+        fmt = infer_format(texts)
+        if fmt is not None:
+            parsed = pd.to_datetime(pd.Series(texts, dtype=object).str.strip(), format=fmt, errors='coerce')
+            parsed = parsed.to_numpy(dtype='datetime64[ns]')
+        else:
+            parsed = np.full(len(texts), np.datetime64('NaT'), dtype='datetime64[ns]')
+        # Mixed columns (e.g. after merging two schemas): the rest go value by value
+        for i in np.flatnonzero(np.isnat(parsed)):
+            parsed[i] = parse_date(texts[i])
+        result[is_text] = parsed
+    return result
+
+def to_datetime64(values):
+    """Parse a column of dates into a datetime64[ns] array; unparseable values become NaT"""
+    codes, uniques = pd.factorize(pd.Series(values, dtype=object), use_na_sentinel=True)
+    parsed = _parse_uniques(np.asarray(uniques, dtype=object))
+    result = np.full(len(codes), np.datetime64('NaT'), dtype='datetime64[ns]')
+    known = codes >= 0
+    result[known] = parsed[codes[known]]
+    return result
+
+def format_dates(values, fmt='%d-%b-%y'):
+    """Normalize a column to date strings in fmt; unparseable values are kept as they were"""
+    series = pd.Series(values, dtype=object)
+    codes, uniques = pd.factorize(series, use_na_sentinel=True)
+    uniques = np.asarray(uniques, dtype=object)
+    parsed = _parse_uniques(uniques)
+    formatted = pd.Series(parsed).dt.strftime(fmt).to_numpy(dtype=object)
+    formatted = np.where(np.isnat(parsed), uniques, formatted)
+    result = np.empty(len(codes), dtype=object)
+    known = codes >= 0
+    result[known] = formatted[codes[known]]
+    result[~known] = series.to_numpy(dtype=object)[~known]
+    return pd.Series(result, index=series.index)
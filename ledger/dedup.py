@@ -0,0 +1,212 @@
+"""Near-duplicate detection between stored rows and a newly parsed statement.
+
+Overlapping statements print the same payment with different whitespace,
+truncated narrations or 'Dr' instead of '-', so exact matching on
+Date / TransactionDetails / Amount lets duplicates in. Exact matching with
+keep='first' also drops genuine repeats, such as two identical FASTag
+charges on one day.
+
+Rows are blocked on (day, paise, debit/credit) with a hash join, and only
+rows inside a block have their normalized narrations compared, so the work
+stays linear in the number of rows. Matching is one-to-one: each stored row
+absorbs at most one incoming row, so k stored repeats absorb k incoming
+repeats and any extra ones are new. Incoming rows are never matched against
+each other; each has its own SrNo on the statement.
+
+Rows that carry the statement's own transaction id (SourceTxnId) are
+settled first by a set lookup on the id. Only the rest go through the
+content comparison, and there two rows with different ids never match.
+find_stored_duplicates() does both against the database: ids are looked
+up through idx_source_txn, and only the stored rows in the incoming rows'
+(DateKey, AmountPaise) blocks are read, through idx_dedup, for the content
+comparison. An append therefore reads a handful of rows per statement
+line, not the whole table.
+"""
+from difflib import SequenceMatcher
+
+import numpy as np
+import pandas as pd
+
+from ledger import aggregates
+from ledger import amounts
+from ledger import dates
+from ledger import instrument
+from ledger import ordering
+from ledger import storage
+
+DETAILS_COLUMNS = ('TransactionDetails', 'Transaction_Details')
+# Narrations at least this similar (0-1) are the same payment
+SIMILARITY = 0.9
+# A narration cut short by the statement layout still matches its full form
+MIN_PREFIX = 8
+# Statement columns holding a transaction id, most specific first
+ID_COLUMN_NAMES = ('transid', 'tran id', 'transaction id', 'upi ref', 'ref no', 'utr', 'order id', 'cheq')
+MISSING_IDS = ('', '-', 'nan', 'none', 'na')
+# Values per IN (...) query, and blocks per candidate query
+QUERY_CHUNK = 500
+BLOCK_CHUNK = 250
+BLOCK_WHERE = f'{ordering.DATE_KEY_COLUMN} = ? AND {storage.AMOUNT_PAISE_COLUMN} = ?'
+
+def clean_source_ids(values):
+    """Statement ids as stripped strings; blanks and placeholders become None"""
+    values = pd.Series(values, dtype=object)
+    # Excel turns numeric ids into floats: 123456.0 -> '123456'
+    text = values.map(lambda v: str(int(v)) if isinstance(v, float) and v.is_integer() else v)
+    text = text.astype(str).str.replace(r'\s+', '', regex=True)
+    missing = values.isna() | text.str.lower().isin(MISSING_IDS)
+    return text.where(~missing, None)
+
+def find_id_columns(columns):
+    """Columns that look like transaction ids, in ID_COLUMN_NAMES order"""
+    found = []
+    for name in ID_COLUMN_NAMES:
+        for col in columns:
+            if name in str(col).lower() and col not in found:
+                found.append(col)
+    return found
+
+def source_ids(df, columns=None):
+    """Per-row id from the first id column that has one, or None"""
+    result = pd.Series([None] * len(df), index=df.index, dtype=object)
+    for col in find_id_columns(df.columns) if columns is None else columns:
+        result = result.where(result.notna(), clean_source_ids(df[col]).to_numpy())
+    return result
+
+def normalize_narration(values):
+    """Lowercase letters and digits only, so spacing and punctuation do not matter"""
+    return pd.Series(values, dtype=object).fillna('').astype(str).str.lower().str.replace(r'[^a-z0-9]', '', regex=True)
+
+def narration_score(a, b):
+    """1.0 for equal narrations, 0.99 when one is a truncation of the other, else the similarity ratio"""
+    if a == b:
+        return 1.0
+    shorter, longer = (a, b) if len(a) <= len(b) else (b, a)
+    if len(shorter) >= MIN_PREFIX and longer.startswith(shorter):
+        return 0.99
+    return SequenceMatcher(None, a, b, autojunk=False).ratio()
+
+def blocking_keys(df, id_column=None):
+    """Per-row block key (day, paise, is_debit), normalized narration and source id"""
+    columns = list(df.columns)
+    day = dates.to_datetime64(df[aggregates.find_column(columns, aggregates.DATE_COLUMNS)])
+    paise = df['AmountPaise'] if 'AmountPaise' in columns else amounts.to_paise(df['Amount'])
+    sign_col = next((c for c in aggregates.SIGN_COLUMNS if c in columns), None)
+    is_debit = df[sign_col].isin(aggregates.DEBIT_SIGNS) if sign_col else np.zeros(len(df), dtype=bool)
+    details_col = next((c for c in DETAILS_COLUMNS if c in columns), None)
+    keys = pd.DataFrame({
+        'row': np.arange(len(df)),
+        'day': day.astype('datetime64[D]').astype('int64'),
+        'paise': pd.Series(paise).fillna(0).to_numpy(dtype='int64'),
+        'is_debit': np.asarray(is_debit, dtype=bool),
+        'narration': normalize_narration(df[details_col]).to_numpy() if details_col else '',
+    })
+    if id_column and id_column in columns:
+        keys['source_id'] = clean_source_ids(df[id_column]).to_numpy()
+    else:
+        keys['source_id'] = None
+    return keys
+
+def find_duplicates(existing, incoming, id_column=storage.SOURCE_ID_COLUMN, similarity=SIMILARITY):
+    """Boolean array over incoming rows: True where the row is already stored"""
+    is_duplicate = np.zeros(len(incoming), dtype=bool)
+    if existing.empty or incoming.empty:
+        return is_duplicate
+
+    with instrument.stage('dedup'):
+        new_keys = blocking_keys(incoming, id_column)
+        old_keys = blocking_keys(existing, id_column)
+
+        # Rows whose id is already stored: one hash lookup each
+        stored_ids = old_keys['source_id'].dropna()
+        is_duplicate[(new_keys['source_id'].notna() & new_keys['source_id'].isin(stored_ids)).to_numpy()] = True
+        used_old = set(old_keys['row'][old_keys['source_id'].isin(new_keys['source_id'].dropna())])
+        instrument.count('dedup_by_id', int(is_duplicate.sum()))
+
+        # Everything else is compared on content
+        pairs = new_keys[~is_duplicate].merge(
+            old_keys[~old_keys['row'].isin(used_old)], on=['day', 'paise', 'is_debit'], suffixes=('_new', '_old'))
+
+        # Different source ids are different payments, whatever the narration says
+        pairs = pairs[pairs['source_id_new'].isna() | pairs['source_id_old'].isna()]
+
+        # Equal narrations are the common case; only the rest are scored one by one
+        new_narrations = pairs['narration_new'].to_numpy()
+        old_narrations = pairs['narration_old'].to_numpy()
+        scores = np.ones(len(pairs))
+        unequal = np.flatnonzero(new_narrations != old_narrations)
+        scores[unequal] = [narration_score(new_narrations[i], old_narrations[i]) for i in unequal]
+        keep = scores >= similarity
+        pairs = pairs[keep].assign(score=scores[keep]).sort_values(
+            ['score', 'row_new', 'row_old'], ascending=[False, True, True])
+
+        # Best pairs first; every row on either side is used at most once
+        for new_row, old_row in zip(pairs['row_new'], pairs['row_old']):
+            if is_duplicate[new_row] or old_row in used_old:
+                continue
+            is_duplicate[new_row] = True
+            used_old.add(old_row)
+
+    instrument.reject('duplicate', n=int(is_duplicate.sum()))
+    return is_duplicate
+
+def ensure_dedup_index(conn, table='transactions'):
+    """Index the (DateKey, AmountPaise) blocks; call after the ordering and paise columns exist"""
+    conn.execute(f'CREATE INDEX IF NOT EXISTS idx_dedup ON "{table}"({ordering.DATE_KEY_COLUMN}, {storage.AMOUNT_PAISE_COLUMN})')
+
+def stored_candidates(conn, incoming, table='transactions'):
+    """Stored rows in the same (DateKey, AmountPaise) block as some incoming row, by idx_dedup lookups"""
+    columns = storage.table_columns(conn, table)
+    if ordering.DATE_KEY_COLUMN not in columns or storage.AMOUNT_PAISE_COLUMN not in columns:
+        return pd.read_sql_query(f'SELECT * FROM "{table}"', conn)  # not migrated yet
+    keys = pd.DataFrame({
+        'date_key': ordering.date_keys(incoming[aggregates.find_column(list(incoming.columns), aggregates.DATE_COLUMNS)]),
+        'paise': (incoming['AmountPaise'] if 'AmountPaise' in incoming.columns else amounts.to_paise(incoming['Amount'])).to_numpy(),
+    }).dropna().drop_duplicates()
+    blocks = [(key, int(paise)) for key, paise in keys.itertuples(index=False, name=None)]
+
+    parts = []
+    for start in range(0, len(blocks), BLOCK_CHUNK):
+        chunk = blocks[start:start + BLOCK_CHUNK]
+        parts.append(pd.read_sql_query(
+            f'SELECT * FROM "{table}" WHERE ' + ' OR '.join(f'({BLOCK_WHERE})' for _ in chunk),
+            conn, params=[value for block in chunk for value in block]))
+    instrument.count('dedup_candidates', sum(map(len, parts)))
+    return pd.concat(parts, ignore_index=True) if parts else pd.DataFrame(columns=columns)
+
+def stored_ids(conn, ids, table='transactions'):
+    """The ones of ids already stored as SourceTxnId, by idx_source_txn lookups"""
+    ids = list(dict.fromkeys(ids))
+    found = set()
+    for start in range(0, len(ids), QUERY_CHUNK):
+        chunk = ids[start:start + QUERY_CHUNK]
+        found.update(value for (value,) in conn.execute(
+            f'SELECT {storage.SOURCE_ID_COLUMN} FROM "{table}" WHERE {storage.SOURCE_ID_COLUMN} IN ({", ".join("?" * len(chunk))})',
+            chunk))
+    return found
+
+def find_stored_duplicates(conn, incoming, id_column=storage.SOURCE_ID_COLUMN, table='transactions'):
+    """find_duplicates() against the rows stored in a database table, without reading the ones not needed"""
+    is_duplicate = np.zeros(len(incoming), dtype=bool)
+    if incoming.empty:
+        return is_duplicate
+    columns = storage.table_columns(conn, table)
+
+    matched = set()
+    if id_column in incoming.columns and storage.SOURCE_ID_COLUMN in columns:
+        ids = clean_source_ids(incoming[id_column])
+        with instrument.stage('dedup'):
+            matched = stored_ids(conn, ids.dropna(), table)
+        is_duplicate[ids.isin(matched).to_numpy()] = True
+        instrument.count('dedup_by_id', int(is_duplicate.sum()))
+        instrument.reject('duplicate', n=int(is_duplicate.sum()))
+
+    rest = incoming[~is_duplicate]
+    if rest.empty:
+        return is_duplicate
+    with instrument.stage('dedup'):
+        existing = stored_candidates(conn, rest, table)
+    if matched:
+        # A stored row already claimed by its id is not matched again on content
+        existing = existing[~existing[storage.SOURCE_ID_COLUMN].isin(matched)]
+    is_duplicate[np.flatnonzero(~is_duplicate)[find_duplicates(existing, rest, id_column)]] = True
+    return is_duplicate
@@ -0,0 +1,276 @@
+"""Parsed rows handed from parser processes to the writer through shared memory.
+
+A parser process would otherwise pickle its rows (lists of dicts, or
+DataFrames) and the parent would unpickle every value again. share()
+instead lays the rows out column by column in one shared memory block:
+numeric columns as raw NumPy buffers, text columns as int32 codes into a
+dictionary of their distinct values (UTF-8 bytes and offsets), anything
+else pickled on its own. Only a small description of the block crosses
+the process boundary. SharedRows.frame() reads the block in place as a
+DataFrame, whichever form the parser returned: numeric columns are
+read-only views of it, so they are never copied (copy-on-write copies a
+column only if a script writes into it), and each distinct string is
+decoded once. The append scripts turn rows into a DataFrame first thing,
+so that is what the daemon hands them. rows() gives back the parser's own
+form; rebuilding a list of dicts costs about what unpickling it does.
+
+The parent owns the block once it has the description: SharedRows.close()
+unlinks it. python -m ledger.bench --handoff times this against pickling.
+"""
+import copy
+import pickle
+import operator
+import threading
+from multiprocessing import shared_memory
+
+import numpy as np
+import pandas as pd
+
+from ledger import accounts
+
+ALIGN = 8
+CODES_DTYPE = np.int32
+
+_lingering = []
+_lingering_lock = threading.Lock()
+
+def _aligned(size):
+    return (size + ALIGN - 1) // ALIGN * ALIGN
+
+def _text_column(values, allow_missing=False):
+    """(codes, distinct strings) of a column holding only str, or None"""
+    codes, uniques = pd.factorize(values)
+    if not allow_missing and len(codes) and codes.min() < 0:
+        return None
+    uniques = list(uniques)
+    if not all(isinstance(value, str) for value in uniques):
+        return None
+    return codes.astype(CODES_DTYPE), uniques
+
+def _record_column(values):
+    """How one column of a list of dicts is stored: ('array', array), ('text', codes, uniques) or ('pickle', bytes)"""
+    kinds = set(map(type, values))
+    if kinds <= {float} and kinds:
+        return ('array', np.array(values, dtype=np.float64))
+    if kinds <= {int} and kinds:
+        try:
+            return ('array', np.array(values, dtype=np.int64))
+        except OverflowError:
+            pass
+    if kinds <= {str} and kinds:
+        text = _text_column(np.array(values, dtype=object))
+        if text is not None:
+            return ('text',) + text
+    return ('pickle', pickle.dumps(values, protocol=pickle.HIGHEST_PROTOCOL))
+
+def _frame_column(series):
+    """How one DataFrame column is stored, as in _record_column()"""
+    if isinstance(series.dtype, np.dtype) and series.dtype.kind in 'biufmM':
+        return ('array', np.ascontiguousarray(series.to_numpy()))
+    if isinstance(series.dtype, pd.StringDtype) or series.dtype == object:
+        text = _text_column(series, allow_missing=isinstance(series.dtype, pd.StringDtype))
+        if text is not None:
+            return ('text',) + text
+    return ('pickle', pickle.dumps(series, protocol=pickle.HIGHEST_PROTOCOL))
+
+def _columns(rows):
+    """'records' or 'frame', the row count, and [(name, stored column)] of parsed rows"""
+    if isinstance(rows, pd.DataFrame):
+        return 'frame', len(rows), [(name, _frame_column(rows.iloc[:, i])) for i, name in enumerate(rows.columns)]
+    if not rows:
+        return 'records', 0, []
+    names = list(rows[0])
+    keys = rows[0].keys()
+    if not all(map(keys.__eq__, map(dict.keys, rows))):
+        # Rows with different keys are not a table; keep them as they are
+        return 'records', len(rows), [(None, ('pickle', pickle.dumps(rows, protocol=pickle.HIGHEST_PROTOCOL)))]
+    return 'records', len(rows), [(name, _record_column(list(map(operator.itemgetter(name), rows)))) for name in names]
+
+def share(rows):
+    """Copy parsed rows into a new shared memory block and describe it
+
+    The description is small and picklable; the receiving process passes
+    it to SharedRows and unlinks the block when done. None stays None.
+    """
+    if rows is None:
+        return None
+    kind, length, columns = _columns(rows)
+    index = None
+    if kind == 'frame' and not rows.index.equals(pd.RangeIndex(length)):
+        index = pickle.dumps(rows.index, protocol=pickle.HIGHEST_PROTOCOL)
+
+    # Lay every buffer out first, then write them into one block
+    buffers, specs, size = [], [], 0
+    def place(data):
+        nonlocal size
+        offset = size
+        buffers.append((offset, data))
+        size = _aligned(offset + data.nbytes if isinstance(data, np.ndarray) else offset + len(data))
+        return offset
+
+    for i, (name, stored) in enumerate(columns):
+        spec = {'name': name, 'kind': stored[0]}
+        if stored[0] == 'array':
+            spec.update(dtype=stored[1].dtype.str, offset=place(stored[1]))
+        elif stored[0] == 'text':
+            codes, uniques = stored[1], stored[2]
+            encoded = [value.encode('utf-8') for value in uniques]
+            ends = np.cumsum([len(value) for value in encoded], dtype=np.int64)
+            spec.update(codes=place(codes), ends=place(ends), count=len(uniques), text=place(b''.join(encoded)),
+                        text_size=int(ends[-1]) if len(ends) else 0)
+            if kind == 'frame':
+                spec['dtype'] = str(rows.dtypes.iloc[i])
+        else:
+            spec.update(offset=place(stored[1]), size=len(stored[1]))
+        specs.append(spec)
+    index_spec = None if index is None else {'offset': place(index), 'size': len(index)}
+
+    shm = shared_memory.SharedMemory(create=True, size=max(size, 1))
+    try:
+        for offset, data in buffers:
+            if isinstance(data, np.ndarray):
+                np.ndarray(data.shape, dtype=data.dtype, buffer=shm.buf, offset=offset)[:] = data
+            else:
+                shm.buf[offset:offset + len(data)] = data
+        handle = {'name': shm.name, 'size': shm.size, 'format': kind, 'length': length, 'columns': specs, 'index': index_spec}
+    except BaseException:
+        shm.close()
+        shm.unlink()
+        raise
+    shm.close()
+    return handle
+
+class SharedRows:
+    """Rows in a block written by share(), read in place"""
+
+    def __init__(self, handle):
+        self.handle = handle
+        self.shm = shared_memory.SharedMemory(name=handle['name'])
+        self.base = None
+
+    def __len__(self):
+        return self.handle['length']
+
+    def _array(self, dtype, offset, count):
+        array = np.ndarray(count, dtype=dtype, buffer=self.shm.buf, offset=offset)
+        array.flags.writeable = False
+        return array
+
+    def _bytes(self, offset, size):
+        return bytes(self.shm.buf[offset:offset + size])
+
+    def _uniques(self, spec):
+        ends = self._array(np.int64, spec['ends'], spec['count']).tolist()
+        text = self._bytes(spec['text'], spec['text_size'])
+        starts = [0] + ends[:-1]
+        return [text[start:end].decode('utf-8') for start, end in zip(starts, ends)]
+
+    def _text(self, spec):
+        """Strings of a text column, one object per distinct value"""
+        uniques = np.array(self._uniques(spec) + [None], dtype=object)
+        # Missing values (-1) pick the trailing None
+        return uniques.take(self._array(CODES_DTYPE, spec['codes'], len(self)))
+
+    def _column(self, spec):
+        if spec['kind'] == 'array':
+            return self._array(np.dtype(spec['dtype']), spec['offset'], len(self))
+        if spec['kind'] == 'text':
+            return self._text(spec)
+        return pickle.loads(self._bytes(spec['offset'], spec['size']))
+
+    def _frame(self):
+        specs = self.handle['columns']
+        if len(specs) == 1 and specs[0]['name'] is None:
+            return pd.DataFrame(self._column(specs[0]))
+        data = {}
+        for spec in specs:
+            values = self._column(spec)
+            if 'dtype' in spec and spec['kind'] == 'text':
+                values = pd.array(values, dtype=spec['dtype'])
+            data[spec['name']] = values
+        index = self.handle['index']
+        index = None if index is None else pickle.loads(self._bytes(index['offset'], index['size']))
+        return pd.DataFrame(data, index=index, copy=False)
+
+    def _records(self):
+        specs = self.handle['columns']
+        if len(specs) == 1 and specs[0]['name'] is None:
+            return self._column(specs[0])
+        names = [spec['name'] for spec in specs]
+        columns = [self._column(spec) for spec in specs]
+        columns = [values.tolist() if isinstance(values, np.ndarray) else values for values in columns]
+        return [dict(zip(names, values)) for values in zip(*columns)]
+
+    def frame(self):
+        """The rows as a DataFrame, whatever the parser returned, as a new object on every call"""
+        if self.base is None:
+            self.base = self._frame()
+        # Shares the columns; the kept base makes any in-place write copy first
+        return self.base.copy(deep=False)
+
+    def rows(self):
+        """The rows as the parser returned them, as a new object on every call"""
+        if self.handle['format'] == 'records':
+            return self._records()
+        return self.frame()
+
+    def close(self):
+        """Unlink the block; its memory goes once no frame from frame() still uses it"""
+        self.base = None
+        self.shm.unlink()
+        with _lingering_lock:
+            _lingering.append(self.shm)
+            _lingering[:] = [shm for shm in _lingering if not _release(shm)]
+
+def _release(shm):
+    try:
+        shm.close()
+        return True
+    except BufferError:
+        return False  # views still exported; tried again on the next close()
+
+class LocalRows:
+    """Rows parsed in this process, with the SharedRows interface"""
+
+    def __init__(self, rows):
+        self.data = rows
+
+    def __len__(self):
+        return 0 if self.data is None else len(self.data)
+
+    def frame(self):
+        if self.data is None or isinstance(self.data, pd.DataFrame):
+            return copy.deepcopy(self.data)
+        return pd.DataFrame(self.data)
+
+    def rows(self):
+        return copy.deepcopy(self.data)
+
+    def close(self):
+        self.data = None
+
+def attach(handle):
+    """SharedRows for a description from share(); share(None) gives rows None"""
+    return LocalRows(None) if handle is None else SharedRows(handle)
+
+def load_parsers():
+    """Parser process initializer: import every account script once"""
+    for account in accounts.ACCOUNTS:
+        try:
+            accounts.load_script(account)
+        except Exception as e:
+            print(f"Could not load parser for {account}: {e}")
+
+def extract(account, path):
+    """(rows, header) of a statement parsed with its account's script; header is None for non-card accounts"""
+    config = accounts.ACCOUNTS[account]
+    parse = getattr(accounts.load_script(account), config['script_extract'])
+    if not config['statement']:
+        return parse(path), None
+    statement = {}
+    return parse(path, statement), statement
+
+def parse_shared(account, path):
+    """Parser process side: extract a statement and share() the rows; the small header dict is pickled"""
+    rows, statement = extract(account, path)
+    return share(rows), statement
@@ -0,0 +1,172 @@
+"""Stage timers, counters and reject reasons for the ingestion scripts.
+
+The scripts call echo() for per-row progress output, stage() around the
+expensive steps and reject() when a line or row is dropped. Set
+LEDGER_QUIET=1 to drop per-row output entirely, LEDGER_STATS=1 to print
+the report at the end of a run, LEDGER_PROFILE=<file> to write cProfile
+stats and LEDGER_TRACEMALLOC=1 to measure peak Python memory.
+"""
+import os
+import sys
+import time
+import threading
+import contextlib
+from collections import Counter, defaultdict
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+class Collector:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.started = time.perf_counter()
+            self.stage_seconds = defaultdict(float)
+            self.stage_calls = Counter()
+            self.page_seconds = defaultdict(list)
+            self.counters = Counter()
+            self.rejects = Counter()
+
+_collector = Collector()
+_quiet = os.environ.get('LEDGER_QUIET', '') not in ('', '0')
+
+def configure(quiet=None):
+    global _quiet
+    if quiet is not None:
+        _quiet = quiet
+
+def is_quiet():
+    return _quiet
+
+def echo(*args, **kwargs):
+    """print() for per-row and progress output; does nothing in quiet mode"""
+    if not _quiet:
+        print(*args, **kwargs)
+
+@contextlib.contextmanager
+def stage(name, page=None):
+    """Time a pipeline stage; pass page= to also keep per-page timings"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        with _collector.lock:
+            _collector.stage_seconds[name] += elapsed
+            _collector.stage_calls[name] += 1
+            if page is not None:
+                _collector.page_seconds[name].append(elapsed)
+
+def count(name, n=1):
+    with _collector.lock:
+        _collector.counters[name] += n
+
+def reject(reason, detail=None, n=1):
+    """Count dropped lines/rows by reason; the detail is only printed outside quiet mode"""
+    if not n:
+        return
+    with _collector.lock:
+        _collector.rejects[reason] += n
+    if detail is not None and not _quiet:
+        print(f"Rejected ({reason}): {detail}")
+
+def reset():
+    _collector.reset()
+
+def peak_memory_bytes():
+    """Peak traced Python memory if tracemalloc is on, else the process peak RSS"""
+    import tracemalloc
+    if tracemalloc.is_tracing():
+        return tracemalloc.get_traced_memory()[1]
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+def report():
+    with _collector.lock:
+        elapsed = time.perf_counter() - _collector.started
+        rows = _collector.counters.get('rows', 0)
+        stages = {}
+        for name, seconds in _collector.stage_seconds.items():
+            stages[name] = {'seconds': round(seconds, 6), 'calls': _collector.stage_calls[name]}
+            pages = _collector.page_seconds.get(name)
+            if pages:
+                stages[name]['slowest_page'] = round(max(pages), 6)
+                stages[name]['mean_page'] = round(sum(pages) / len(pages), 6)
+        return {
+            'elapsed': round(elapsed, 6),
+            'stages': stages,
+            'counters': dict(_collector.counters),
+            'rejects': dict(_collector.rejects),
+            'rows_per_sec': round(rows / elapsed, 1) if elapsed and rows else None,
+            'peak_memory_bytes': peak_memory_bytes(),
+        }
+
+def print_report(out=None):
+    out = out or sys.stderr
+    result = report()
+    print(f"\nRun statistics ({result['elapsed']:.2f}s):", file=out)
+    for name, info in sorted(result['stages'].items(), key=lambda item: -item[1]['seconds']):
+        line = f"  {name:<14} {info['seconds']:9.3f}s  x{info['calls']}"
+        if 'mean_page' in info:
+            line += f"  (mean page {info['mean_page'] * 1000:.1f} ms, slowest {info['slowest_page'] * 1000:.1f} ms)"
+        print(line, file=out)
+    for name, value in sorted(result['counters'].items()):
+        print(f"  {name:<14} {value}", file=out)
+    if result['rejects']:
+        print("  rejected: " + ', '.join(f"{reason}={n}" for reason, n in sorted(result['rejects'].items())), file=out)
+    if result['rows_per_sec']:
+        print(f"  rows/sec       {result['rows_per_sec']}", file=out)
+    if result['peak_memory_bytes']:
+        print(f"  peak memory    {result['peak_memory_bytes'] / (1024 * 1024):.1f} MB", file=out)
+
+@contextlib.contextmanager
+def profile(output_path=None, trace_memory=False):
+    """Run the block under cProfile (and optionally tracemalloc)"""
+    import cProfile
+    import pstats
+    import tracemalloc
+
+    if trace_memory:
+        tracemalloc.start()
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield profiler
+    finally:
+        profiler.disable()
+        if output_path:
+            profiler.dump_stats(output_path)
+            print(f"Profile written to {output_path}", file=sys.stderr)
+        else:
+            pstats.Stats(profiler, stream=sys.stderr).sort_stats('cumulative').print_stats(25)
+        if trace_memory:
+            current, peak = tracemalloc.get_traced_memory()
+            print(f"tracemalloc peak: {peak / (1024 * 1024):.1f} MB", file=sys.stderr)
+            tracemalloc.stop()
+
+@contextlib.contextmanager
+def session():
+    """Wrap a script run: applies the LEDGER_* environment options and prints the report"""
+    profile_path = os.environ.get('LEDGER_PROFILE')
+    trace_memory = os.environ.get('LEDGER_TRACEMALLOC', '') not in ('', '0')
+    show_stats = os.environ.get('LEDGER_STATS', '') not in ('', '0')
+    reset()
+    with contextlib.ExitStack() as stack:
+        if profile_path:
+            stack.enter_context(profile(profile_path, trace_memory))
+        elif trace_memory:
+            import tracemalloc
+            tracemalloc.start()
+            stack.callback(tracemalloc.stop)
+        try:
+            yield
+        finally:
+            if show_stats:
+                print_report()
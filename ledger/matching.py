@@ -0,0 +1,340 @@
+"""Links between rows of different accounts that are the same money.
+
+An ICICI debit that pays a card bill shows up again as a PAYMENT credit
+on the DBS or SBI card, and a PhonePe or Paytm UPI payment is also an
+ICICI debit, so adding the accounts up counts such amounts twice. Each
+rule in LINK_RULES pairs rows of one group of accounts with rows of
+another: same amount, directions and narrations as given, dates at most
+`days` apart. Pairs are found with merge_asof on the date, by amount,
+after sorting, and each row is linked at most once per rule (closest
+date first). Rules with 'by_ref' first pair rows carrying the same
+12-digit UPI reference (the SourceTxnId, or the RRN in a bank narration
+like 'UPI/412345678901/...'), so two same-amount payments a day apart are
+not crossed; rows without a shared reference fall back to amount and date.
+
+Links live in their own database (LINKS_DB, or --links-db) as
+(kind, left account/row, right account/row), rows being the rowids in
+the account databases. Each account's change log cursor is kept there
+too, so update_links() only matches rows inserted or changed since the
+last run, against the unlinked rows of the other side within the date
+window. A rebuilt database ('reset' in its change log) drops and redoes
+that account's links.
+"""
+import os
+import re
+import sys
+import argparse
+
+import numpy as np
+import pandas as pd
+
+from ledger import accounts
+from ledger import aggregates
+from ledger import changefeed
+from ledger import dedup
+from ledger import instrument
+from ledger import ordering
+from ledger import storage
+
+LINKS_DB = os.environ.get('LEDGER_LINKS_DB', os.path.join(accounts.REPO_ROOT, 'ledger_links.db'))
+
+BANKS = ['ICICI_SA_0090', 'ICICI_CA_1849']
+CARDS = ['DBS_CC_2009', 'SBI_CC_7670']
+UPI_APPS = ['PhonePeTransaction', 'PaytmTransactions']
+TRANSFER_PATTERN = r'neft|imps|rtgs|transfer|\btrf\b'
+# UPI reference number (RRN / UTR) as printed by the apps and in bank narrations
+UPI_REF_PATTERN = r'(?<!\d)(\d{12})(?!\d)'
+
+# left rows are linked to right rows; a pattern, when given, must appear in the narration;
+# by_ref rules link rows with the same UPI reference before falling back to amount and date
+LINK_RULES = [
+    {'kind': 'card_payment', 'left': BANKS, 'left_direction': 'debit',
+     'right': CARDS, 'right_direction': 'credit', 'right_pattern': r'payment|thank ?you', 'days': 4},
+    {'kind': 'upi_to_bank_account', 'left': UPI_APPS, 'left_direction': 'debit', 'left_pattern': r'bank account',
+     'right': BANKS, 'right_direction': 'credit', 'days': 2},
+    {'kind': 'upi_debit', 'left': UPI_APPS, 'left_direction': 'debit',
+     'right': BANKS, 'right_direction': 'debit', 'right_pattern': r'upi', 'by_ref': True, 'days': 2},
+    {'kind': 'upi_credit', 'left': UPI_APPS, 'left_direction': 'credit',
+     'right': BANKS, 'right_direction': 'credit', 'days': 2},
+    {'kind': 'bank_transfer', 'left': BANKS, 'left_direction': 'debit', 'left_pattern': TRANSFER_PATTERN,
+     'right': BANKS, 'right_direction': 'credit', 'right_pattern': TRANSFER_PATTERN, 'days': 2},
+]
+
+# Row ids per IN (...) query
+QUERY_CHUNK = 500
+
+LINKS_TABLE_SQL = """
+CREATE TABLE IF NOT EXISTS links (
+    kind TEXT NOT NULL,
+    left_account TEXT NOT NULL,
+    left_row INTEGER NOT NULL,
+    left_date TEXT NOT NULL,
+    right_account TEXT NOT NULL,
+    right_row INTEGER NOT NULL,
+    right_date TEXT NOT NULL,
+    paise INTEGER NOT NULL,
+    PRIMARY KEY (kind, left_account, left_row),
+    UNIQUE (kind, right_account, right_row)
+)
+"""
+
+CURSORS_TABLE_SQL = """
+CREATE TABLE IF NOT EXISTS cursors (
+    account TEXT PRIMARY KEY,
+    seq INTEGER NOT NULL,
+    version INTEGER NOT NULL
+)
+"""
+
+ROW_COLUMNS = ['account', 'row_id', 'day', 'paise', 'is_debit', 'narration', 'ref']
+
+def connect_links(links_path=None):
+    conn = storage.connect(links_path or LINKS_DB)
+    conn.execute(LINKS_TABLE_SQL)
+    conn.execute(CURSORS_TABLE_SQL)
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_links_left ON links(left_account, left_row)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_links_right ON links(right_account, right_row)')
+    conn.commit()
+    return conn
+
+def upi_refs(source_ids, narrations):
+    """12-digit UPI reference of each row: from its SourceTxnId, else the first one in the narration"""
+    refs = source_ids.fillna('').astype(str).str.extract(UPI_REF_PATTERN)[0]
+    return refs.fillna(narrations.str.extract(UPI_REF_PATTERN)[0])
+
+def read_rows(conn, account, where='1', params=(), table='transactions'):
+    """(account, row_id, day, paise, is_debit, narration, ref) rows; day counts days since 1970"""
+    columns = storage.table_columns(conn, table)
+    sign_col = aggregates.find_column(columns, aggregates.SIGN_COLUMNS)
+    details_col = aggregates.find_column(columns, dedup.DETAILS_COLUMNS)
+    source_id = storage.SOURCE_ID_COLUMN if storage.SOURCE_ID_COLUMN in columns else 'NULL'
+    rows = pd.read_sql_query(f'''
+        SELECT rowid AS row_id, {ordering.DATE_KEY_COLUMN} AS date_key, {storage.amount_paise_sql(columns)} AS paise,
+               "{sign_col}" AS sign, "{details_col}" AS narration, {source_id} AS source_id
+        FROM "{table}" WHERE {ordering.DATE_KEY_COLUMN} IS NOT NULL AND ({where})
+    ''', conn, params=list(params))
+    rows['account'] = account
+    rows['day'] = pd.to_datetime(rows['date_key']).to_numpy().astype('datetime64[D]').astype('int64')
+    rows['paise'] = np.abs(rows['paise'].fillna(0).astype('int64'))
+    rows['is_debit'] = rows['sign'].isin(aggregates.DEBIT_SIGNS)
+    rows['narration'] = rows['narration'].fillna('').astype(str)
+    rows['ref'] = upi_refs(rows['source_id'], rows['narration'])
+    return rows[ROW_COLUMNS]
+
+def read_row_ids(conn, account, row_ids):
+    parts = [read_rows(conn, account, f"rowid IN ({', '.join('?' * len(chunk))})", chunk)
+             for chunk in (row_ids[i:i + QUERY_CHUNK] for i in range(0, len(row_ids), QUERY_CHUNK))]
+    return pd.concat(parts, ignore_index=True) if parts else pd.DataFrame(columns=ROW_COLUMNS)
+
+def account_changes(conn, cursor, version):
+    """(reset, changed row ids, new cursor, new version) since the last run
+
+    Databases without a change log are redone whenever their data version moves.
+    """
+    new_version = storage.data_version(conn)
+    if conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'changes'").fetchone() is None:
+        return new_version != version, [], 0, new_version
+    last = changefeed.last_seq(conn)
+    if cursor > last:
+        return True, [], last, new_version   # replaced by an older file
+    changes = conn.execute('SELECT seq, op, row_id FROM changes WHERE seq > ? ORDER BY seq', (cursor,)).fetchall()
+    resets = [seq for seq, op, _ in changes if op == 'reset']
+    if resets:
+        return True, [], last, new_version
+    return False, sorted({row_id for _, _, row_id in changes}), last, new_version
+
+def select(rows, direction, pattern=None):
+    mask = rows['is_debit'].to_numpy(dtype=bool) == (direction == 'debit')
+    if pattern:
+        mask &= rows['narration'].str.contains(pattern, flags=re.IGNORECASE, regex=True).to_numpy(dtype=bool)
+    return rows[mask]
+
+def match_refs(left, right, days):
+    """One-to-one pairs with the same UPI reference and amount at most `days` apart"""
+    as_ints = {'row_id': 'int64', 'day': 'int64', 'paise': 'int64'}
+    left = left.dropna(subset=['ref'])[['account', 'row_id', 'day', 'paise', 'ref']].astype(as_ints)
+    right = right.dropna(subset=['ref'])[['account', 'row_id', 'day', 'paise', 'ref']].astype(as_ints).rename(
+        columns={'account': 'right_account', 'row_id': 'right_row', 'day': 'right_day'})
+    found = left.merge(right, on=['ref', 'paise'])
+    found['gap'] = (found['day'] - found['right_day']).abs()
+    found = found[found['gap'] <= days].sort_values(['gap', 'day'], kind='stable')
+    found = found.drop_duplicates(['account', 'row_id']).drop_duplicates(['right_account', 'right_row'])
+    return found[['account', 'row_id', 'day', 'paise', 'right_account', 'right_row', 'right_day']]
+
+def without(rows, pairs, account='account', row_id='row_id'):
+    """rows minus the ones already in pairs"""
+    if pairs.empty or rows.empty:
+        return rows
+    keys = pd.MultiIndex.from_frame(pairs[[account, row_id]].astype({row_id: 'int64'}), names=['account', 'row_id'])
+    return rows[~pd.MultiIndex.from_frame(rows[['account', 'row_id']].astype({'row_id': 'int64'})).isin(keys)]
+
+def match_pairs(left, right, days):
+    """One-to-one pairs of equal amounts at most `days` apart, closest dates first"""
+    as_ints = {'row_id': 'int64', 'day': 'int64', 'paise': 'int64'}
+    left = left[['account', 'row_id', 'day', 'paise']].astype(as_ints).drop_duplicates(['account', 'row_id'])
+    right = right[['account', 'row_id', 'day', 'paise']].astype(as_ints).drop_duplicates(['account', 'row_id']).rename(
+        columns={'account': 'right_account', 'row_id': 'right_row'})
+    right['right_day'] = right['day']
+    pairs = []
+    while len(left) and len(right):
+        found = pd.merge_asof(left.sort_values('day'), right.sort_values('day'), on='day', by='paise',
+                              direction='nearest', tolerance=days).dropna(subset=['right_row'])
+        if found.empty:
+            break
+        found = found.astype({'right_row': 'int64', 'right_day': 'int64'})
+        # A right row nearest to several left rows goes to the closest one; the others try again
+        found['gap'] = (found['day'] - found['right_day']).abs()
+        found = found.sort_values(['gap', 'day'], kind='stable').drop_duplicates(['right_account', 'right_row'])
+        pairs.append(found)
+        left = left[~pd.MultiIndex.from_frame(left[['account', 'row_id']]).isin(
+            pd.MultiIndex.from_frame(found[['account', 'row_id']]))]
+        right = right[~pd.MultiIndex.from_frame(right[['right_account', 'right_row']]).isin(
+            pd.MultiIndex.from_frame(found[['right_account', 'right_row']]))]
+    if not pairs:
+        return pd.DataFrame(columns=['account', 'row_id', 'day', 'paise', 'right_account', 'right_row', 'right_day'])
+    return pd.concat(pairs, ignore_index=True)
+
+def window_rows(conns, account_names, days_seen, days):
+    """Rows of the given accounts dated within `days` of any day in days_seen, by idx_order range scans"""
+    if not len(days_seen):
+        return pd.DataFrame(columns=ROW_COLUMNS)
+    to_key = lambda day: str(np.datetime64(int(day), 'D'))
+    low, high = to_key(min(days_seen) - days), to_key(max(days_seen) + days)
+    parts = [read_rows(conns[account], account, f'{ordering.DATE_KEY_COLUMN} BETWEEN ? AND ?', (low, high))
+             for account in account_names if account in conns]
+    rows = pd.concat(parts, ignore_index=True) if parts else pd.DataFrame(columns=ROW_COLUMNS)
+    # Only days near one actually seen, not the whole span between the first and last
+    seen = np.unique(np.asarray(days_seen, dtype='int64'))
+    position = np.searchsorted(seen, rows['day'].to_numpy(dtype='int64'))
+    below = seen[np.clip(position - 1, 0, len(seen) - 1)]
+    above = seen[np.clip(position, 0, len(seen) - 1)]
+    near = np.minimum(np.abs(rows['day'] - below), np.abs(rows['day'] - above)) <= days
+    return rows[near.to_numpy(dtype=bool)]
+
+def linked_keys(links, kind, side):
+    rows = links.execute(f'SELECT {side}_account, {side}_row FROM links WHERE kind = ?', (kind,)).fetchall()
+    return pd.MultiIndex.from_tuples(rows, names=['account', 'row_id']) if rows else None
+
+def unlinked(rows, keys):
+    if keys is None or rows.empty:
+        return rows
+    return rows[~pd.MultiIndex.from_frame(rows[['account', 'row_id']]).isin(keys)]
+
+def match_rule(links, conns, fresh, rule):
+    """Link the fresh rows of a rule's accounts; returns the number of links added"""
+    new_left = select(pd.concat([fresh[a] for a in rule['left'] if a in fresh] or [pd.DataFrame(columns=ROW_COLUMNS)],
+                                ignore_index=True), rule['left_direction'], rule.get('left_pattern'))
+    new_right = select(pd.concat([fresh[a] for a in rule['right'] if a in fresh] or [pd.DataFrame(columns=ROW_COLUMNS)],
+                                 ignore_index=True), rule['right_direction'], rule.get('right_pattern'))
+    if new_left.empty and new_right.empty:
+        return 0
+
+    # Fresh rows on one side meet the unlinked rows of the other side near their dates
+    left = pd.concat([new_left, select(window_rows(conns, rule['left'], new_right['day'].to_numpy(), rule['days']),
+                                       rule['left_direction'], rule.get('left_pattern'))], ignore_index=True)
+    right = pd.concat([new_right, select(window_rows(conns, rule['right'], new_left['day'].to_numpy(), rule['days']),
+                                         rule['right_direction'], rule.get('right_pattern'))], ignore_index=True)
+    left = unlinked(left, linked_keys(links, rule['kind'], 'left'))
+    right = unlinked(right, linked_keys(links, rule['kind'], 'right'))
+    if rule.get('by_ref'):
+        by_ref = match_refs(left, right, rule['days'])
+        rest = match_pairs(without(left, by_ref), without(right, by_ref, 'right_account', 'right_row'), rule['days'])
+        pairs = pd.concat([by_ref, rest], ignore_index=True) if len(by_ref) else rest
+    else:
+        pairs = match_pairs(left, right, rule['days'])
+
+    to_key = lambda days: np.datetime_as_string(days.to_numpy(dtype='int64').astype('datetime64[D]'), unit='D')
+    links.executemany('INSERT OR IGNORE INTO links VALUES (?, ?, ?, ?, ?, ?, ?, ?)', zip(
+        [rule['kind']] * len(pairs), pairs['account'], pairs['row_id'].astype('int64').tolist(), to_key(pairs['day']),
+        pairs['right_account'], pairs['right_row'].tolist(), to_key(pairs['right_day']), pairs['paise'].astype('int64').tolist()))
+    return len(pairs)
+
+def forget_rows(links, account, row_ids=None):
+    """Drop the links of some rows of an account, or of all of them"""
+    for side in ('left', 'right'):
+        if row_ids is None:
+            links.execute(f'DELETE FROM links WHERE {side}_account = ?', (account,))
+            continue
+        for start in range(0, len(row_ids), QUERY_CHUNK):
+            chunk = row_ids[start:start + QUERY_CHUNK]
+            links.execute(f"DELETE FROM links WHERE {side}_account = ? AND {side}_row IN ({', '.join('?' * len(chunk))})",
+                          [account] + list(chunk))
+
+def update_links(db_paths, links_path=None, rules=None):
+    """Match the rows added or changed since the last run; returns {kind: links added}"""
+    links = connect_links(links_path)
+    conns = {}
+    try:
+        for account, db_path in db_paths.items():
+            if os.path.exists(db_path):
+                conns[account] = storage.connect(db_path, readonly=True)
+
+        fresh = {}
+        cursors = dict((account, (seq, version)) for account, seq, version in
+                       links.execute('SELECT account, seq, version FROM cursors').fetchall())
+        with instrument.stage('match_changes'):
+            for account, conn in conns.items():
+                if ordering.DATE_KEY_COLUMN not in storage.table_columns(conn):
+                    print(f"[{account}] skipped: no {ordering.DATE_KEY_COLUMN} column yet (append a statement first)")
+                    continue
+                seq, version = cursors.get(account, (0, -1))
+                reset, row_ids, new_seq, new_version = account_changes(conn, seq, version)
+                if reset or account not in cursors:
+                    forget_rows(links, account)
+                    fresh[account] = read_rows(conn, account)
+                elif row_ids:
+                    forget_rows(links, account, row_ids)
+                    fresh[account] = read_row_ids(conn, account, row_ids)
+                links.execute('INSERT OR REPLACE INTO cursors VALUES (?, ?, ?)', (account, new_seq, new_version))
+
+        added = {}
+        with instrument.stage('match'):
+            for rule in rules or LINK_RULES:
+                added[rule['kind']] = match_rule(links, conns, fresh, rule)
+        links.commit()
+        instrument.count('links', sum(added.values()))
+        return added
+    finally:
+        links.close()
+        for conn in conns.values():
+            conn.close()
+
+def linked_row_ids(links, account, kinds=None):
+    """rowids of an account's rows that are the other end of a link, e.g. to leave out of combined totals"""
+    kinds = kinds or [rule['kind'] for rule in LINK_RULES]
+    marks = ', '.join('?' * len(kinds))
+    rows = links.execute(f'''
+        SELECT left_row FROM links WHERE left_account = ? AND kind IN ({marks})
+        UNION SELECT right_row FROM links WHERE right_account = ? AND kind IN ({marks})
+    ''', [account] + kinds + [account] + kinds).fetchall()
+    return {row_id for (row_id,) in rows}
+
+def print_summary(links):
+    summary = links.execute('''
+        SELECT kind, left_account, right_account, COUNT(*), SUM(paise) FROM links
+        GROUP BY kind, left_account, right_account ORDER BY kind, left_account, right_account
+    ''').fetchall()
+    if not summary:
+        print("No linked transactions")
+        return
+    print(f"{'Kind':20} {'From':20} {'To':20} {'Links':>7} {'Amount':>16}")
+    for kind, left_account, right_account, count, paise in summary:
+        print(f"{kind:20} {left_account:20} {right_account:20} {count:>7} {aggregates.to_rupees(paise):>16,.2f}")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Link rows that are the same money across account databases")
+    parser.add_argument('--db', action='append', metavar='ACCOUNT=PATH',
+                        help="Override the database path of an account")
+    parser.add_argument('--links-db', help="Links database (default: LEDGER_LINKS_DB or ledger_links.db in the repo)")
+    args = parser.parse_args(argv)
+
+    added = update_links(accounts.db_paths(accounts.parse_db_overrides(args.db)), args.links_db)
+    print(f"{sum(added.values())} new link(s): " + ', '.join(f"{kind} {n}" for kind, n in added.items()))
+    links = connect_links(args.links_db)
+    try:
+        print_summary(links)
+    finally:
+        links.close()
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,112 @@
+"""Stable row numbers and a sortable ordering key for the transactions tables.
+
+SrNo is handed out once, when a row is first stored, and never changes.
+Chronological order comes from (DateKey, DaySeq): the ISO date and the
+row's position within that day. A back-dated statement therefore only
+adds DaySeq values after the ones already stored for its days, so no
+existing row is rewritten. Read in date order with ORDER BY DateKey, DaySeq.
+
+The last SrNo and the last DaySeq of a day are index lookups
+(idx_srno on CAST(SrNo AS INTEGER), idx_order on (DateKey, DaySeq)), so
+appends no longer need the whole table to number new rows.
+"""
+import numpy as np
+import pandas as pd
+
+from ledger import aggregates
+from ledger import dates
+from ledger import storage
+
+DATE_KEY_COLUMN = 'DateKey'
+DAY_SEQ_COLUMN = 'DaySeq'
+ORDER_BY = f'{DATE_KEY_COLUMN}, {DAY_SEQ_COLUMN}'
+
+def date_keys(values):
+    """ISO 'YYYY-MM-DD' strings for a column of dates; None where unparseable"""
+    parsed = dates.to_datetime64(values)
+    keys = np.datetime_as_string(parsed, unit='D').astype(object)
+    keys[np.isnat(parsed)] = None
+    return keys
+
+def add_order_columns(df, date_column, start_seq=None):
+    """Set DateKey and DaySeq in the frame's current (statement) order
+
+    start_seq maps a DateKey to the last DaySeq already stored for that day.
+    """
+    keys = pd.Series(date_keys(df[date_column]), index=df.index, dtype=object)
+    seq = keys.fillna('').groupby(keys.fillna(''), sort=False).cumcount() + 1
+    if start_seq:
+        seq += keys.map(start_seq).fillna(0).astype('int64')
+    df[DATE_KEY_COLUMN] = keys
+    df[DAY_SEQ_COLUMN] = seq.astype('int64')
+    return df
+
+def ensure_order_columns(conn, table='transactions'):
+    """Add DateKey / DaySeq and their indexes, filling them for rows that lack them"""
+    columns = storage.table_columns(conn, table)
+    for name, sql_type in [(DATE_KEY_COLUMN, 'TEXT'), (DAY_SEQ_COLUMN, 'INTEGER')]:
+        if name not in columns:
+            conn.execute(f'ALTER TABLE "{table}" ADD COLUMN {name} {sql_type}')
+    conn.execute(f'CREATE INDEX IF NOT EXISTS idx_order ON "{table}"({ORDER_BY})')
+    if any(name.lower() == 'srno' for name in columns):
+        conn.execute(f'CREATE INDEX IF NOT EXISTS idx_srno ON "{table}"(CAST(SrNo AS INTEGER))')
+
+    # Rows written before the columns existed are ordered by insertion within each day
+    date_col = aggregates.find_column(columns, aggregates.DATE_COLUMNS)
+    missing = pd.read_sql_query(
+        f'SELECT rowid AS row_id, "{date_col}" AS date FROM "{table}" WHERE {DAY_SEQ_COLUMN} IS NULL ORDER BY rowid', conn)
+    if missing.empty:
+        return
+    add_order_columns(missing, 'date', last_day_seq(conn, date_keys(missing['date']), table))
+    conn.executemany(f'UPDATE "{table}" SET {DATE_KEY_COLUMN} = ?, {DAY_SEQ_COLUMN} = ? WHERE rowid = ?',
+                     missing[[DATE_KEY_COLUMN, DAY_SEQ_COLUMN, 'row_id']].astype(object).itertuples(index=False, name=None))
+
+def last_srno(conn, table='transactions'):
+    row = conn.execute(f'SELECT MAX(CAST(SrNo AS INTEGER)) FROM "{table}"').fetchone()
+    return row[0] or 0
+
+def last_day_seq(conn, keys, table='transactions'):
+    """{DateKey: highest stored DaySeq} for the given days"""
+    days = sorted({key for key in keys if key is not None})
+    if not days:
+        return {}
+    placeholders = ', '.join('?' * len(days))
+    return dict(conn.execute(f'''
+        SELECT {DATE_KEY_COLUMN}, MAX({DAY_SEQ_COLUMN}) FROM "{table}"
+        WHERE {DATE_KEY_COLUMN} IN ({placeholders}) AND {DAY_SEQ_COLUMN} IS NOT NULL
+        GROUP BY {DATE_KEY_COLUMN}
+    ''', days).fetchall())
+
+def assign_row_keys(conn, df, date_column, table='transactions'):
+    """Number rows about to be appended: SrNo after the last stored one, DaySeq after each day's last
+
+    Tables without SrNo (SBI_CC_7670.py numbers rows with an id column) only get DateKey / DaySeq.
+    """
+    if any(name.lower() == 'srno' for name in storage.table_columns(conn, table)):
+        start = last_srno(conn, table)
+        df['SrNo'] = range(start + 1, start + len(df) + 1)
+    return add_order_columns(df, date_column, last_day_seq(conn, date_keys(df[date_column]), table))
+
+def merge_row_keys(df, first_rows, date_column):
+    """Keys for a merge of two databases: the first keeps its SrNo and day order, the second follows
+
+    The first first_rows rows come from the first database. Returns the frame
+    sorted by (DateKey, DaySeq).
+    """
+    base = df.iloc[:first_rows].copy()
+    extra = df.iloc[first_rows:].copy()
+
+    srno = pd.to_numeric(base['SrNo'], errors='coerce') if 'SrNo' in base.columns else pd.Series(np.nan, index=base.index)
+    if srno.isna().any() or srno.duplicated().any():
+        srno = pd.Series(range(1, len(base) + 1), index=base.index)
+    base['SrNo'] = srno.astype('int64')
+    if DAY_SEQ_COLUMN not in base.columns or base[DAY_SEQ_COLUMN].isna().any():
+        add_order_columns(base, date_column)
+
+    start = int(base['SrNo'].max()) if len(base) else 0
+    extra['SrNo'] = range(start + 1, start + len(extra) + 1)
+    add_order_columns(extra, date_column, base.groupby(DATE_KEY_COLUMN)[DAY_SEQ_COLUMN].max().to_dict())
+
+    merged = pd.concat([base, extra])
+    merged[DAY_SEQ_COLUMN] = merged[DAY_SEQ_COLUMN].astype('int64')
+    return merged.sort_values([DATE_KEY_COLUMN, DAY_SEQ_COLUMN], na_position='last', kind='stable').reset_index(drop=True)
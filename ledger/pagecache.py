@@ -0,0 +1,150 @@
+"""Persistent cache of pdfplumber's per-page output.
+
+Layout analysis (extract_text / extract_tables) is most of the cost of
+reading a statement; the regexes that turn its output into rows are
+cheap. page_text() and page_tables() keep that output per page in SQLite,
+zlib-compressed JSON keyed by a hash of what layout depends on: the
+page's content streams, its resources (fonts, form XObjects), its boxes
+and rotation, and the pdfplumber version. A parser fix therefore replays
+over the cached text of every archived statement without laying a page
+out again, and a page repeated in an overlapping download is laid out
+once.
+
+The cache is opt-in: LEDGER_PAGE_CACHE=1 keeps it in page_cache.db under
+the user's cache directory (LOCALAPPDATA, XDG_CACHE_HOME or ~/.cache),
+LEDGER_PAGE_CACHE=<file> in that file, and configure(path) sets it for a
+run. Unset, pages are laid out every time and never hashed.
+"""
+import os
+import sys
+import json
+import zlib
+import sqlite3
+import hashlib
+import argparse
+
+from ledger import instrument
+from ledger import storage
+
+def default_path():
+    """page_cache.db in the per-user cache directory"""
+    base = os.environ.get('LOCALAPPDATA') or os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(base, 'ledger', 'page_cache.db')
+
+CACHE_PATH = os.environ.get('LEDGER_PAGE_CACHE', '')
+if CACHE_PATH.lower() in ('', 'off', '0'):
+    CACHE_PATH = None
+elif CACHE_PATH.lower() in ('1', 'on'):
+    CACHE_PATH = default_path()
+
+# Bumped when what is stored for a method changes
+CACHE_FORMAT = 1
+
+PAGES_TABLE_SQL = """
+CREATE TABLE IF NOT EXISTS pages (
+    key TEXT PRIMARY KEY,
+    method TEXT NOT NULL,
+    value BLOB NOT NULL
+)
+"""
+
+_ready = set()
+
+def configure(path):
+    """Use another cache file; None turns the cache off"""
+    global CACHE_PATH
+    CACHE_PATH = path
+
+def page_key(page, method):
+    """Hash of everything a page's layout depends on, for one extraction method"""
+    import pdfplumber
+    from ledger import pdfresources
+
+    page_obj = page.page_obj
+    digest = hashlib.sha256(f"{CACHE_FORMAT}|{pdfplumber.__version__}|{method}|".encode())
+    pdfresources.feed(digest, [page_obj.mediabox, page_obj.cropbox, page_obj.rotate, page.bbox])
+    pdfresources.feed(digest, page_obj.resources)
+    for stream in page_obj.contents:
+        pdfresources.feed(digest, stream)
+    return digest.hexdigest()
+
+def _connect():
+    if CACHE_PATH not in _ready:
+        os.makedirs(os.path.dirname(os.path.abspath(CACHE_PATH)), exist_ok=True)
+    conn = storage.connect(CACHE_PATH)
+    if CACHE_PATH not in _ready:
+        conn.execute(PAGES_TABLE_SQL)
+        conn.commit()
+        _ready.add(CACHE_PATH)
+    return conn
+
+def _disable(e):
+    instrument.count('page_cache_errors')
+    instrument.echo(f"Page cache {CACHE_PATH} not used: {e}")
+    configure(None)
+
+def cached(page, method, extract):
+    """extract(page) through the cache; method names what extract returns"""
+    if CACHE_PATH is None:
+        return extract(page)
+    key = page_key(page, method)
+    try:
+        conn = _connect()
+        try:
+            row = conn.execute('SELECT value FROM pages WHERE key = ?', (key,)).fetchone()
+        finally:
+            conn.close()
+    except (sqlite3.Error, OSError) as e:
+        _disable(e)
+        return extract(page)
+    if row is not None:
+        instrument.count('page_cache_hits')
+        return json.loads(zlib.decompress(row[0]))
+
+    instrument.count('page_cache_misses')
+    value = extract(page)
+    try:
+        conn = _connect()
+        try:
+            conn.execute('INSERT OR REPLACE INTO pages (key, method, value) VALUES (?, ?, ?)',
+                         (key, method, zlib.compress(json.dumps(value).encode())))
+            conn.commit()
+        finally:
+            conn.close()
+    except sqlite3.Error as e:
+        _disable(e)
+    return value
+
+def page_text(page):
+    """page.extract_text(), from the cache when the page was laid out before"""
+    return cached(page, 'text', lambda p: p.extract_text())
+
+def page_tables(page):
+    """page.extract_tables(), from the cache when the page was laid out before"""
+    return cached(page, 'tables', lambda p: p.extract_tables())
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Show or clear the per-page PDF layout cache")
+    parser.add_argument('--cache', help="Cache file (default: LEDGER_PAGE_CACHE, or page_cache.db in the user cache directory)")
+    parser.add_argument('--clear', action='store_true', help="Delete every cached page")
+    args = parser.parse_args(argv)
+
+    path = args.cache or CACHE_PATH or default_path()
+    if path is None or not os.path.exists(path):
+        print("No page cache")
+        return 0
+    conn = sqlite3.connect(path)
+    try:
+        if args.clear:
+            conn.execute('DELETE FROM pages')
+            conn.commit()
+            conn.execute('VACUUM')
+            print(f"Cleared {path}")
+        for method, count, size in conn.execute('SELECT method, COUNT(*), SUM(LENGTH(value)) FROM pages GROUP BY method'):
+            print(f"{method:7} {count:>8} pages {size / 1024:>10,.1f} KiB")
+    finally:
+        conn.close()
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
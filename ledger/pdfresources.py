@@ -0,0 +1,136 @@
+"""Fonts shared across pages and statements in the PDF layer.
+
+pdfminer, under pdfplumber, builds a font (font program, widths,
+ToUnicode CMap) the first time a page uses it and keeps it for that one
+document only, by object id; a font written inline in a page's resources
+is rebuilt for every page. Statements from one bank embed the same fonts
+month after month, so open_pdf() gives each document a resource manager
+backed by FONTS, a process-wide LRU keyed by a hash of the font
+dictionary and its decoded streams. It is bounded by entry count and by
+the stream bytes of the fonts it holds, and is shared by the daemon's
+worker threads. Cached fonts are detached from their document, so the
+cache holds fonts only, never whole documents.
+"""
+import hashlib
+import threading
+from collections import OrderedDict
+
+import pdfplumber
+from pdfminer.pdfinterp import PDFResourceManager
+from pdfminer.pdftypes import PDFObjRef, PDFStream, resolve1
+
+from ledger import instrument
+
+MAX_FONTS = 256
+MAX_BYTES = 64 * 1024 * 1024
+# PDF objects nested deeper than this are not hashed
+MAX_DEPTH = 12
+
+def feed(digest, value, depth=0):
+    """Hash a PDF object: streams by their decoded data, dicts and lists item by item
+
+    Returns the number of stream bytes hashed.
+    """
+    value = resolve1(value)
+    size = 0
+    if depth > MAX_DEPTH:
+        digest.update(b'~')
+    elif isinstance(value, PDFStream):
+        digest.update(b'S')
+        size += feed(digest, {k: v for k, v in value.attrs.items() if k not in ('Length', 'Filter', 'DecodeParms')}, depth + 1)
+        data = value.get_data()
+        digest.update(data)
+        size += len(data)
+    elif isinstance(value, dict):
+        digest.update(b'{')
+        for key in sorted(value, key=str):
+            if key != 'Parent':
+                digest.update(str(key).encode() + b':')
+                size += feed(digest, value[key], depth + 1)
+        digest.update(b'}')
+    elif isinstance(value, (list, tuple)) and all(isinstance(item, (int, float)) for item in value):
+        # Widths and other number arrays, in one go
+        digest.update(repr(list(value)).encode())
+    elif isinstance(value, (list, tuple)):
+        digest.update(b'[')
+        for item in value:
+            size += feed(digest, item, depth + 1)
+        digest.update(b']')
+    else:
+        digest.update(repr(value).encode() + b',')
+    return size
+
+class FontCache:
+    """Least recently used fonts by content hash, within a count and a byte budget"""
+
+    def __init__(self, max_fonts=MAX_FONTS, max_bytes=MAX_BYTES):
+        self.max_fonts = max_fonts
+        self.max_bytes = max_bytes
+        self.fonts = OrderedDict()
+        self.bytes = 0
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.fonts.get(key)
+            if entry is None:
+                return None
+            self.fonts.move_to_end(key)
+            return entry[0]
+
+    def put(self, key, font, size):
+        with self.lock:
+            if key in self.fonts:
+                return
+            self.fonts[key] = (font, size)
+            self.bytes += size
+            while len(self.fonts) > 1 and (len(self.fonts) > self.max_fonts or self.bytes > self.max_bytes):
+                _, (_, evicted) = self.fonts.popitem(last=False)
+                self.bytes -= evicted
+                instrument.count('font_cache_evictions')
+
+    def clear(self):
+        with self.lock:
+            self.fonts.clear()
+            self.bytes = 0
+
+FONTS = FontCache()
+
+def detach(font):
+    """Drop what ties a font to its document, so a cached font does not keep the whole document alive
+
+    The font program stream and the descriptor's references are only read
+    while pdfminer builds the font.
+    """
+    for name, value in list(vars(font).items()):
+        if isinstance(value, (PDFStream, PDFObjRef)):
+            setattr(font, name, None)
+        elif isinstance(value, dict):
+            setattr(font, name, {k: v for k, v in value.items() if not isinstance(v, (PDFStream, PDFObjRef))})
+    return font
+
+class SharedResourceManager(PDFResourceManager):
+    """PDFResourceManager whose fonts come from FONTS"""
+
+    def get_font(self, objid, spec):
+        if objid and objid in self._cached_fonts:
+            return self._cached_fonts[objid]
+        digest = hashlib.sha256()
+        size = feed(digest, spec)
+        key = digest.hexdigest()
+        font = FONTS.get(key)
+        if font is None:
+            instrument.count('font_cache_misses')
+            font = detach(super().get_font(None, spec))
+            FONTS.put(key, font, size)
+        else:
+            instrument.count('font_cache_hits')
+        if objid and self.caching:
+            self._cached_fonts[objid] = font
+        return font
+
+def open_pdf(path):
+    """pdfplumber.open() whose pages take their fonts from the process-wide cache"""
+    pdf = pdfplumber.open(path)
+    pdf.rsrcmgr = SharedResourceManager()
+    return pdf
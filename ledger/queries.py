@@ -0,0 +1,45 @@
+"""Read-only queries served by ledger.service; totals come from ledger.aggregates."""
+from datetime import datetime
+
+from ledger import aggregates
+
+def _format_date(value):
+    return datetime.strptime(value, '%Y-%m-%d').strftime('%d-%b-%y') if value is not None else None
+
+def summary(conn):
+    """Same figures verify_database prints: count, date range, totals per sign"""
+    result = aggregates.totals(conn)
+    by_sign = [{'sign': e['sign'], 'count': e['count'], 'total': aggregates.to_rupees(e['paise'])}
+               for e in result['by_sign'].values()]
+    return {
+        'total_transactions': result['count'],
+        'earliest_date': _format_date(result['earliest']),
+        'latest_date': _format_date(result['latest']),
+        'by_sign': sorted(by_sign, key=lambda e: str(e['sign'])),
+        'total_debits': aggregates.to_rupees(result['debit_paise']),
+        'total_credits': aggregates.to_rupees(result['credit_paise']),
+    }
+
+def balance(conn):
+    """Net movement (credits - debits) over the whole ledger"""
+    result = aggregates.totals(conn)
+    return {
+        'total_debits': aggregates.to_rupees(result['debit_paise']),
+        'total_credits': aggregates.to_rupees(result['credit_paise']),
+        'net': aggregates.to_rupees(result['credit_paise'] - result['debit_paise']),
+    }
+
+def monthly(conn):
+    """Debit / credit totals per calendar month"""
+    return [{
+        'month': month,
+        'debits': aggregates.to_rupees(entry['debit_paise']),
+        'credits': aggregates.to_rupees(entry['credit_paise']),
+        'count': entry['count'],
+    } for month, entry in aggregates.monthly_totals(conn).items()]
+
+QUERIES = {
+    'summary': summary,
+    'balance': balance,
+    'monthly': monthly,
+}
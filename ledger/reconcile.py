@@ -0,0 +1,172 @@
+"""Running-balance reconciliation for the ICICI bank accounts.
+
+The statements print the balance after every transaction. The scripts
+keep it as BalancePaise, and reconcile_database() recomputes the running
+balance as opening + cumsum(signed amounts) over rows in (DateKey, DaySeq)
+order, the statement's own order.
+A row is a break when the reported balance stops agreeing with the
+computed one, which is where a transaction was missed or duplicated. The
+check re-anchors on the reported balance after a break, so one missing
+row is flagged once rather than on every later row.
+
+Only rows after the last reconciled rowid are read; the watermark, the
+closing balance and the (DateKey, DaySeq) of the last checked row are kept
+in ledger_meta. New rows that sort before that row (a back-dated
+statement, or rows without a date) cannot be chained onto the closing
+balance, so they are skipped and reported instead of raising false breaks.
+Tables without the ordering columns are read in rowid order.
+"""
+import numpy as np
+import pandas as pd
+
+from ledger import aggregates
+from ledger import amounts
+from ledger import instrument
+from ledger import ordering
+from ledger import storage
+
+BALANCE_COLUMNS = [('Balance', 'REAL'), ('BalancePaise', 'INTEGER')]
+WATERMARK_KEY = 'reconciled_rowid'
+CLOSING_KEY = 'reconciled_balance_paise'
+DATE_KEY_KEY = 'reconciled_date_key'
+DAY_SEQ_KEY = 'reconciled_day_seq'
+
+BREAKS_TABLE_SQL = """
+CREATE TABLE IF NOT EXISTS balance_breaks (
+    row_id INTEGER PRIMARY KEY,
+    expected_paise INTEGER NOT NULL,
+    reported_paise INTEGER NOT NULL,
+    difference_paise INTEGER NOT NULL
+)
+"""
+
+def add_balance_columns(df, column='Balance'):
+    """Replace the raw reported balance with Balance / BalancePaise; None where it was blank"""
+    values = pd.Series(df[column] if column in df.columns else [None] * len(df), index=df.index, dtype=object)
+    paise = amounts.to_paise(values)
+    known = (values.notna() & values.astype(str).str.contains(r'\d')).to_numpy()
+    df['BalancePaise'] = np.where(known, paise.astype(object), None)
+    df['Balance'] = np.where(known, (paise / 100.0).astype(object), None)
+    return df
+
+def ensure_balance_columns(conn, table='transactions'):
+    """Add the balance columns to databases written before they existed"""
+    columns = storage.table_columns(conn, table)
+    for name, sql_type in BALANCE_COLUMNS:
+        if name not in columns:
+            conn.execute(f'ALTER TABLE "{table}" ADD COLUMN {name} {sql_type}')
+    conn.execute(BREAKS_TABLE_SQL)
+
+def reset(conn):
+    """Forget earlier results; call when the transactions table is rewritten"""
+    conn.execute(BREAKS_TABLE_SQL)
+    conn.execute('DELETE FROM balance_breaks')
+    storage.delete_meta(conn, WATERMARK_KEY, CLOSING_KEY, DATE_KEY_KEY, DAY_SEQ_KEY)
+
+def find_breaks(signed_paise, reported_paise, known, opening_paise):
+    """(expected, is_break, closing) for one run of rows in statement order
+
+    expected is the balance each row should report given the rows before it.
+    """
+    signed_paise = np.asarray(signed_paise, dtype='int64')
+    reported_paise = np.asarray(reported_paise, dtype='int64')
+    known = np.asarray(known, dtype=bool)
+    rows = len(signed_paise)
+
+    computed = opening_paise + np.cumsum(signed_paise)
+    offset = np.where(known, reported_paise - computed, 0)
+    # Offset of the last row with a reported balance, carried forward
+    last_known = np.maximum.accumulate(np.where(known, np.arange(rows), -1))
+    previous_known = np.concatenate([[-1], last_known[:-1]])
+    previous_offset = np.where(previous_known >= 0, offset[np.maximum(previous_known, 0)], 0)
+
+    expected = computed + previous_offset
+    is_break = known & (offset != previous_offset)
+    closing = int(computed[-1] + (offset[last_known[-1]] if last_known[-1] >= 0 else 0))
+    return expected, is_break, closing
+
+def out_of_order(rows, date_key, day_seq):
+    """Mask of the rows that sort at or before the last checked (date_key, day_seq), or have no date"""
+    keys = rows['date_key']
+    skipped = keys.isna()
+    if date_key is not None:
+        seq = rows['day_seq'].fillna(0).astype('int64')
+        skipped |= (keys < date_key) | ((keys == date_key) & (seq <= int(day_seq)))
+    return skipped.to_numpy(dtype=bool)
+
+def reconcile_database(conn, table='transactions'):
+    """Check the rows added since the last run; returns the new breaks as a DataFrame"""
+    ensure_balance_columns(conn, table)
+    columns = storage.table_columns(conn, table)
+    sign_col = aggregates.find_column(columns, aggregates.SIGN_COLUMNS)
+    ordered = ordering.DATE_KEY_COLUMN in columns and ordering.DAY_SEQ_COLUMN in columns
+    watermark = storage.get_meta(conn, WATERMARK_KEY, 0)
+    opening = storage.get_meta(conn, CLOSING_KEY)
+
+    with instrument.stage('reconcile'):
+        if ordered:
+            position = f'{ordering.DATE_KEY_COLUMN} AS date_key, {ordering.DAY_SEQ_COLUMN} AS day_seq'
+            order_by = f'{ordering.ORDER_BY}, rowid'
+        else:
+            position, order_by = 'NULL AS date_key, NULL AS day_seq', 'rowid'
+        rows = pd.read_sql_query(f'''
+            SELECT rowid AS row_id, "{sign_col}" AS sign, {storage.amount_paise_sql(columns)} AS paise, BalancePaise, {position}
+            FROM "{table}"
+            WHERE rowid > ?
+            ORDER BY {order_by}
+        ''', conn, params=(watermark,))
+        no_breaks = pd.DataFrame(columns=['row_id', 'expected_paise', 'reported_paise', 'difference_paise'])
+        if rows.empty:
+            return no_breaks
+        new_watermark = int(rows['row_id'].max())
+
+        if ordered:
+            skipped = out_of_order(rows, storage.get_meta(conn, DATE_KEY_KEY), storage.get_meta(conn, DAY_SEQ_KEY))
+            if skipped.any():
+                print(f"Balance check: {int(skipped.sum())} row(s) undated or dated before the rows already checked were skipped "
+                      f"(rows {', '.join(str(row_id) for row_id in rows['row_id'][skipped])})")
+                instrument.count('unordered_rows', int(skipped.sum()))
+                rows = rows[~skipped].reset_index(drop=True)
+            if rows.empty:
+                storage.set_meta(conn, WATERMARK_KEY, new_watermark)
+                return no_breaks
+
+        paise = rows['paise'].fillna(0).to_numpy(dtype='int64')
+        signed = np.where(rows['sign'].isin(aggregates.DEBIT_SIGNS), -paise, paise)
+        known = rows['BalancePaise'].notna().to_numpy()
+        reported = rows['BalancePaise'].fillna(0).to_numpy(dtype='int64')
+
+        if opening is None and known.any():
+            # First run: trust the first reported balance
+            first = int(np.argmax(known))
+            opening = int(reported[first] - signed[:first + 1].sum())
+
+        breaks = no_breaks
+        if opening is not None:
+            expected, is_break, closing = find_breaks(signed, reported, known, opening)
+            breaks = pd.DataFrame({
+                'row_id': rows['row_id'].to_numpy()[is_break],
+                'expected_paise': expected[is_break],
+                'reported_paise': reported[is_break],
+                'difference_paise': reported[is_break] - expected[is_break],
+            })
+            conn.executemany('INSERT OR REPLACE INTO balance_breaks VALUES (?, ?, ?, ?)',
+                             breaks.astype(object).itertuples(index=False, name=None))
+            storage.set_meta(conn, CLOSING_KEY, closing)
+        if ordered:
+            storage.set_meta(conn, DATE_KEY_KEY, rows['date_key'].iloc[-1])
+            storage.set_meta(conn, DAY_SEQ_KEY, int(rows['day_seq'].iloc[-1]))
+        storage.set_meta(conn, WATERMARK_KEY, new_watermark)
+
+    instrument.count('reconciled_rows', len(rows))
+    instrument.count('balance_breaks', len(breaks))
+    return breaks
+
+def print_breaks(breaks):
+    if breaks.empty:
+        print("Balance check: running balance matches the statement")
+        return
+    print(f"Balance check: {len(breaks)} row(s) where the running balance breaks:")
+    for row in breaks.itertuples(index=False):
+        print(f"  row {row.row_id}: expected {row.expected_paise / 100:,.2f}, "
+              f"statement says {row.reported_paise / 100:,.2f} ({row.difference_paise / 100:+,.2f})")
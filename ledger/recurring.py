@@ -0,0 +1,210 @@
+"""Recurring payments (bills, subscriptions, regular transfers) found in the ledger.
+
+Every row gets a normalized Counterparty: the narration lowercased with
+reference numbers and punctuation removed, so 'UPI/4521.../NETFLIX COM'
+and 'UPI/9934.../NETFLIX COM' group together. Rows are grouped by
+(Counterparty, direction) and, per group, NumPy computes the gaps between
+consecutive dates, the median gap (the period), the share of gaps close to
+it (regularity) and the coefficient of variation of the amounts. Groups
+that are regular enough are written to `recurring_series` with the next
+expected date and amount.
+
+Only rows without a Counterparty are new. update_recurring() fills them
+in and recomputes just the counterparties they touch, reading those
+groups through idx_counterparty.
+"""
+import os
+import sys
+import argparse
+
+import numpy as np
+import pandas as pd
+
+from ledger import accounts
+from ledger import aggregates
+from ledger import dedup
+from ledger import instrument
+from ledger import ordering
+from ledger import storage
+
+# A series needs this many payments ...
+MIN_OCCURRENCES = 3
+# ... at least this many days apart on average ...
+MIN_PERIOD_DAYS = 5
+# ... with this share of gaps within GAP_TOLERANCE of the period ...
+MIN_REGULARITY = 0.6
+GAP_TOLERANCE = 0.2
+MIN_GAP_TOLERANCE_DAYS = 3
+# ... and amounts this stable (std / mean); utility bills vary month to month
+MAX_AMOUNT_CV = 0.5
+# The next amount is the median of the last few payments
+RECENT_PAYMENTS = 3
+# Counterparties per IN (...) query
+QUERY_CHUNK = 500
+
+SERIES_TABLE_SQL = """
+CREATE TABLE IF NOT EXISTS recurring_series (
+    counterparty TEXT NOT NULL,
+    direction TEXT NOT NULL,
+    occurrences INTEGER NOT NULL,
+    first_date TEXT NOT NULL,
+    last_date TEXT NOT NULL,
+    period_days REAL NOT NULL,
+    regularity REAL NOT NULL,
+    typical_paise INTEGER NOT NULL,
+    amount_cv REAL NOT NULL,
+    next_date TEXT NOT NULL,
+    next_paise INTEGER NOT NULL,
+    PRIMARY KEY (counterparty, direction)
+)
+"""
+
+SERIES_COLUMNS = ['counterparty', 'direction', 'occurrences', 'first_date', 'last_date', 'period_days',
+                  'regularity', 'typical_paise', 'amount_cv', 'next_date', 'next_paise']
+
+def normalize_counterparty(narrations):
+    """Lowercase words of a narration without reference numbers or punctuation"""
+    text = pd.Series(narrations, dtype=object).fillna('').astype(str).str.lower()
+    text = text.str.replace(r'[a-z]*\d[\w]*', ' ', regex=True)   # refs, UPI ids, card numbers
+    text = text.str.replace(r'[^a-z]+', ' ', regex=True)
+    return text.str.strip()
+
+def ensure_recurring(conn, table='transactions'):
+    if 'Counterparty' not in storage.table_columns(conn, table):
+        conn.execute(f'ALTER TABLE "{table}" ADD COLUMN Counterparty TEXT')
+    conn.execute(f'CREATE INDEX IF NOT EXISTS idx_counterparty ON "{table}"(Counterparty, {ordering.DATE_KEY_COLUMN})')
+    conn.execute(SERIES_TABLE_SQL)
+
+def detect_series(rows):
+    """recurring_series rows from (Counterparty, is_debit, DateKey, paise) rows"""
+    rows = rows[(rows['Counterparty'] != '') & rows['DateKey'].notna()]
+    rows = rows.sort_values(['Counterparty', 'is_debit', 'DateKey'], kind='stable').reset_index(drop=True)
+    if rows.empty:
+        return pd.DataFrame(columns=SERIES_COLUMNS)
+
+    group, keys = pd.factorize(pd.MultiIndex.from_arrays([rows['Counterparty'], rows['is_debit']]))
+    days = rows['DateKey'].to_numpy().astype('datetime64[D]').astype('int64')
+    paise = np.abs(rows['paise'].to_numpy(dtype='int64'))
+    groups = len(keys)
+
+    occurrences = np.bincount(group, minlength=groups)
+    first = np.full(groups, np.iinfo('int64').max)
+    last = np.full(groups, np.iinfo('int64').min)
+    np.minimum.at(first, group, days)
+    np.maximum.at(last, group, days)
+
+    # Gaps between consecutive payments of the same group
+    same = group[1:] == group[:-1]
+    gap_group = group[1:][same]
+    gaps = np.diff(days)[same]
+    period = pd.Series(gaps).groupby(gap_group).median().reindex(range(groups)).to_numpy()
+    tolerance = np.maximum(period * GAP_TOLERANCE, MIN_GAP_TOLERANCE_DAYS)
+    on_time = np.abs(gaps - period[gap_group]) <= tolerance[gap_group]
+    regularity = np.bincount(gap_group, weights=on_time, minlength=groups) / np.maximum(occurrences - 1, 1)
+
+    mean = np.bincount(group, weights=paise, minlength=groups) / occurrences
+    square = np.bincount(group, weights=paise.astype('float64') ** 2, minlength=groups) / occurrences
+    cv = np.sqrt(np.maximum(square - mean ** 2, 0)) / np.maximum(mean, 1)
+    typical = pd.Series(paise).groupby(group).median().to_numpy()
+    from_end = pd.Series(group).groupby(group).cumcount(ascending=False).to_numpy()
+    is_recent = from_end < RECENT_PAYMENTS
+    recent = pd.Series(paise[is_recent]).groupby(group[is_recent]).median().to_numpy()
+
+    keep = ((occurrences >= MIN_OCCURRENCES) & (np.nan_to_num(period) >= MIN_PERIOD_DAYS)
+            & (regularity >= MIN_REGULARITY) & (cv <= MAX_AMOUNT_CV))
+    period = np.nan_to_num(period)
+    to_date = lambda values: np.datetime_as_string(values.astype('datetime64[D]'), unit='D')
+    return pd.DataFrame({
+        'counterparty': keys.get_level_values(0)[keep],
+        'direction': np.where(keys.get_level_values(1)[keep], 'debit', 'credit'),
+        'occurrences': occurrences[keep],
+        'first_date': to_date(first[keep]),
+        'last_date': to_date(last[keep]),
+        'period_days': period[keep],
+        'regularity': regularity[keep].round(3),
+        'typical_paise': typical[keep].round().astype('int64'),
+        'amount_cv': cv[keep].round(3),
+        'next_date': to_date(last[keep] + np.round(period[keep]).astype('int64')),
+        'next_paise': recent[keep].round().astype('int64'),
+    })
+
+def read_groups(conn, counterparties, table='transactions'):
+    """Rows of the given counterparties, looked up through idx_counterparty"""
+    columns = storage.table_columns(conn, table)
+    sign_col = aggregates.find_column(columns, aggregates.SIGN_COLUMNS)
+    parts = []
+    counterparties = sorted(counterparties)
+    for start in range(0, len(counterparties), QUERY_CHUNK):
+        chunk = counterparties[start:start + QUERY_CHUNK]
+        parts.append(pd.read_sql_query(f'''
+            SELECT Counterparty, "{sign_col}" AS sign, {ordering.DATE_KEY_COLUMN} AS DateKey,
+                   {storage.amount_paise_sql(columns)} AS paise
+            FROM "{table}" WHERE Counterparty IN ({', '.join('?' * len(chunk))})
+        ''', conn, params=chunk))
+    rows = pd.concat(parts, ignore_index=True) if parts else pd.DataFrame(columns=['Counterparty', 'sign', 'DateKey', 'paise'])
+    rows['is_debit'] = rows['sign'].isin(aggregates.DEBIT_SIGNS)
+    return rows
+
+def update_recurring(conn, table='transactions'):
+    """Give new rows a Counterparty and recompute the series they belong to; returns the number of new rows"""
+    ensure_recurring(conn, table)
+    columns = storage.table_columns(conn, table)
+    details_col = aggregates.find_column(columns, dedup.DETAILS_COLUMNS)
+
+    with instrument.stage('recurring'):
+        new = pd.read_sql_query(
+            f'SELECT rowid AS row_id, "{details_col}" AS narration FROM "{table}" WHERE Counterparty IS NULL', conn)
+        if new.empty:
+            return 0
+        new['Counterparty'] = normalize_counterparty(new['narration']).to_numpy()
+        conn.executemany(f'UPDATE "{table}" SET Counterparty = ? WHERE rowid = ?',
+                         new[['Counterparty', 'row_id']].astype(object).itertuples(index=False, name=None))
+
+        touched = sorted(set(new['Counterparty']) - {''})
+        series = detect_series(read_groups(conn, touched, table))
+        for start in range(0, len(touched), QUERY_CHUNK):
+            chunk = touched[start:start + QUERY_CHUNK]
+            conn.execute(f"DELETE FROM recurring_series WHERE counterparty IN ({', '.join('?' * len(chunk))})", chunk)
+        conn.executemany(f"INSERT INTO recurring_series VALUES ({', '.join('?' * len(SERIES_COLUMNS))})",
+                         series[SERIES_COLUMNS].astype(object).itertuples(index=False, name=None))
+
+    instrument.count('recurring_series', len(series))
+    return len(new)
+
+def print_series(conn):
+    series = pd.read_sql_query('SELECT * FROM recurring_series ORDER BY next_date', conn)
+    if series.empty:
+        print("No recurring payments found")
+        return
+    print(f"{len(series)} recurring payment(s):")
+    for row in series.itertuples(index=False):
+        print(f"  {row.counterparty[:40]:40} {row.direction:6} every {row.period_days:5.1f} days "
+              f"x{row.occurrences:<3} ~{aggregates.to_rupees(row.typical_paise):>10,.2f}  "
+              f"next {row.next_date} ~{aggregates.to_rupees(row.next_paise):,.2f}")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Update and show recurring payments per account")
+    parser.add_argument('accounts', nargs='*', help="Accounts to show (default: all)")
+    parser.add_argument('--db', action='append', metavar='ACCOUNT=PATH',
+                        help="Override the database path of an account")
+    args = parser.parse_args(argv)
+
+    db_paths = accounts.db_paths(accounts.parse_db_overrides(args.db))
+    for account in args.accounts or sorted(db_paths):
+        if account not in db_paths:
+            raise SystemExit(f"Unknown account: {account}")
+        if not os.path.exists(db_paths[account]):
+            print(f"[{account}] skipped: {db_paths[account]} not found")
+            continue
+        conn = storage.connect(db_paths[account])
+        try:
+            if update_recurring(conn):
+                storage.bump_version(conn)
+            conn.commit()
+            print(f"[{account}]")
+            print_series(conn)
+        finally:
+            conn.close()
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,163 @@
+"""Local HTTP/JSON service answering the ledger queries of every account.
+
+GET /<query>?account=<name> runs one of queries.QUERIES (summary, balance,
+monthly) against that account's database; without account= it runs for
+all of them, and GET /accounts lists the names. Database reads happen in a
+thread pool over read-only pooled connections while asyncio keeps many
+keep-alive clients open at once.
+
+Results are cached per (query, account) under the key (inode,
+data_version): the inode changes when a merge or rebuild swaps in a new
+file and the data version changes on every append, so a cached answer is
+never served after the database moved on. Concurrent requests for the
+same query and version are coalesced into a single read that they all
+await, as is the version check itself.
+"""
+import os
+import sys
+import json
+import asyncio
+import argparse
+from urllib.parse import urlsplit, parse_qs
+from concurrent.futures import ThreadPoolExecutor
+
+from ledger import accounts
+from ledger import queries
+from ledger import storage
+
+class NotFound(Exception):
+    pass
+
+class QueryService:
+    """Answer ledger queries from a thread pool, coalescing and caching results
+
+    A cached result is reused until the database's version counter (bumped
+    by every append) or the file itself (a merge writes a new file) changes.
+    """
+
+    def __init__(self, db_paths, workers=8):
+        self.db_paths = db_paths
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        self.inflight = {}
+        self.cache = {}
+
+    def _read(self, db_path, func):
+        conn = storage.connect(db_path, readonly=True)
+        try:
+            return func(conn)
+        finally:
+            conn.close()
+
+    def _version(self, db_path):
+        try:
+            inode = os.stat(db_path).st_ino
+        except OSError:
+            raise NotFound(f"Database not found: {db_path}")
+        return inode, self._read(db_path, storage.data_version)
+
+    async def _coalesced(self, key, func, *args):
+        """Run func in the thread pool once for all concurrent callers with the same key"""
+        task = self.inflight.get(key)
+        if task is None:
+            loop = asyncio.get_running_loop()
+            task = asyncio.ensure_future(loop.run_in_executor(self.executor, func, *args))
+            self.inflight[key] = task
+            task.add_done_callback(lambda _: self.inflight.pop(key, None))
+        return await asyncio.shield(task)
+
+    async def query(self, name, account):
+        if name not in queries.QUERIES:
+            raise NotFound(f"Unknown query: {name}")
+        if account not in self.db_paths:
+            raise NotFound(f"Unknown account: {account}")
+        db_path = self.db_paths[account]
+
+        version = await self._coalesced(('version', db_path), self._version, db_path)
+        cached = self.cache.get((name, account))
+        if cached is not None and cached[0] == version:
+            return cached[1]
+
+        result = await self._coalesced((name, account, version), self._read, db_path, queries.QUERIES[name])
+        self.cache[(name, account)] = (version, result)
+        return result
+
+    async def handle_path(self, target):
+        url = urlsplit(target)
+        name = url.path.strip('/')
+        params = parse_qs(url.query)
+        if name in ('', 'accounts'):
+            return {'accounts': sorted(self.db_paths)}
+
+        account = params.get('account', [None])[0]
+        if account is not None:
+            return await self.query(name, account)
+
+        names = sorted(self.db_paths)
+        results = await asyncio.gather(*(self.query(name, a) for a in names), return_exceptions=True)
+        return {a: (r if not isinstance(r, Exception) else {'error': str(r)}) for a, r in zip(names, results)}
+
+    async def handle_client(self, reader, writer):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                method, target, _ = request_line.decode('latin-1').split(' ', 2)
+                keep_alive = True
+                while True:
+                    header = await reader.readline()
+                    if header in (b'\r\n', b'\n', b''):
+                        break
+                    if header.lower().startswith(b'connection:') and b'close' in header.lower():
+                        keep_alive = False
+
+                if method != 'GET':
+                    status, body = '405 Method Not Allowed', {'error': 'Only GET is supported'}
+                else:
+                    try:
+                        status, body = '200 OK', await self.handle_path(target)
+                    except NotFound as e:
+                        status, body = '404 Not Found', {'error': str(e)}
+                    except Exception as e:
+                        status, body = '500 Internal Server Error', {'error': str(e)}
+
+                payload = json.dumps(body).encode('utf-8')
+                writer.write(
+                    f"HTTP/1.1 {status}\r\n"
+                    f"Content-Type: application/json\r\n"
+                    f"Content-Length: {len(payload)}\r\n"
+                    f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n".encode('latin-1') + payload
+                )
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, host, port):
+        server = await asyncio.start_server(self.handle_client, host, port, backlog=1024)
+        print(f"Serving ledger queries on http://{host}:{port}/ (accounts: {', '.join(sorted(self.db_paths))})")
+        async with server:
+            await server.serve_forever()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Local HTTP/JSON query service over the account databases")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--workers', type=int, default=8)
+    parser.add_argument('--db', action='append', metavar='ACCOUNT=PATH',
+                        help="Override the database path of an account")
+    args = parser.parse_args(argv)
+
+    service = QueryService(accounts.db_paths(accounts.parse_db_overrides(args.db)), workers=args.workers)
+    try:
+        asyncio.run(service.serve(args.host, args.port))
+    except KeyboardInterrupt:
+        print("Stopping...")
+    finally:
+        storage.close_all()
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,230 @@
+import os
+import pathlib
+import sqlite3
+import threading
+
+# Applied once when a pooled write connection is opened; read-only
+# connections leave the file's journal mode alone, so reading a database
+# never converts it to WAL or leaves -wal/-shm files next to it
+WRITE_PRAGMAS = [
+    ('journal_mode', 'WAL'),
+    ('synchronous', 'NORMAL'),
+]
+
+# Applied once when any pooled connection is opened
+PRAGMAS = [
+    ('mmap_size', 256 * 1024 * 1024),
+    ('cache_size', -32 * 1024),   # negative = KiB, i.e. 32 MB
+    ('temp_store', 'MEMORY'),
+    ('busy_timeout', 5000),
+]
+
+# Prepared statements kept per connection, keyed by SQL text
+STATEMENT_CACHE_SIZE = 256
+
+# Idle connections kept per database file
+POOL_SIZE = 4
+
+class PooledConnection(sqlite3.Connection):
+    """sqlite3 connection whose close() hands it back to its pool"""
+
+    pool = None
+    file_id = None
+
+    def close(self):
+        if self.pool is None:
+            super().close()
+        else:
+            self.pool.release(self)
+
+    def close_for_real(self):
+        super().close()
+
+class ConnectionPool:
+    """Reusable, pre-configured connections to a single database file"""
+
+    def __init__(self, db_path, size=POOL_SIZE, readonly=False):
+        self.db_path = db_path
+        self.size = size
+        self.readonly = readonly
+        self.idle = []
+        self.lock = threading.Lock()
+
+    def _open(self):
+        if self.readonly:
+            target, uri, pragmas = pathlib.Path(self.db_path).as_uri() + '?mode=ro', True, PRAGMAS
+        else:
+            target, uri, pragmas = self.db_path, False, WRITE_PRAGMAS + PRAGMAS
+        conn = sqlite3.connect(
+            target,
+            uri=uri,
+            factory=PooledConnection,
+            cached_statements=STATEMENT_CACHE_SIZE,
+            check_same_thread=False,
+        )
+        for name, value in pragmas:
+            conn.execute(f"PRAGMA {name}={value}")
+        conn.pool = self
+        conn.file_id = self._file_id()
+        return conn
+
+    def _file_id(self):
+        try:
+            return os.stat(self.db_path).st_ino
+        except OSError:
+            return None
+
+    def acquire(self):
+        # A rebuild swaps in a new file; connections opened on the old one would keep reading it
+        file_id = self._file_id()
+        with self.lock:
+            stale = [conn for conn in self.idle if conn.file_id != file_id]
+            self.idle = [conn for conn in self.idle if conn.file_id == file_id]
+            conn = self.idle.pop() if self.idle else None
+        for old in stale:
+            old.close_for_real()
+        return conn or self._open()
+
+    def release(self, conn):
+        # Same as closing a plain connection: uncommitted work is discarded
+        if conn.in_transaction:
+            conn.rollback()
+        with self.lock:
+            if len(self.idle) < self.size:
+                self.idle.append(conn)
+                return
+        conn.close_for_real()
+
+    def close_all(self):
+        with self.lock:
+            idle, self.idle = self.idle, []
+        for conn in idle[:-1]:
+            conn.close_for_real()
+        if idle:
+            # The last write connection folds the WAL back into the database,
+            # so SQLite removes the -wal/-shm files when it closes
+            if not self.readonly:
+                idle[-1].execute('PRAGMA wal_checkpoint(TRUNCATE)')
+            idle[-1].close_for_real()
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+def get_pool(db_path, readonly=False):
+    key = (os.path.abspath(db_path), readonly)
+    with _pools_lock:
+        if key not in _pools:
+            _pools[key] = ConnectionPool(key[0], readonly=readonly)
+        return _pools[key]
+
+def connect(db_path, readonly=False):
+    """Drop-in replacement for sqlite3.connect backed by the per-database pool
+
+    conn.close() returns the connection to the pool instead of closing it,
+    so the pragmas and the prepared statement cache survive between calls.
+    readonly=True opens the file with mode=ro for verify, query and report paths.
+    """
+    return get_pool(db_path, readonly).acquire()
+
+def close_pool(db_path):
+    """Really close the idle connections of one database (e.g. before deleting the file)
+
+    Read-only connections go first: one still open would keep the WAL files in place.
+    """
+    path = os.path.abspath(db_path)
+    with _pools_lock:
+        pools = [_pools.pop((path, readonly), None) for readonly in (True, False)]
+    for pool in pools:
+        if pool is not None:
+            pool.close_all()
+
+def close_all():
+    with _pools_lock:
+        # Read-only pools first, as in close_pool()
+        pools = sorted(_pools.values(), key=lambda pool: not pool.readonly)
+        _pools.clear()
+    for pool in pools:
+        pool.close_all()
+
+META_TABLE_SQL = "CREATE TABLE IF NOT EXISTS ledger_meta (key TEXT PRIMARY KEY, value NOT NULL)"
+
+def bump_version(conn):
+    """Record that the transactions changed so cached query results are dropped"""
+    conn.execute(META_TABLE_SQL)
+    conn.execute("""
+        INSERT INTO ledger_meta (key, value) VALUES ('version', 1)
+        ON CONFLICT(key) DO UPDATE SET value = value + 1
+    """)
+
+def data_version(conn):
+    """Counter bumped by every append; 0 for databases never written by these scripts"""
+    try:
+        row = conn.execute("SELECT value FROM ledger_meta WHERE key = 'version'").fetchone()
+    except sqlite3.OperationalError:
+        return 0
+    return row[0] if row else 0
+
+def get_meta(conn, key, default=None):
+    try:
+        row = conn.execute("SELECT value FROM ledger_meta WHERE key = ?", (key,)).fetchone()
+    except sqlite3.OperationalError:
+        return default
+    return row[0] if row else default
+
+def set_meta(conn, key, value):
+    conn.execute(META_TABLE_SQL)
+    conn.execute("""
+        INSERT INTO ledger_meta (key, value) VALUES (?, ?)
+        ON CONFLICT(key) DO UPDATE SET value = excluded.value
+    """, (key, value))
+
+def delete_meta(conn, *keys):
+    conn.execute(META_TABLE_SQL)
+    conn.executemany("DELETE FROM ledger_meta WHERE key = ?", [(key,) for key in keys])
+
+# Amounts are stored as integer paise next to the REAL Amount column
+AMOUNT_PAISE_COLUMN = 'AmountPaise'
+AMOUNT_TO_PAISE_SQL = 'CAST(ROUND(Amount * 100) AS INTEGER)'
+
+def table_columns(conn, table='transactions'):
+    return [row[1] for row in conn.execute(f'PRAGMA table_info("{table}")')]
+
+# One field, spelled differently by an account's create and merge scripts
+COLUMN_SPELLINGS = (
+    ('Date', 'TransactionDate'),
+    ('TransactionDetails', 'Transaction_Details'),
+    ('BillingAmountSign', 'BillingAmountSign-DR,CR'),
+)
+
+def match_columns(conn, df, table='transactions'):
+    """df with its columns renamed to the spelling the table uses for the same field"""
+    columns = table_columns(conn, table)
+    renames = {}
+    for spellings in COLUMN_SPELLINGS:
+        stored = next((name for name in spellings if name in columns), None)
+        renames.update({name: stored for name in spellings if stored and name != stored and name in df.columns})
+    return df.rename(columns=renames)
+
+def ensure_amount_paise(conn, table='transactions'):
+    """Add and backfill AmountPaise on databases written before it existed"""
+    if AMOUNT_PAISE_COLUMN not in table_columns(conn, table):
+        conn.execute(f'ALTER TABLE "{table}" ADD COLUMN {AMOUNT_PAISE_COLUMN} INTEGER')
+    conn.execute(f'UPDATE "{table}" SET {AMOUNT_PAISE_COLUMN} = {AMOUNT_TO_PAISE_SQL} WHERE {AMOUNT_PAISE_COLUMN} IS NULL')
+
+def amount_paise_sql(columns):
+    """SQL for a row's amount in paise, for tables with or without AmountPaise
+
+    Rows whose backfill was never committed still have a NULL AmountPaise.
+    """
+    if AMOUNT_PAISE_COLUMN in columns:
+        return f'COALESCE({AMOUNT_PAISE_COLUMN}, {AMOUNT_TO_PAISE_SQL})'
+    return AMOUNT_TO_PAISE_SQL
+
+# Native transaction id from the statement (TransID, UPI ref, ...), when it has one
+SOURCE_ID_COLUMN = 'SourceTxnId'
+
+def ensure_source_id(conn, table='transactions'):
+    """Add the indexed SourceTxnId column to databases written before it existed"""
+    if SOURCE_ID_COLUMN not in table_columns(conn, table):
+        conn.execute(f'ALTER TABLE "{table}" ADD COLUMN {SOURCE_ID_COLUMN} TEXT')
+    conn.execute(f'CREATE INDEX IF NOT EXISTS idx_source_txn ON "{table}"({SOURCE_ID_COLUMN})')
@@ -0,0 +1,270 @@
+"""Synthetic statements that follow each bank's real layout closely enough
+for the account scripts to parse them. Used by the benchmark harness.
+
+PDFs are written with a tiny built-in writer (Helvetica text plus ruled
+lines for table layouts) so no PDF library is needed.
+"""
+import random
+from datetime import date, timedelta
+
+PAGE_WIDTH = 595
+PAGE_HEIGHT = 842
+
+MERCHANTS = [
+    'Reliance Fresh', 'Mysuru Mylari Hotel', 'AMAZON PAY INDIA', 'SWIGGY BANGALORE',
+    'ZOMATO LTD', 'BPCL FUEL STATION', 'APOLLO PHARMACY', 'BIG BAZAAR', 'IRCTC E TICKET',
+    'DMART AVENUE SUPERMARTS', 'UBER INDIA', 'CULT FIT', 'MORE RETAIL', 'NETFLIX COM',
+]
+BILLS = ['Bill paid - Electricity', 'Bill paid - Water', 'Bill paid - FASTag', 'Mobile recharged']
+PAYMENT_NARRATIONS = ['PAYMENT RECEIVED - THANK YOU', 'REFUND', 'CASHBACK']
+
+def _escape(text):
+    return text.replace('\\', '\\\\').replace('(', '\\(').replace(')', '\\)')
+
+class PdfWriter:
+    """Stream a simple multi-page PDF to disk, one page at a time"""
+
+    def __init__(self, path):
+        self.f = open(path, 'wb')
+        self.offsets = {}
+        self.page_ids = []
+        self.next_id = 4    # 1 = catalog, 2 = page tree, 3 = font
+        self.f.write(b'%PDF-1.4\n%\xe2\xe3\xcf\xd3\n')
+        self._write_object(3, b'<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica /Encoding /WinAnsiEncoding >>')
+
+    def _write_object(self, obj_id, body):
+        self.offsets[obj_id] = self.f.tell()
+        self.f.write(f'{obj_id} 0 obj\n'.encode('latin-1') + body + b'\nendobj\n')
+
+    def add_page(self, texts, lines=(), font_size=8):
+        """texts: (x, y, string) tuples; lines: (x1, y1, x2, y2) rules"""
+        ops = []
+        if lines:
+            ops.append('0.5 w')
+            for x1, y1, x2, y2 in lines:
+                ops.append(f'{x1:.2f} {y1:.2f} m {x2:.2f} {y2:.2f} l S')
+        for x, y, text in texts:
+            ops.append(f'BT /F1 {font_size} Tf {x:.2f} {y:.2f} Td ({_escape(text)}) Tj ET')
+        stream = '\n'.join(ops).encode('latin-1', 'replace')
+
+        content_id, page_id = self.next_id, self.next_id + 1
+        self.next_id += 2
+        self._write_object(content_id, f'<< /Length {len(stream)} >>\nstream\n'.encode('latin-1') + stream + b'\nendstream')
+        self._write_object(page_id, (
+            f'<< /Type /Page /Parent 2 0 R /MediaBox [0 0 {PAGE_WIDTH} {PAGE_HEIGHT}] '
+            f'/Resources << /Font << /F1 3 0 R >> >> /Contents {content_id} 0 R >>'
+        ).encode('latin-1'))
+        self.page_ids.append(page_id)
+
+    def add_text_page(self, text_lines, font_size=9, left=40, top=800, leading=12):
+        self.add_page([(left, top - i * leading, line) for i, line in enumerate(text_lines)], font_size=font_size)
+
+    def close(self):
+        kids = ' '.join(f'{page_id} 0 R' for page_id in self.page_ids)
+        self._write_object(2, f'<< /Type /Pages /Kids [{kids}] /Count {len(self.page_ids)} >>'.encode('latin-1'))
+        self._write_object(1, b'<< /Type /Catalog /Pages 2 0 R >>')
+
+        xref_offset = self.f.tell()
+        size = self.next_id
+        self.f.write(f'xref\n0 {size}\n0000000000 65535 f \n'.encode('latin-1'))
+        for obj_id in range(1, size):
+            self.f.write(f'{self.offsets[obj_id]:010d} 00000 n \n'.encode('latin-1'))
+        self.f.write(f'trailer\n<< /Size {size} /Root 1 0 R >>\nstartxref\n{xref_offset}\n%%EOF\n'.encode('latin-1'))
+        self.f.close()
+
+def _transactions(rows, seed=0, start=date(2023, 4, 1)):
+    """Yield (date, narration, amount, is_credit) in date order, a few rows per day"""
+    rng = random.Random(seed)
+    day = start
+    left_today = rng.randint(1, 6)
+    for _ in range(rows):
+        if left_today == 0:
+            day += timedelta(days=rng.randint(1, 2))
+            left_today = rng.randint(1, 6)
+        left_today -= 1
+
+        roll = rng.random()
+        if roll < 0.08:
+            yield day, rng.choice(PAYMENT_NARRATIONS), round(rng.uniform(500, 50000), 2), True
+        elif roll < 0.25:
+            yield day, rng.choice(BILLS), float(rng.choice([100, 250, 499, 1250, 2016.6, 2085])), False
+        else:
+            yield day, rng.choice(MERCHANTS), round(rng.uniform(20, 8000), 2), False
+
+def _chunks(items, size):
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+def _card_header(transactions, date_format, previous_balance=0.0):
+    """Statement date, period, due date and totals lines of a card statement"""
+    start, end = transactions[0][0], transactions[-1][0]
+    due = sum(-amount if is_credit else amount for _, _, amount, is_credit in transactions) + previous_balance
+    suffix = ' CR' if due < 0 else ''
+    return [
+        f"Statement Date {end.strftime(date_format)}",
+        f"Statement Period {start.strftime(date_format)} to {end.strftime(date_format)}",
+        f"Payment Due Date {(end + timedelta(days=20)).strftime(date_format)}",
+        f"Previous Balance {previous_balance:,.2f}",
+        f"Total Amount Due {abs(due):,.2f}{suffix}",
+    ]
+
+def write_dbs_pdf(path, rows, seed=0, rows_per_page=55):
+    """DBS card statement: 'DD-MM-YYYY DETAILS 1,234.56[ CR]' lines"""
+    writer = PdfWriter(path)
+    transactions = list(_transactions(rows, seed))
+    header = _card_header(transactions, '%d-%m-%Y') if transactions else []
+    for page_rows in _chunks(transactions, rows_per_page):
+        lines = ['DBS Bank Credit Card Statement'] + header + ['Date Transaction Details Amount (INR)']
+        header = []
+        for day, narration, amount, is_credit in page_rows:
+            suffix = ' CR' if is_credit else ''
+            lines.append(f"{day.strftime('%d-%m-%Y')} {narration} {amount:,.2f}{suffix}")
+        writer.add_text_page(lines)
+    writer.close()
+
+def write_sbi_pdf(path, rows, seed=0, rows_per_page=55):
+    """SBI card statement: 'DD Mon YY DETAILS 1,234.00 D|C', date omitted for same-day rows"""
+    writer = PdfWriter(path)
+    transactions = list(_transactions(rows, seed))
+    header = _card_header(transactions, '%d %b %Y') if transactions else []
+    previous_day = None
+    for page_rows in _chunks(transactions, rows_per_page):
+        lines = ['SBI Card Statement'] + header + ['Date Transaction Details Amount ( ) ']
+        header = []
+        for day, narration, amount, is_credit in page_rows:
+            sign = 'C' if is_credit else 'D'
+            prefix = '' if day == previous_day else day.strftime('%d %b %y') + ' '
+            lines.append(f"{prefix}{narration.upper()} {amount:,.2f} {sign}")
+            previous_day = day
+        writer.add_text_page(lines)
+        previous_day = None    # each page restarts with a dated line
+    writer.close()
+
+def write_phonepe_pdf(path, rows, seed=0, rows_per_page=18):
+    """PhonePe statement: 'Mon DD, YYYY Paid to X Debit INR 120.00' plus id lines"""
+    rng = random.Random(seed + 1)
+    writer = PdfWriter(path)
+    for page_rows in _chunks(_transactions(rows, seed), rows_per_page):
+        lines = ['Transaction Statement', 'Date Transaction Details Type Amount']
+        for day, narration, amount, is_credit in page_rows:
+            if is_credit:
+                details, kind = f"Received from {rng.choice(MERCHANTS).title()}", 'Credit'
+            elif narration.startswith(('Bill', 'Mobile')):
+                details, kind = narration, 'Debit'
+            else:
+                details, kind = f"Paid to {narration.title()}", 'Debit'
+            lines.append(f"{day.strftime('%b %d, %Y')} {details} {kind} INR {amount:.2f}")
+            lines.append(f"Transaction ID T{day.strftime('%y%m%d')}{rng.randrange(10 ** 15):015d}")
+            lines.append(f"UTR No. {rng.randrange(10 ** 12):012d}")
+        writer.add_text_page(lines)
+    writer.close()
+
+ICICI_CA_COLUMNS = ['SrNo', 'TransID', 'ValueDate', 'TransactionDate', 'CheqNo',
+                    'TransactionRemarks', 'Withdrawal(Dr)', 'Deposit(Cr)', 'Balance']
+ICICI_CA_EDGES = [30, 60, 110, 160, 215, 255, 410, 465, 520, 575]
+
+def _icici_rows(rows, seed, opening_balance=250000.0):
+    """ICICI rows with a running balance, as printed on the statement"""
+    rng = random.Random(seed + 2)
+    balance = opening_balance
+    for sr_no, (day, narration, amount, is_credit) in enumerate(_transactions(rows, seed), 1):
+        balance = round(balance + amount if is_credit else balance - amount, 2)
+        yield {
+            'SrNo': sr_no,
+            'TransID': f"S{rng.randrange(10 ** 8):08d}",
+            'ValueDate': day,
+            'TransactionDate': day,
+            'CheqNo': '-' if rng.random() < 0.97 else f"{rng.randrange(10 ** 6):06d}",
+            'Remarks': f"UPI/{rng.randrange(10 ** 12):012d}/{narration}",
+            'Withdrawal': 0.0 if is_credit else amount,
+            'Deposit': amount if is_credit else 0.0,
+            'Balance': balance,
+        }
+
+def write_icici_ca_pdf(path, rows, seed=0, rows_per_page=40):
+    """ICICI current account statement: ruled table read with extract_tables()"""
+    writer = PdfWriter(path)
+    row_height = 18
+    top = 800
+    for page_rows in _chunks(_icici_rows(rows, seed), rows_per_page):
+        table = [ICICI_CA_COLUMNS]
+        for r in page_rows:
+            table.append([
+                str(r['SrNo']), r['TransID'], r['ValueDate'].strftime('%d/%m/%Y'),
+                r['TransactionDate'].strftime('%d-%b-%Y'), r['CheqNo'], r['Remarks'][:40],
+                f"{r['Withdrawal']:.2f}" if r['Withdrawal'] else '0.00',
+                f"{r['Deposit']:.2f}" if r['Deposit'] else '0.00',
+                f"{r['Balance']:.2f}",
+            ])
+        bottom = top - row_height * len(table)
+        lines = [(ICICI_CA_EDGES[0], top - i * row_height, ICICI_CA_EDGES[-1], top - i * row_height)
+                 for i in range(len(table) + 1)]
+        lines += [(x, top, x, bottom) for x in ICICI_CA_EDGES]
+        texts = []
+        for i, cells in enumerate(table):
+            y = top - (i + 1) * row_height + 6
+            for x, cell in zip(ICICI_CA_EDGES, cells):
+                texts.append((x + 2, y, cell))
+        writer.add_page(texts, lines, font_size=5)
+    writer.close()
+
+def write_icici_sa_excel(path, rows, seed=0):
+    """ICICI savings account statement sheet: preamble rows, then the transaction table
+
+    The bank ships legacy .xls; pandas cannot write that format, so this
+    writes the same sheet layout as .xlsx (read_excel handles both).
+    """
+    import pandas as pd
+
+    records = [{
+        'S No.': r['SrNo'],
+        'Value Date': r['ValueDate'].strftime('%d/%m/%Y'),
+        'Transaction Date': r['TransactionDate'].strftime('%d/%m/%Y'),
+        'Cheque Number': r['CheqNo'],
+        'Transaction Remarks': r['Remarks'],
+        'Withdrawal Amount (INR )': r['Withdrawal'],
+        'Deposit Amount (INR )': r['Deposit'],
+        'Balance (INR )': r['Balance'],
+    } for r in _icici_rows(rows, seed)]
+    with pd.ExcelWriter(path) as writer:
+        pd.DataFrame([['DETAILED STATEMENT'], ['Account XXXXXXXX0090']]).to_excel(
+            writer, sheet_name='OpTransactionHistory', header=False, index=False)
+        pd.DataFrame(records).to_excel(writer, sheet_name='OpTransactionHistory', startrow=3, index=False)
+
+def write_paytm_excel(path, rows, seed=0):
+    """Paytm UPI passbook export ('Passbook Payment History' sheet)"""
+    import pandas as pd
+
+    rng = random.Random(seed + 3)
+    records = []
+    for day, narration, amount, is_credit in _transactions(rows, seed):
+        details = f"Received from {rng.choice(MERCHANTS).title()}" if is_credit else f"Paid to {narration.title()}"
+        records.append({
+            'Date': day.strftime('%d/%m/%Y'),
+            'Time': f"{rng.randrange(24):02d}:{rng.randrange(60):02d}:{rng.randrange(60):02d}",
+            'Transaction Details': details,
+            'Your Account': 'State Bank Of India - 47',
+            'Amount': f"{'+' if is_credit else '-'}{amount:,.2f}",
+            'UPI Ref No.': f"{rng.randrange(10 ** 12):012d}",
+            'Order ID': f"{rng.randrange(10 ** 18):018d}",
+            'Remarks': '',
+            'Tags': '#Others',
+            'Comment': '',
+        })
+    with pd.ExcelWriter(path) as writer:
+        pd.DataFrame(records).to_excel(writer, sheet_name='Passbook Payment History', index=False)
+
+GENERATORS = {
+    'dbs': (write_dbs_pdf, '.pdf'),
+    'sbi': (write_sbi_pdf, '.pdf'),
+    'phonepe': (write_phonepe_pdf, '.pdf'),
+    'icici_ca': (write_icici_ca_pdf, '.pdf'),
+    'icici_sa': (write_icici_sa_excel, '.xlsx'),
+    'paytm': (write_paytm_excel, '.xlsx'),
+}
@@ -0,0 +1,166 @@
+"""One writer thread per database, committing queued writes in groups.
+
+Parser workers extract rows on their own threads and submit() the write
+(dedup against the stored rows, insert, checks, version bump) as a job.
+The database's writer thread takes jobs off a bounded queue and runs
+as many as arrive within GROUP_DELAY, up to GROUP_ROWS rows, inside one
+BEGIN IMMEDIATE ... COMMIT, each job in its own savepoint so a failing
+job is rolled back alone. So in-process writers never contend for
+SQLite's write lock, a job always sees the rows of the jobs before it
+(no duplicates from two overlapping statements parsed at once), and a
+burst of statements costs one commit. A full queue blocks submit(),
+which holds producers back instead of buffering their rows.
+
+Writers in other processes are waited for through busy_timeout; a group
+that still finds the database locked is retried LOCK_RETRIES times. Any
+other failure of a group (the connection, BEGIN or COMMIT itself) rolls it
+back and fails every job in it; the thread carries on with the next group.
+"""
+import os
+import time
+import queue
+import sqlite3
+import threading
+from concurrent.futures import Future
+
+from ledger import atomic
+from ledger import instrument
+from ledger import storage
+
+QUEUE_SIZE = 32
+# A group closes at this many rows, or this many seconds after its first job
+GROUP_ROWS = 50000
+GROUP_DELAY = 0.05
+LOCK_RETRIES = 5
+RETRY_PAUSE = 0.5
+
+_STOP = object()
+
+class GroupCommitWriter:
+    """Single writer thread for one database file"""
+
+    def __init__(self, db_path, queue_size=QUEUE_SIZE, group_rows=GROUP_ROWS, group_delay=GROUP_DELAY):
+        self.db_path = db_path
+        self.group_rows = group_rows
+        self.group_delay = group_delay
+        self.jobs = queue.Queue(maxsize=queue_size)
+        self.thread = threading.Thread(target=self.run, name=f"writer-{os.path.basename(db_path)}", daemon=True)
+        self.thread.start()
+
+    def submit(self, job, rows=0):
+        """Queue job(conn) and return a Future of its result; blocks while the queue is full"""
+        future = Future()
+        self.jobs.put((job, rows, future))
+        return future
+
+    def write(self, job, rows=0):
+        """submit() and wait for the job's group to commit"""
+        return self.submit(job, rows).result()
+
+    def next_group(self, first):
+        """Jobs arriving within group_delay of the first, up to group_rows rows; also whether to stop"""
+        group, rows = [first], first[1]
+        deadline = time.monotonic() + self.group_delay
+        while rows < self.group_rows:
+            timeout = deadline - time.monotonic()
+            try:
+                item = self.jobs.get(timeout=timeout) if timeout > 0 else self.jobs.get_nowait()
+            except queue.Empty:
+                break
+            if item is _STOP:
+                return group, True
+            group.append(item)
+            rows += item[1]
+        return group, False
+
+    def run(self):
+        stopping = False
+        while not stopping:
+            first = self.jobs.get()
+            if first is _STOP:
+                break
+            group = [first]
+            try:
+                group, stopping = self.next_group(first)
+                self.commit_group(group)
+            except Exception as e:
+                # One bad group must not take the database's writer down with it
+                print(f"Writer for {self.db_path} dropped a group: {e}")
+                for _, _, future in group:
+                    if not future.done():
+                        future.set_exception(e)
+        storage.close_pool(self.db_path)
+
+    def commit_group(self, group):
+        results = None
+        for attempt in range(LOCK_RETRIES + 1):
+            conn = None
+            try:
+                conn = storage.connect(self.db_path)
+                with instrument.stage('group_commit'):
+                    conn.execute('BEGIN IMMEDIATE')
+                    results = [self.run_job(conn, job) for job, _, _ in group]
+                    conn.commit()
+                break
+            except Exception as e:
+                rollback(conn)
+                # Only a lock held by another process past busy_timeout is worth another try
+                locked = isinstance(e, sqlite3.OperationalError) and 'locked' in str(e)
+                if not locked or attempt == LOCK_RETRIES:
+                    results = [(None, e)] * len(group)
+                    break
+                print(f"{self.db_path} is locked by another process, retrying")
+                time.sleep(RETRY_PAUSE * (attempt + 1))
+            finally:
+                if conn is not None:
+                    conn.close()
+        instrument.count('write_groups')
+        instrument.count('write_jobs', len(group))
+        for (_, _, future), (result, error) in zip(group, results):
+            if error is None:
+                future.set_result(result)
+            else:
+                future.set_exception(error)
+
+    def run_job(self, conn, job):
+        """(result, None) or (None, exception); a failed job leaves nothing behind"""
+        try:
+            with atomic.savepoint(conn, 'ledger_job'):
+                return job(conn), None
+        except sqlite3.OperationalError as e:
+            if 'locked' in str(e):
+                raise
+            return None, e
+        except Exception as e:
+            return None, e
+
+    def close(self):
+        """Finish the queued jobs and stop the thread"""
+        self.jobs.put(_STOP)
+        self.thread.join()
+
+def rollback(conn):
+    """Roll back a failed group; an error here is dropped, the group's own error is what its jobs get"""
+    try:
+        if conn is not None and conn.in_transaction:
+            conn.rollback()
+    except sqlite3.Error:
+        pass
+
+_writers = {}
+_writers_lock = threading.Lock()
+
+def get_writer(db_path):
+    """The writer of a database file, started on first use"""
+    key = os.path.abspath(db_path)
+    with _writers_lock:
+        if key not in _writers:
+            _writers[key] = GroupCommitWriter(key)
+        return _writers[key]
+
+def close_all():
+    with _writers_lock:
+        writers = list(_writers.values())
+        _writers.clear()
+    for writer in writers:
+        writer.close()
@@ -0,0 +1,80 @@
+import os
+import sys
+import shutil
+import sqlite3
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from ledger import accounts
+from ledger import cycles
+from ledger import daemon
+from ledger import pagecache
+from ledger import storage
+from ledger import synthetic
+from ledger import writer
+
+# Synthetic statement format and a file name the daemon routes to each account
+STATEMENTS = {
+    'DBS_CC_2009': ('dbs', 'statement_dbs'),
+    'ICICI_CA_1849': ('icici_ca', 'statement_1849'),
+    'ICICI_SA_0090': ('icici_sa', 'statement_0090'),
+    'PaytmTransactions': ('paytm', 'statement_paytm'),
+    'PhonePeTransaction': ('phonepe', 'statement_phonepe'),
+    'SBI_CC_7670': ('sbi', 'statement_sbi'),
+}
+STORED_ROWS = 30
+STATEMENT_ROWS = 45
+
+class ProcessFileTest(unittest.TestCase):
+    """A statement overlapping the stored one goes through process_file into a database built by the create script"""
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.watch_dir = os.path.join(self.dir, 'drop')
+        os.makedirs(self.watch_dir)
+        self.cache_path = pagecache.CACHE_PATH
+        pagecache.configure(None)
+        db_paths = {account: os.path.join(self.dir, f"{account}.db") for account in accounts.ACCOUNTS}
+        self.daemon = daemon.IngestionDaemon(self.watch_dir, db_paths=db_paths)
+
+    def tearDown(self):
+        writer.close_all()
+        storage.close_all()
+        pagecache.configure(self.cache_path)
+        shutil.rmtree(self.dir)
+
+    def create_database(self, account, path):
+        config = accounts.ACCOUNTS[account]
+        script = accounts.load_module(config['create'])
+        transactions = getattr(script, config['extract'])(path)
+        if config['statement']:
+            script.create_database(transactions, self.daemon.db_path(account), cycles.read_statement(path))
+        else:
+            script.create_database(transactions, self.daemon.db_path(account))
+        storage.close_pool(self.daemon.db_path(account))
+
+    def stored_rows(self, account):
+        conn = sqlite3.connect(self.daemon.db_path(account))
+        try:
+            return conn.execute('SELECT COUNT(*) FROM transactions').fetchone()[0]
+        finally:
+            conn.close()
+
+    def test_every_routed_account_appends_its_create_format(self):
+        for account, (kind, name) in STATEMENTS.items():
+            with self.subTest(account=account):
+                generate, extension = synthetic.GENERATORS[kind]
+                first = os.path.join(self.dir, name + '_first' + extension)
+                generate(first, STORED_ROWS)
+                self.create_database(account, first)
+
+                # The same days again plus new ones: only the new rows are stored
+                path = os.path.join(self.watch_dir, name + extension)
+                generate(path, STATEMENT_ROWS)
+                self.assertEqual(accounts.route_file(path, self.watch_dir), account)
+                self.assertTrue(self.daemon.process_file(path))
+                self.assertEqual(self.stored_rows(account), STATEMENT_ROWS)
+
+if __name__ == '__main__':
+    unittest.main()
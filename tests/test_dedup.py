@@ -0,0 +1,70 @@
+import os
+import sys
+import sqlite3
+import unittest
+
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from ledger import amounts
+from ledger import dedup
+from ledger import ordering
+from ledger import storage
+
+def frame(rows):
+    df = pd.DataFrame(rows, columns=['Date', 'TransactionDetails', 'Amount', 'BillingAmountSign', 'SourceTxnId'])
+    return amounts.add_paise_column(df)
+
+STORED = frame([
+    ('01-Jan-24', 'UPI/NETFLIX COM', 649.0, '-', 'T1'),
+    ('01-Jan-24', 'FASTAG CHARGE', 100.0, '-', None),
+    ('01-Jan-24', 'FASTAG CHARGE', 100.0, '-', None),
+    ('02-Jan-24', 'SALARY ACME LTD', 50000.0, '+', None),
+    ('03-Jan-24', 'SWIGGY ORDER', 250.0, '-', 'T9'),
+])
+
+INCOMING = frame([
+    ('01-Jan-24', 'UPI/NETFLIX COM', 649.0, '-', 'T1'),          # same id
+    ('01-Jan-24', 'FASTAG  CHARGE', 100.0, '-', None),           # near-duplicate
+    ('01-Jan-24', 'FASTAG CHARGE', 100.0, '-', None),
+    ('01-Jan-24', 'FASTAG CHARGE', 100.0, '-', None),            # a third, new charge
+    ('02-Jan-24', 'SALARY ACME LT', 50000.0, '+', None),         # truncated narration
+    ('03-Jan-24', 'SWIGGY ORDER', 250.0, '-', 'T10'),            # same content, other id
+    ('04-Jan-24', 'NEW PAYMENT', 10.0, '-', None),
+])
+
+class FindStoredDuplicatesTest(unittest.TestCase):
+
+    def setUp(self):
+        self.conn = sqlite3.connect(':memory:')
+        stored = ordering.add_order_columns(STORED.copy(), 'Date')
+        stored.to_sql('transactions', self.conn, index=False)
+        storage.ensure_source_id(self.conn)
+        ordering.ensure_order_columns(self.conn)
+        dedup.ensure_dedup_index(self.conn)
+
+    def tearDown(self):
+        self.conn.close()
+
+    def test_matches_the_in_memory_comparison(self):
+        expected = dedup.find_duplicates(STORED, INCOMING)
+        found = dedup.find_stored_duplicates(self.conn, INCOMING)
+        self.assertEqual(found.tolist(), expected.tolist())
+        self.assertEqual(found.tolist(), [True, True, True, False, True, False, False])
+
+    def test_reads_only_the_candidate_rows(self):
+        candidates = dedup.stored_candidates(self.conn, INCOMING.iloc[[4]])
+        self.assertEqual(candidates['TransactionDetails'].tolist(), ['SALARY ACME LTD'])
+
+    def test_lookups_use_the_indexes(self):
+        plans = {
+            'idx_source_txn': f"SELECT 1 FROM transactions WHERE {storage.SOURCE_ID_COLUMN} IN ('T1')",
+            'idx_dedup': f"SELECT 1 FROM transactions WHERE {dedup.BLOCK_WHERE}",
+        }
+        for index, sql in plans.items():
+            params = () if '?' not in sql else ('2024-01-01', 100)
+            plan = ' '.join(str(row[-1]) for row in self.conn.execute('EXPLAIN QUERY PLAN ' + sql, params))
+            self.assertIn(index, plan)
+
+if __name__ == '__main__':
+    unittest.main()
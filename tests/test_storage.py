@@ -0,0 +1,45 @@
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from ledger import storage
+
+class ClosePoolTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.db_path = os.path.join(self.dir, 'test.db')
+
+    def tearDown(self):
+        storage.close_all()
+        shutil.rmtree(self.dir)
+
+    def wal_files(self):
+        return [name for name in os.listdir(self.dir) if name.endswith(('-wal', '-shm'))]
+
+    def write_and_read(self):
+        conn = storage.connect(self.db_path)
+        conn.execute('CREATE TABLE t (value TEXT)')
+        conn.execute("INSERT INTO t VALUES ('a')")
+        conn.commit()
+        reader = storage.connect(self.db_path, readonly=True)
+        self.assertEqual(reader.execute('SELECT value FROM t').fetchall(), [('a',)])
+        reader.close()
+        conn.close()
+        self.assertTrue(self.wal_files())
+
+    def test_close_pool_leaves_no_wal_files(self):
+        self.write_and_read()
+        storage.close_pool(self.db_path)
+        self.assertEqual(self.wal_files(), [])
+
+    def test_close_all_leaves_no_wal_files(self):
+        self.write_and_read()
+        storage.close_all()
+        self.assertEqual(self.wal_files(), [])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,69 @@
+import os
+import sys
+import shutil
+import sqlite3
+import tempfile
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from ledger import storage
+from ledger import writer
+
+def insert(value):
+    return lambda conn: conn.execute('INSERT INTO t VALUES (?)', (value,)).rowcount
+
+class GroupCommitWriterTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.db_path = os.path.join(self.dir, 'test.db')
+        conn = sqlite3.connect(self.db_path)
+        conn.execute('CREATE TABLE t (value TEXT)')
+        conn.commit()
+        conn.close()
+        self.writer = writer.GroupCommitWriter(self.db_path, group_delay=0)
+
+    def tearDown(self):
+        self.writer.close()
+        storage.close_all()
+        shutil.rmtree(self.dir)
+
+    def stored(self):
+        conn = sqlite3.connect(self.db_path)
+        try:
+            return [value for (value,) in conn.execute('SELECT value FROM t ORDER BY rowid')]
+        finally:
+            conn.close()
+
+    def test_failed_commit_fails_the_group_and_the_writer_carries_on(self):
+        with mock.patch.object(storage.PooledConnection, 'commit', side_effect=sqlite3.DatabaseError('disk I/O error')):
+            future = self.writer.submit(insert('lost'), rows=1)
+            with self.assertRaises(sqlite3.DatabaseError):
+                future.result(timeout=10)
+        self.assertEqual(self.writer.write(insert('kept'), rows=1), 1)
+        self.assertTrue(self.writer.thread.is_alive())
+        self.assertEqual(self.stored(), ['kept'])
+
+    def test_error_outside_the_commit_does_not_stop_the_thread(self):
+        with mock.patch.object(self.writer, 'commit_group', side_effect=RuntimeError('boom')):
+            future = self.writer.submit(insert('lost'), rows=1)
+            with self.assertRaises(RuntimeError):
+                future.result(timeout=10)
+        self.assertEqual(self.writer.write(insert('kept'), rows=1), 1)
+        self.assertEqual(self.stored(), ['kept'])
+
+    def test_failing_job_is_rolled_back_alone(self):
+        def fail(conn):
+            conn.execute("INSERT INTO t VALUES ('partial')")
+            raise ValueError('bad statement')
+        futures = [self.writer.submit(insert('a'), rows=1), self.writer.submit(fail, rows=1),
+                   self.writer.submit(insert('b'), rows=1)]
+        self.assertEqual(futures[0].result(timeout=10), 1)
+        with self.assertRaises(ValueError):
+            futures[1].result(timeout=10)
+        self.assertEqual(futures[2].result(timeout=10), 1)
+        self.assertEqual(self.stored(), ['a', 'b'])
+
+if __name__ == '__main__':
+    unittest.main()